@@ -0,0 +1,104 @@
+# functions/benchmarks/ancestry_bench.py
+"""
+Times chat history loading (_fetch_message_ancestry) against the old full-chat scan.
+
+Seeds a chat with a parent chain of --chain messages plus --other-messages on unrelated
+branches, then loads the leaf's ancestry with each MAX_PARENT_WALK_BEFORE_SCAN value in
+--walk-limits (0 reproduces the old loader, which streamed the whole chat). It does this once
+for chains whose messages carry `ancestorMessageIds` and once for legacy chains without it.
+The seeded chat is deleted afterwards. Run from functions/ against the emulator:
+
+    FIRESTORE_EMULATOR_HOST=localhost:8080 GCLOUD_PROJECT=demo-bench \\
+        python -m benchmarks.ancestry_bench --chain 40 --other-messages 400
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from common.core import db, close_async_db
+import handlers.vertex.task as task_module
+from benchmarks.timing import require_firestore_target, summarize
+
+
+def seed_chat(chat_id: str, chain_length: int, other_messages: int, with_ancestor_ids: bool) -> str:
+    """Writes the chat's messages and returns the leaf message ID."""
+    messages = db.collection("chats").document(chat_id).collection("messages")
+    batch, pending, ancestors, leaf_id = db.batch(), 0, [], None
+    for index in range(chain_length + other_messages):
+        on_chain = index < chain_length
+        message_id = f"{'chain' if on_chain else 'other'}-{index:05d}"
+        data = {
+            "id": message_id,
+            "parts": [{"type": "text", "content": f"Message {index}: " + "lorem ipsum " * 40}],
+            "participant": "user:benchmark" if index % 2 == 0 else "model:benchmark",
+            # Off-chain messages hang off the root, so a full scan reads them but the walk does not.
+            "parentMessageId": (ancestors[-1] if ancestors else None) if on_chain else "chain-00000",
+        }
+        if with_ancestor_ids:
+            data["ancestorMessageIds"] = list(ancestors) if on_chain else ["chain-00000"]
+        batch.set(messages.document(message_id), data)
+        if on_chain:
+            ancestors.append(message_id)
+            leaf_id = message_id
+        pending += 1
+        if pending == 400:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    return leaf_id
+
+
+def delete_chat(chat_id: str):
+    messages = db.collection("chats").document(chat_id).collection("messages")
+    while True:
+        docs = list(messages.limit(400).stream())
+        if not docs:
+            break
+        batch = db.batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+        batch.commit()
+
+
+async def time_loads(chat_id: str, leaf_id: str, walk_limit: int, repeat: int) -> tuple[list[float], int]:
+    task_module.MAX_PARENT_WALK_BEFORE_SCAN = walk_limit
+    samples, loaded = [], 0
+    try:
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            message_ids, _ = await task_module._fetch_message_ancestry(chat_id, leaf_id)
+            samples.append((time.perf_counter() - started_at) * 1000)
+            loaded = len(message_ids)
+    finally:
+        await close_async_db()
+    return samples, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chain", type=int, default=40, help="Messages on the leaf's parent chain.")
+    parser.add_argument("--other-messages", type=int, default=400, help="Messages on other branches of the same chat.")
+    parser.add_argument("--walk-limits", type=int, nargs="+", default=[0, 10, 50, 200], help="MAX_PARENT_WALK_BEFORE_SCAN values to compare.")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    require_firestore_target()
+
+    original_limit = task_module.MAX_PARENT_WALK_BEFORE_SCAN
+    for with_ancestor_ids in (True, False):
+        chat_id = f"benchmark-{uuid.uuid4().hex[:12]}"
+        leaf_id = seed_chat(chat_id, args.chain, args.other_messages, with_ancestor_ids)
+        print(f"\n{'With' if with_ancestor_ids else 'Without'} ancestorMessageIds: chain {args.chain}, chat size {args.chain + args.other_messages}")
+        try:
+            for walk_limit in args.walk_limits:
+                samples, loaded = asyncio.run(time_loads(chat_id, leaf_id, walk_limit, args.repeat))
+                label = "full scan (old loader)" if walk_limit == 0 else f"walk limit {walk_limit}"
+                print(f"  {label:<24} {loaded:>5} messages  {summarize(samples)}")
+        finally:
+            task_module.MAX_PARENT_WALK_BEFORE_SCAN = original_limit
+            delete_chat(chat_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# functions/benchmarks/model_prefetch_bench.py
+"""
+Times model-config resolution for an agent tree: one batched get_all (the prefetch done by
+instantiate_adk_agent_from_config) against one read per Agent/LoopAgent node, which is what
+the recursive instantiation did before the prefetch.
+
+Seeds --models model documents and a SequentialAgent of --leaves Agent children that reference
+them round-robin (so with more leaves than models, IDs repeat as they do in real trees). The
+seeded documents are deleted afterwards. Run from functions/ against the emulator:
+
+    FIRESTORE_EMULATOR_HOST=localhost:8080 GCLOUD_PROJECT=demo-bench \\
+        python -m benchmarks.model_prefetch_bench --models 4 --leaves 12
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from common.core import db, close_async_db
+from common.adk_helpers import (
+    collect_model_ids, get_model_config_from_firestore, get_model_configs_from_firestore, _iter_agent_configs,
+)
+from benchmarks.timing import require_firestore_target, summarize
+
+
+def build_agent_config(model_ids: list[str], leaves: int) -> dict:
+    return {
+        "name": "benchmark_root",
+        "agentType": "SequentialAgent",
+        "childAgents": [
+            {"name": f"leaf_{index}", "agentType": "Agent", "modelId": model_ids[index % len(model_ids)]}
+            for index in range(leaves)
+        ],
+    }
+
+
+async def per_node_reads(agent_config: dict):
+    for config in _iter_agent_configs(agent_config):
+        if config.get("agentType") in ("Agent", "LoopAgent"):
+            await get_model_config_from_firestore(config["modelId"])
+
+
+async def batched_prefetch(agent_config: dict):
+    await get_model_configs_from_firestore(collect_model_ids(agent_config))
+
+
+async def time_strategy(strategy, agent_config: dict, repeat: int) -> list[float]:
+    samples = []
+    try:
+        await strategy(agent_config)  # Warm-up: channel setup is not part of either strategy.
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            await strategy(agent_config)
+            samples.append((time.perf_counter() - started_at) * 1000)
+    finally:
+        await close_async_db()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", type=int, default=4, help="Distinct model documents.")
+    parser.add_argument("--leaves", type=int, default=12, help="Agent nodes in the tree.")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    require_firestore_target()
+
+    prefix = f"benchmark-{uuid.uuid4().hex[:8]}"
+    model_ids = [f"{prefix}-{index}" for index in range(args.models)]
+    for model_id in model_ids:
+        db.collection("models").document(model_id).set({"provider": "openai", "modelString": "gpt-4o-mini", "temperature": 0})
+    agent_config = build_agent_config(model_ids, args.leaves)
+    try:
+        per_node = asyncio.run(time_strategy(per_node_reads, agent_config, args.repeat))
+        batched = asyncio.run(time_strategy(batched_prefetch, agent_config, args.repeat))
+    finally:
+        for model_id in model_ids:
+            db.collection("models").document(model_id).delete()
+    print(f"{args.leaves} Agent nodes, {args.models} distinct models")
+    print(f"  one read per node  {summarize(per_node)}")
+    print(f"  batched prefetch   {summarize(batched)}")
+
+
+if __name__ == "__main__":
+    main()
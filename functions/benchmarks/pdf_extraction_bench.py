@@ -0,0 +1,94 @@
+# functions/benchmarks/pdf_extraction_bench.py
+"""
+Compares serial PDF text extraction against the process pool in common.pdf_extraction.
+
+Generates a synthetic text PDF (or uses --source, a local path or gs:// URI) and times
+extract_pdf_text for each worker count, cold (pool spawned inside the timing) and warm
+(pool already running). Run from functions/:
+
+    python -m benchmarks.pdf_extraction_bench --pages 400 --workers 1 2 4
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from common import pdf_extraction
+
+LOREM = ("Agent configuration documents describe models, tools and child agents. "
+         "Each run flattens the chat history into a prompt within the token budget. ")
+
+
+def build_text_pdf(path: str, pages: int, lines_per_page: int = 45):
+    """Writes a minimal, valid PDF with `pages` pages of Helvetica text."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_number in range(1, pages + 1):
+        lines = [f"Page {page_number} line {line}: {LOREM}"[:110] for line in range(lines_per_page)]
+        text_ops = " ".join(f"({line}) Tj T*" for line in lines)
+        stream = f"BT /F1 9 Tf 11 TL 36 806 Td {text_ops} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(page_ids))
+
+    body, offsets = bytearray(b"%PDF-1.4\n"), []
+    for object_id, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += b"%d 0 obj\n%s\nendobj\n" % (object_id, obj)
+    xref_offset = len(body)
+    body += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    body += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    body += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, "wb") as pdf_file:
+        pdf_file.write(body)
+
+
+def reset_pool(workers: int):
+    if pdf_extraction._pool is not None:
+        pdf_extraction._pool.shutdown(wait=True)
+        pdf_extraction._pool = None
+    pdf_extraction.PDF_EXTRACTION_WORKERS = workers
+
+
+def time_extraction(source: str, max_chars: int) -> tuple[float, int]:
+    started_at = time.perf_counter()
+    text = pdf_extraction.extract_pdf_text(source, max_chars)
+    return (time.perf_counter() - started_at) * 1000, len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400, help="Pages in the synthetic PDF.")
+    parser.add_argument("--source", help="Existing PDF path or gs:// URI to use instead of a synthetic one.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to compare (1 = serial).")
+    parser.add_argument("--max-chars", type=int, default=10 ** 9, help="Extraction budget; the default extracts every page.")
+    parser.add_argument("--repeat", type=int, default=3, help="Warm runs per worker count.")
+    args = parser.parse_args()
+
+    temp_path = None
+    source = args.source
+    if source is None:
+        temp_file = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+        temp_file.close()
+        source = temp_path = temp_file.name
+        build_text_pdf(source, args.pages)
+        print(f"Synthetic PDF: {args.pages} pages, {os.path.getsize(source) / 1024:.0f} KiB")
+    print(f"CPUs: {os.cpu_count()}, pages per task: {pdf_extraction.PDF_PAGES_PER_TASK}")
+    print(f"{'workers':>7} {'cold ms':>9} {'warm ms (median)':>17} {'chars':>10}")
+    try:
+        for workers in args.workers:
+            reset_pool(workers)
+            cold_ms, characters = time_extraction(source, args.max_chars)
+            warm_ms = statistics.median(time_extraction(source, args.max_chars)[0] for _ in range(args.repeat))
+            print(f"{workers:>7} {cold_ms:>9.0f} {warm_ms:>17.0f} {characters:>10}")
+    finally:
+        reset_pool(1)
+        if temp_path:
+            os.remove(temp_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+# functions/benchmarks/timing.py
+"""Shared helpers for the benchmark scripts in this directory."""
+import os
+import statistics
+import sys
+
+
+def require_firestore_target():
+    """
+    Refuses to run against a real project unless BENCHMARK_ALLOW_PROJECT=1: benchmarks write and
+    delete their own documents, which belongs on the Firestore emulator (FIRESTORE_EMULATOR_HOST)
+    or a scratch project.
+    """
+    if os.environ.get("FIRESTORE_EMULATOR_HOST") or os.environ.get("BENCHMARK_ALLOW_PROJECT") == "1":
+        return
+    sys.exit("Set FIRESTORE_EMULATOR_HOST, or BENCHMARK_ALLOW_PROJECT=1 to use the project from the environment.")
+
+
+def summarize(samples_ms: list[float]) -> str:
+    """Median / p90 / mean of a list of millisecond timings."""
+    ordered = sorted(samples_ms)
+    p90 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+    return f"median {statistics.median(ordered):8.1f} ms  p90 {p90:8.1f} ms  mean {statistics.fmean(ordered):8.1f} ms"
@@ -0,0 +1,90 @@
+# functions/benchmarks/worker_runtime_bench.py
+"""
+Times per-task overhead of the long-lived worker runtime against the old asyncio.run() per task.
+
+Each simulated task performs --reads Firestore document reads. "asyncio.run" mode is the old
+entry point: a fresh event loop and a fresh AsyncClient per task, closed at the end. "runtime"
+mode submits the same coroutine to common.worker_runtime, which keeps one loop and one client
+for all tasks, exactly as run_agent_task_wrapper does. The first runtime task is reported
+separately as the cold start. Run from functions/ against the emulator:
+
+    FIRESTORE_EMULATOR_HOST=localhost:8080 GCLOUD_PROJECT=demo-bench \\
+        python -m benchmarks.worker_runtime_bench --tasks 50 --reads 3
+
+--reads 0 measures loop and client setup alone.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from common.core import db, get_async_db, close_async_db
+from common.worker_runtime import WorkerRuntime
+from benchmarks.timing import require_firestore_target, summarize
+
+BENCHMARK_COLLECTION = "benchmarks"
+
+
+async def simulated_task(doc_id: str, reads: int):
+    doc_ref = get_async_db().collection(BENCHMARK_COLLECTION).document(doc_id)
+    for _ in range(reads):
+        await doc_ref.get()
+
+
+async def simulated_task_with_own_client(doc_id: str, reads: int):
+    try:
+        await simulated_task(doc_id, reads)
+    finally:
+        await close_async_db()
+
+
+def time_asyncio_run(doc_id: str, tasks: int, reads: int) -> list[float]:
+    samples = []
+    for _ in range(tasks):
+        started_at = time.perf_counter()
+        asyncio.run(simulated_task_with_own_client(doc_id, reads))
+        samples.append((time.perf_counter() - started_at) * 1000)
+    return samples
+
+
+def time_worker_runtime(doc_id: str, tasks: int, reads: int) -> list[float]:
+    runtime = WorkerRuntime(name="benchmark-runtime")
+    samples = []
+    try:
+        for _ in range(tasks):
+            started_at = time.perf_counter()
+            loop = runtime.loop
+            runtime.get_client("firestore", lambda: get_async_db(loop), close=lambda client: client.close())
+            runtime.run(simulated_task(doc_id, reads))
+            samples.append((time.perf_counter() - started_at) * 1000)
+    finally:
+        runtime.shutdown()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=50, help="Simulated tasks per mode.")
+    parser.add_argument("--reads", type=int, default=3, help="Firestore reads per task.")
+    args = parser.parse_args()
+    if args.reads:
+        require_firestore_target()
+
+    doc_id = f"worker-runtime-{uuid.uuid4().hex[:12]}"
+    if args.reads:
+        db.collection(BENCHMARK_COLLECTION).document(doc_id).set({"payload": "x" * 1024})
+    try:
+        old_samples = time_asyncio_run(doc_id, args.tasks, args.reads)
+        runtime_samples = time_worker_runtime(doc_id, args.tasks, args.reads)
+    finally:
+        if args.reads:
+            db.collection(BENCHMARK_COLLECTION).document(doc_id).delete()
+    print(f"{args.tasks} tasks, {args.reads} reads each")
+    print(f"  asyncio.run per task   {summarize(old_samples)}")
+    print(f"  runtime, cold (task 1) {runtime_samples[0]:8.1f} ms")
+    if len(runtime_samples) > 1:
+        print(f"  runtime, warm          {summarize(runtime_samples[1:])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,22 @@
 # functions/common/adk_helpers.py
 import re
 import os
+import time
+import asyncio
 import importlib
 import traceback
 
-from .core import logger, db
+from .core import logger, get_async_db
 from google.adk.agents import Agent, SequentialAgent, LoopAgent, ParallelAgent # LlmAgent is aliased as Agent
 from google.adk.models.lite_llm import LiteLlm
 from google.genai import types as genai_types
 from google.adk.tools.mcp_tool.mcp_toolset import MCPToolset
 
-from google.adk.tools.mcp_tool.mcp_session_manager import (
-    StreamableHTTPConnectionParams,
-    SseServerParams,
-)
+from google.adk.tools.mcp_tool.mcp_session_manager import SseServerParams
+from .mcp_pool import mcp_session_pool, mcp_connection_params
+from .worker_runtime import worker_runtime
+from .rate_limiter import rate_limiter, rate_limit_key, resolve_rate_limits
+from .hedged_llm import HedgedLiteLlm, DEFAULT_HEDGE_DELAY_SEC
 from google.adk.artifacts import GcsArtifactService
 from .config import get_gcp_project_config
 from google.adk.auth.auth_schemes import AuthScheme
@@ -37,6 +40,9 @@ BACKEND_LITELLM_PROVIDER_CONFIG = {
     "custom": {"prefix": None, "apiKeyEnv": None} # No prefix, user provides full string
 }
 
+# Maximum number of sibling agents instantiated at once under one Sequential/Parallel agent.
+AGENT_INSTANTIATION_CONCURRENCY = int(os.environ.get("AGENT_INSTANTIATION_CONCURRENCY", 8))
+
 def generate_vertex_deployment_display_name(agent_config_name: str, agent_doc_id: str) -> str:
     base_name = agent_config_name or f"adk-agent-{agent_doc_id}"
     # Vertex AI display names must be 4-63 chars, start with letter, contain only lowercase letters, numbers, hyphens.
@@ -64,8 +70,8 @@ async def get_model_config_from_firestore(model_id: str) -> dict:
     if not model_id:
         raise ValueError("model_id cannot be empty.")
     try:
-        model_ref = db.collection("models").document(model_id)
-        model_doc = model_ref.get()
+        model_ref = get_async_db().collection("models").document(model_id)
+        model_doc = await model_ref.get()
         if not model_doc.exists:
             raise ValueError(f"Model with ID '{model_id}' not found in Firestore.")
         return model_doc.to_dict()
@@ -75,6 +81,51 @@ async def get_model_config_from_firestore(model_id: str) -> dict:
         raise ValueError(f"Could not fetch model configuration for ID '{model_id}'.")
 
 
+def _iter_agent_configs(agent_config: dict):
+    """Yields every node of an agent config tree, parents before their children."""
+    pending = [agent_config]
+    while pending:
+        config = pending.pop(0)
+        yield config
+        pending.extend(config.get("childAgents") or [])
+
+
+def collect_model_ids(agent_config: dict) -> list[str]:
+    """Returns the `modelId` of every Agent/LoopAgent node in a config tree, in first-seen order."""
+    model_ids = []
+    for config in _iter_agent_configs(agent_config):
+        # Orchestrators never read their model, so a stale modelId on them must not be fetched.
+        if config.get("agentType") not in ("Agent", "LoopAgent"):
+            continue
+        model_id = config.get("modelId")
+        if model_id and model_id not in model_ids:
+            model_ids.append(model_id)
+    return model_ids
+
+
+async def get_model_snapshots_from_firestore(model_ids: list[str]) -> dict:
+    """
+    Fetches several model documents in one round trip, keyed by model ID. IDs that are missing
+    (or a failed batch read) are left out rather than raised, so the per-node
+    get_model_config_from_firestore fallback reports them with its usual errors.
+    """
+    if not model_ids:
+        return {}
+    async_db = get_async_db()
+    model_refs = [async_db.collection("models").document(model_id) for model_id in model_ids]
+    try:
+        model_docs = [doc async for doc in async_db.get_all(model_refs)]
+    except Exception as e:
+        logger.warn(f"Batch fetch of model configs {model_ids} from Firestore failed, falling back to single reads: {e}")
+        return {}
+    return {doc.id: doc for doc in model_docs if doc.exists}
+
+
+async def get_model_configs_from_firestore(model_ids: list[str]) -> dict:
+    """Like get_model_snapshots_from_firestore, but returns each model's configuration dict."""
+    return {model_id: doc.to_dict() for model_id, doc in (await get_model_snapshots_from_firestore(model_ids)).items()}
+
+
 async def get_adk_artifact_service() -> GcsArtifactService:
     """
     Initializes and returns a GCSArtifactService instance.
@@ -141,81 +192,11 @@ def _create_mcp_auth_objects(auth_config: dict | None) -> tuple[AuthScheme | Non
         logger.error(f"Error creating MCP auth objects for config {auth_config}: {e}")
         return None, None
 
-async def _prepare_agent_kwargs_from_config(merged_agent_and_model_config, adk_agent_name: str, context_for_log: str = ""): # Made async
-    logger.info(f"Preparing kwargs for ADK agent '{adk_agent_name}' {context_for_log}. Original config name: '{merged_agent_and_model_config.get('name', 'N/A')}'")
-
-    instantiated_tools = []
-    mcp_tools_by_server_and_auth = {}
-    user_defined_tools_config = merged_agent_and_model_config.get("tools", [])
-    logger.debug(f"user_defined_tools_config for agent '{adk_agent_name}': {user_defined_tools_config}")
-    for tc_idx, tc in enumerate(user_defined_tools_config):
-        tool_type = tc.get('type')
-        if tool_type is None and tc.get('module_path') and tc.get('class_name'):
-            tool_type = 'gofannon'
-            tc['type'] = 'gofannon'
-            logger.info(f"Auto-detected tool type 'gofannon' for tool with module_path: {tc.get('module_path')}")
-
-        if tool_type == 'mcp':
-            server_url = tc.get('mcpServerUrl')
-            tool_name_on_server = tc.get('mcpToolName')
-            auth_config_from_ui = tc.get('auth') # New: get auth config
-
-            # Create a hashable key for the dictionary
-            auth_key = frozenset(auth_config_from_ui.items()) if auth_config_from_ui else None
-            dict_key = (server_url, auth_key)
-
-            if server_url and tool_name_on_server:
-                if dict_key not in mcp_tools_by_server_and_auth:
-                    mcp_tools_by_server_and_auth[dict_key] = []
-                mcp_tools_by_server_and_auth[dict_key].append(tool_name_on_server)
-                logger.info(f"Queued MCP tool '{tool_name_on_server}' from server '{server_url}' (Auth: {bool(auth_config_from_ui)}) for agent '{adk_agent_name}'.")
-            else:
-                logger.warn(f"Skipping MCP tool for agent '{adk_agent_name}' due to missing mcpServerUrl or mcpToolName: {tc}")
-        elif tool_type == 'gofannon' or tool_type == 'custom_repo':
-            try:
-                tool_instance = instantiate_tool(tc)
-                instantiated_tools.append(tool_instance)
-                logger.info(f"Successfully instantiated tool '{tc.get('id', f'index_{tc_idx}')}' (type: {tool_type}) for agent '{adk_agent_name}'.")
-            except ValueError as e:
-                logger.warn(f"Skipping tool for agent '{adk_agent_name}' due to error: {e} (Tool config: {tc.get('id', f'index_{tc_idx}')}, Type: {tool_type})")
-        else:
-            logger.warn(f"Unknown or unhandled tool type '{tool_type}' for agent '{adk_agent_name}'. Tool config: {tc}")
-
-
-            # After iterating all tool_configs, create MCPToolset instances using MCPToolset.from_server
-    for (server_url, auth_key), tool_names_filter in mcp_tools_by_server_and_auth.items():
-        try:
-            auth_config_dict = dict(auth_key) if auth_key else None
-            auth_scheme, auth_credential = _create_mcp_auth_objects(auth_config_dict)
-
-            connection_params = None
-            conn_type_log = ""
-            if server_url.endswith("/sse"):
-                connection_params = SseServerParams(url=server_url)
-                conn_type_log = "SSE"
-            else:
-                connection_params = StreamableHTTPConnectionParams(url=server_url)
-                conn_type_log = "StreamableHTTP"
-
-            unique_tool_filter = list(set(tool_names_filter))
-            logger.info(f"Attempting to create MCPToolset for '{server_url}' ({conn_type_log}) with tool filter: {unique_tool_filter} for agent '{adk_agent_name}'. Auth provided: {bool(auth_scheme)}")
-
-            toolset = MCPToolset(
-                connection_params=connection_params,
-                tool_filter=unique_tool_filter,
-                auth_scheme=auth_scheme,
-                auth_credential=auth_credential,
-                errlog= None
-            )
-            logger.debug(f"toolset: {toolset}")
-            mcp_toolset_instance = toolset
-
-            instantiated_tools.append(mcp_toolset_instance)
-            logger.info(f"Successfully created and added MCPToolset for server '{server_url}' to agent '{adk_agent_name}' with {len(unique_tool_filter)} tools filtered.")
-        except Exception as e_mcp_toolset:
-            logger.error(f"Failed to create MCPToolset for server '{server_url}' for agent '{adk_agent_name}': {type(e_mcp_toolset).__name__} - {e_mcp_toolset}")
-
-
+def build_litellm_model_kwargs(merged_agent_and_model_config: dict, adk_agent_name: str, context_for_log: str = "") -> dict:
+    """
+    Resolves a model config's provider, modelString and credentials into LiteLLM keyword
+    arguments (model, api_base, api_key and provider-specific extras).
+    """
     selected_provider_id = merged_agent_and_model_config.get("provider")
     base_model_name_from_config = merged_agent_and_model_config.get("modelString")
     user_api_base_override = merged_agent_and_model_config.get("litellm_api_base")
@@ -288,7 +269,109 @@ async def _prepare_agent_kwargs_from_config(merged_agent_and_model_config, adk_a
                 logger.warn(f"WatsonX deployment model used for {adk_agent_name} but space_id not found. Deployment may fail or use default space.")
 
 
-    actual_model_for_adk = LiteLlm(**model_constructor_kwargs)
+    return model_constructor_kwargs
+
+async def _prepare_agent_kwargs_from_config(merged_agent_and_model_config, adk_agent_name: str, context_for_log: str = ""): # Made async
+    logger.info(f"Preparing kwargs for ADK agent '{adk_agent_name}' {context_for_log}. Original config name: '{merged_agent_and_model_config.get('name', 'N/A')}'")
+
+    instantiated_tools = []
+    mcp_tools_by_server_and_auth = {}
+    user_defined_tools_config = merged_agent_and_model_config.get("tools", [])
+    logger.debug(f"user_defined_tools_config for agent '{adk_agent_name}': {user_defined_tools_config}")
+    for tc_idx, tc in enumerate(user_defined_tools_config):
+        tool_type = tc.get('type')
+        if tool_type is None and tc.get('module_path') and tc.get('class_name'):
+            tool_type = 'gofannon'
+            tc['type'] = 'gofannon'
+            logger.info(f"Auto-detected tool type 'gofannon' for tool with module_path: {tc.get('module_path')}")
+
+        if tool_type == 'mcp':
+            server_url = tc.get('mcpServerUrl')
+            tool_name_on_server = tc.get('mcpToolName')
+            auth_config_from_ui = tc.get('auth') # New: get auth config
+
+            # Create a hashable key for the dictionary
+            auth_key = frozenset(auth_config_from_ui.items()) if auth_config_from_ui else None
+            dict_key = (server_url, auth_key)
+
+            if server_url and tool_name_on_server:
+                if dict_key not in mcp_tools_by_server_and_auth:
+                    mcp_tools_by_server_and_auth[dict_key] = []
+                mcp_tools_by_server_and_auth[dict_key].append(tool_name_on_server)
+                logger.info(f"Queued MCP tool '{tool_name_on_server}' from server '{server_url}' (Auth: {bool(auth_config_from_ui)}) for agent '{adk_agent_name}'.")
+            else:
+                logger.warn(f"Skipping MCP tool for agent '{adk_agent_name}' due to missing mcpServerUrl or mcpToolName: {tc}")
+        elif tool_type == 'gofannon' or tool_type == 'custom_repo':
+            try:
+                tool_instance = instantiate_tool(tc)
+                instantiated_tools.append(tool_instance)
+                logger.info(f"Successfully instantiated tool '{tc.get('id', f'index_{tc_idx}')}' (type: {tool_type}) for agent '{adk_agent_name}'.")
+            except ValueError as e:
+                logger.warn(f"Skipping tool for agent '{adk_agent_name}' due to error: {e} (Tool config: {tc.get('id', f'index_{tc_idx}')}, Type: {tool_type})")
+        else:
+            logger.warn(f"Unknown or unhandled tool type '{tool_type}' for agent '{adk_agent_name}'. Tool config: {tc}")
+
+
+            # After iterating all tool_configs, create MCPToolset instances using MCPToolset.from_server
+    for (server_url, auth_key), tool_names_filter in mcp_tools_by_server_and_auth.items():
+        try:
+            auth_config_dict = dict(auth_key) if auth_key else None
+            auth_scheme, auth_credential = _create_mcp_auth_objects(auth_config_dict)
+
+            connection_params = mcp_connection_params(server_url)
+            conn_type_log = "SSE" if isinstance(connection_params, SseServerParams) else "StreamableHTTP"
+
+            unique_tool_filter = list(set(tool_names_filter))
+            logger.info(f"Attempting to create MCPToolset for '{server_url}' ({conn_type_log}) with tool filter: {unique_tool_filter} for agent '{adk_agent_name}'. Auth provided: {bool(auth_scheme)}")
+
+            toolset = MCPToolset(
+                connection_params=connection_params,
+                tool_filter=unique_tool_filter,
+                auth_scheme=auth_scheme,
+                auth_credential=auth_credential,
+                errlog= None
+            )
+            # On the worker loop, sessions come from the process-wide pool; other loops (e.g. a
+            # deploy's asyncio.run) keep the toolset's own short-lived session manager.
+            if worker_runtime.owns_running_loop():
+                mcp_session_pool.attach(toolset, server_url)
+            logger.debug(f"toolset: {toolset}")
+            mcp_toolset_instance = toolset
+
+            instantiated_tools.append(mcp_toolset_instance)
+            logger.info(f"Successfully created and added MCPToolset for server '{server_url}' to agent '{adk_agent_name}' with {len(unique_tool_filter)} tools filtered.")
+        except Exception as e_mcp_toolset:
+            logger.error(f"Failed to create MCPToolset for server '{server_url}' for agent '{adk_agent_name}': {type(e_mcp_toolset).__name__} - {e_mcp_toolset}")
+
+
+    model_constructor_kwargs = build_litellm_model_kwargs(merged_agent_and_model_config, adk_agent_name, context_for_log)
+    # Hedging only on the worker loop, like rate limiting below: deployed agents are pickled and
+    # common.hedged_llm is not shipped to Agent Engine, so they keep a plain LiteLlm.
+    hedge_targets = merged_agent_and_model_config.get("hedgeTargets") or []
+    if hedge_targets and worker_runtime.owns_running_loop():
+        hedge_models, hedge_rate_limits = [], []
+        for target_idx, hedge_target in enumerate(hedge_targets):
+            # A target names its own provider/modelString; credentials are only inherited within the same provider.
+            inherited_config = dict(merged_agent_and_model_config)
+            if hedge_target.get("provider") and hedge_target.get("provider") != inherited_config.get("provider"):
+                inherited_config.pop("litellm_api_key", None)
+                inherited_config.pop("litellm_api_base", None)
+            try:
+                hedge_config = {**inherited_config, **hedge_target}
+                hedge_kwargs = build_litellm_model_kwargs(hedge_config, adk_agent_name, f"{context_for_log} (hedge {target_idx})")
+                hedge_models.append(LiteLlm(**hedge_kwargs))
+                # Each target draws from its own provider/API-key bucket, not the primary's.
+                target_limits = resolve_rate_limits(hedge_config)
+                hedge_rate_limits.append((rate_limit_key(hedge_config.get("provider"), hedge_kwargs.get("api_key")), target_limits) if target_limits else None)
+            except ValueError as e:
+                logger.warn(f"Skipping hedge target {target_idx} for agent '{adk_agent_name}': {e}")
+        hedge_delay_sec = float(merged_agent_and_model_config.get("hedgeDelayMs") or DEFAULT_HEDGE_DELAY_SEC * 1000) / 1000
+        actual_model_for_adk = HedgedLiteLlm(**model_constructor_kwargs, hedges=hedge_models, hedge_rate_limits=hedge_rate_limits, hedge_delay_sec=hedge_delay_sec)
+        logger.info(f"Agent '{adk_agent_name}' hedges '{model_constructor_kwargs['model']}' with {[m.model for m in hedge_models]} after {hedge_delay_sec:.2f}s.")
+    else:
+        if hedge_targets:
+            logger.info(f"Agent '{adk_agent_name}' is built outside the worker loop; hedge targets are ignored.")
+        actual_model_for_adk = LiteLlm(**model_constructor_kwargs)
 
     agent_kwargs = {
         "name": adk_agent_name,
@@ -299,6 +382,14 @@ async def _prepare_agent_kwargs_from_config(merged_agent_and_model_config, adk_a
         "output_key": merged_agent_and_model_config.get("outputKey"),
     }
 
+    # Model calls queue on the shared per provider/API-key buckets when limits are configured.
+    # Only on the worker loop: deployed agents are pickled and must not capture the limiter.
+    rate_limits = resolve_rate_limits(merged_agent_and_model_config)
+    if rate_limits and worker_runtime.owns_running_loop():
+        bucket_key = rate_limit_key(merged_agent_and_model_config.get("provider"), model_constructor_kwargs.get("api_key"))
+        agent_kwargs["before_model_callback"], agent_kwargs["after_model_callback"] = rate_limiter.model_callbacks(bucket_key, rate_limits)
+        logger.info(f"Agent '{adk_agent_name}' is rate limited on bucket '{bucket_key}' (requests/min, tokens/min: {rate_limits}).")
+
     # --- Collect parameters for GenerateContentConfig ---
     model_params = merged_agent_and_model_config
     generate_config_kwargs = {}
@@ -407,7 +498,39 @@ def sanitize_adk_agent_name(name_str: str, prefix_if_needed: str = "agent_") ->
 
     return sanitized
 
-async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_context="root", child_index=0): # Made async
+async def close_agent_toolsets(agent):
+    """Closes the MCP toolsets held anywhere in an agent tree."""
+    pending = [agent]
+    while pending:
+        current = pending.pop()
+        for tool in getattr(current, "tools", None) or []:
+            if isinstance(tool, MCPToolset):
+                try:
+                    await tool.close()
+                except Exception as e:
+                    logger.warn(f"Error closing MCP toolset for agent '{current.name}': {e}")
+        pending.extend(getattr(current, "sub_agents", None) or [])
+
+
+async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_context="root", child_index=0, model_configs=None, instantiation_semaphore=None): # Made async
+    """
+    Recursively instantiates an ADK agent tree. `model_configs` maps modelId to its model document;
+    when omitted (top-level call) every model referenced by the tree is fetched in one batch first.
+    `instantiation_semaphore` bounds concurrent Agent/LoopAgent builds across the whole tree; the
+    top-level call creates it and passes it down alongside `model_configs`.
+    """
+    if instantiation_semaphore is None:
+        instantiation_semaphore = asyncio.Semaphore(AGENT_INSTANTIATION_CONCURRENCY)
+    if model_configs is None:
+        started_at = time.perf_counter()
+        model_ids = collect_model_ids(agent_config)
+        model_configs = await get_model_configs_from_firestore(model_ids)
+        prefetch_ms = (time.perf_counter() - started_at) * 1000
+        agent = await instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_context, child_index, model_configs=model_configs, instantiation_semaphore=instantiation_semaphore)
+        node_count = sum(1 for _ in _iter_agent_configs(agent_config))
+        logger.info(f"Instantiated agent tree '{agent.name}' ({node_count} nodes, {len(model_ids)} models) in {(time.perf_counter() - started_at) * 1000:.1f} ms (model prefetch {prefetch_ms:.1f} ms).")
+        return agent
+
     original_agent_name = agent_config.get('name', f'agent_cfg_{child_index}')
     # Make ADK agent names more unique to avoid conflicts if multiple deployments happen
     # or if names are similar across different parts of a composite agent.
@@ -430,74 +553,77 @@ async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_co
     logger.info(f"Instantiating ADK Agent: Name='{adk_agent_name}', Type='{AgentClass.__name__}', Original Config Name='{original_agent_name}' (Context: parent='{parent_adk_name_for_context}', index={child_index})")
 
     if AgentClass in [Agent, LoopAgent]:
-        model_id = agent_config.get("modelId")
-        if not model_id:
-            raise ValueError(f"Agent '{original_agent_name}' is of type {agent_type_str} but is missing required 'modelId'.")
-
-            # Fetch the model configuration from Firestore
-        model_config = await get_model_config_from_firestore(model_id)
-
-        # Merge agent-specific properties (like tools, outputKey) with the model's properties.
-        # Agent properties take precedence.
-        merged_config = {**model_config, **agent_config}
-
-        if AgentClass == Agent:
-            agent_kwargs = await _prepare_agent_kwargs_from_config(
-                merged_config,
-                adk_agent_name,
-                context_for_log=f"(type: LlmAgent, parent: {parent_adk_name_for_context}, original: {original_agent_name})"
-            )
-            tool_count = len(agent_kwargs.get("tools", []))
-            logger.info(f"Final kwargs for LlmAgent '{adk_agent_name}' includes {tool_count} tools")
+        # Only this node's own work (model lookup, tool and MCP toolset setup) holds a slot;
+        # orchestrators never hold one while awaiting children, so the tree-wide limit cannot deadlock.
+        async with instantiation_semaphore:
+            model_id = agent_config.get("modelId")
+            if not model_id:
+                raise ValueError(f"Agent '{original_agent_name}' is of type {agent_type_str} but is missing required 'modelId'.")
+
+            # Resolved by the top-level prefetch; fall back to a single read for configs it did not see.
+            model_config = model_configs.get(model_id) or await get_model_config_from_firestore(model_id)
+
+            # Merge agent-specific properties (like tools, outputKey) with the model's properties.
+            # Agent properties take precedence.
+            merged_config = {**model_config, **agent_config}
+
+            if AgentClass == Agent:
+                agent_kwargs = await _prepare_agent_kwargs_from_config(
+                    merged_config,
+                    adk_agent_name,
+                    context_for_log=f"(type: LlmAgent, parent: {parent_adk_name_for_context}, original: {original_agent_name})"
+                )
+                tool_count = len(agent_kwargs.get("tools", []))
+                logger.info(f"Final kwargs for LlmAgent '{adk_agent_name}' includes {tool_count} tools")
 
-            try:
-                return Agent(**agent_kwargs)
-            except Exception as e_agent_init:
-                logger.error(f"Initialization Error for LlmAgent '{adk_agent_name}' (from config '{original_agent_name}'): {e_agent_init}")
-                logger.error(f"Args passed: {agent_kwargs}") # Log the arguments that caused the error
-                detailed_traceback = traceback.format_exc()
-                logger.error(f"Traceback:\n{detailed_traceback}")
-                raise ValueError(f"Failed to instantiate LlmAgent '{original_agent_name}': {e_agent_init}.")
-
-        elif AgentClass == LoopAgent:
-            looped_agent_config_name = f"{original_agent_name}_looped_child_config" # For logging
-            looped_agent_adk_name = sanitize_adk_agent_name(f"{adk_agent_name}_looped_child_instance", prefix_if_needed="looped_")
-
-            looped_agent_kwargs = await _prepare_agent_kwargs_from_config( # Await the async call
-                merged_config, # Pass the merged config
-                looped_agent_adk_name,
-                context_for_log=f"(looped child of LoopAgent '{adk_agent_name}', original config: '{looped_agent_config_name}')"
-            )
-            logger.debug(f"Final kwargs for Looped Child ADK Agent '{looped_agent_adk_name}' (for LoopAgent '{adk_agent_name}'): {looped_agent_kwargs}")
-            try:
-                looped_child_agent_instance = Agent(**looped_agent_kwargs) # Agent is LlmAgent
-            except Exception as e_loop_child_init:
-                logger.error(f"Initialization Error for Looped Child Agent '{looped_agent_adk_name}' (from config '{looped_agent_config_name}'): {e_loop_child_init}")
-                logger.error(f"Args passed to looped child Agent constructor: {looped_agent_kwargs}")
-                detailed_traceback = traceback.format_exc()
-                logger.error(f"Traceback:\n{detailed_traceback}")
-                raise ValueError(f"Failed to instantiate looped child agent for '{original_agent_name}': {e_loop_child_init}.")
-
-            max_loops_val_str = agent_config.get("maxLoops", "3") # Default to 3 loops
-            try:
-                max_loops_val = int(max_loops_val_str)
-                if max_loops_val <= 0: # Max loops must be positive
-                    logger.warning(f"MaxLoops for LoopAgent '{adk_agent_name}' is {max_loops_val}, which is not positive. Defaulting to 3.")
+                try:
+                    return Agent(**agent_kwargs)
+                except Exception as e_agent_init:
+                    logger.error(f"Initialization Error for LlmAgent '{adk_agent_name}' (from config '{original_agent_name}'): {e_agent_init}")
+                    logger.error(f"Args passed: {agent_kwargs}") # Log the arguments that caused the error
+                    detailed_traceback = traceback.format_exc()
+                    logger.error(f"Traceback:\n{detailed_traceback}")
+                    raise ValueError(f"Failed to instantiate LlmAgent '{original_agent_name}': {e_agent_init}.")
+
+            elif AgentClass == LoopAgent:
+                looped_agent_config_name = f"{original_agent_name}_looped_child_config" # For logging
+                looped_agent_adk_name = sanitize_adk_agent_name(f"{adk_agent_name}_looped_child_instance", prefix_if_needed="looped_")
+
+                looped_agent_kwargs = await _prepare_agent_kwargs_from_config( # Await the async call
+                    merged_config, # Pass the merged config
+                    looped_agent_adk_name,
+                    context_for_log=f"(looped child of LoopAgent '{adk_agent_name}', original config: '{looped_agent_config_name}')"
+                )
+                logger.debug(f"Final kwargs for Looped Child ADK Agent '{looped_agent_adk_name}' (for LoopAgent '{adk_agent_name}'): {looped_agent_kwargs}")
+                try:
+                    looped_child_agent_instance = Agent(**looped_agent_kwargs) # Agent is LlmAgent
+                except Exception as e_loop_child_init:
+                    logger.error(f"Initialization Error for Looped Child Agent '{looped_agent_adk_name}' (from config '{looped_agent_config_name}'): {e_loop_child_init}")
+                    logger.error(f"Args passed to looped child Agent constructor: {looped_agent_kwargs}")
+                    detailed_traceback = traceback.format_exc()
+                    logger.error(f"Traceback:\n{detailed_traceback}")
+                    raise ValueError(f"Failed to instantiate looped child agent for '{original_agent_name}': {e_loop_child_init}.")
+
+                max_loops_val_str = agent_config.get("maxLoops", "3") # Default to 3 loops
+                try:
+                    max_loops_val = int(max_loops_val_str)
+                    if max_loops_val <= 0: # Max loops must be positive
+                        logger.warning(f"MaxLoops for LoopAgent '{adk_agent_name}' is {max_loops_val}, which is not positive. Defaulting to 3.")
+                        max_loops_val = 3
+                except ValueError:
+                    logger.warning(f"Invalid MaxLoops value '{max_loops_val_str}' for LoopAgent '{adk_agent_name}'. Defaulting to 3.")
                     max_loops_val = 3
-            except ValueError:
-                logger.warning(f"Invalid MaxLoops value '{max_loops_val_str}' for LoopAgent '{adk_agent_name}'. Defaulting to 3.")
-                max_loops_val = 3
 
 
-            loop_agent_kwargs = {
-                "name": adk_agent_name,
-                "description": agent_config.get("description"),
-                "agent": looped_child_agent_instance, # The LlmAgent to loop
-                "max_loops": max_loops_val
-                # Potentially other LoopAgent specific params like "stopping_condition" if supported/configured
-            }
-            logger.debug(f"Final kwargs for LoopAgent '{adk_agent_name}': {{name, description, max_loops, agent_name: {looped_child_agent_instance.name}}}")
-            return LoopAgent(**loop_agent_kwargs)
+                loop_agent_kwargs = {
+                    "name": adk_agent_name,
+                    "description": agent_config.get("description"),
+                    "agent": looped_child_agent_instance, # The LlmAgent to loop
+                    "max_loops": max_loops_val
+                    # Potentially other LoopAgent specific params like "stopping_condition" if supported/configured
+                }
+                logger.debug(f"Final kwargs for LoopAgent '{adk_agent_name}': {{name, description, max_loops, agent_name: {looped_child_agent_instance.name}}}")
+                return LoopAgent(**loop_agent_kwargs)
 
     elif AgentClass == SequentialAgent or AgentClass == ParallelAgent:
         child_agent_configs = agent_config.get("childAgents", [])
@@ -505,18 +631,27 @@ async def instantiate_adk_agent_from_config(agent_config, parent_adk_name_for_co
             logger.info(f"{AgentClass.__name__} '{original_agent_name}' has no child agents configured.")
             instantiated_child_agents = []
         else:
-            instantiated_child_agents = []
-            for idx, child_config in enumerate(child_agent_configs):
-                try:
-                    child_agent_instance = await instantiate_adk_agent_from_config( # Await the recursive async call
-                        child_config,
-                        parent_adk_name_for_context=adk_agent_name, # Pass current agent's ADK name as context
-                        child_index=idx
-                    )
-                    instantiated_child_agents.append(child_agent_instance)
-                except Exception as e_child:
+            # Children are independent, so build them concurrently (bounded tree-wide) and keep config order.
+            child_results = await asyncio.gather(
+                *(instantiate_adk_agent_from_config( # Await the recursive async call
+                    child_config,
+                    parent_adk_name_for_context=adk_agent_name, # Pass current agent's ADK name as context
+                    child_index=idx,
+                    model_configs=model_configs,
+                    instantiation_semaphore=instantiation_semaphore
+                ) for idx, child_config in enumerate(child_agent_configs)),
+                return_exceptions=True
+            )
+            instantiated_child_agents = [result for result in child_results if not isinstance(result, BaseException)]
+            for idx, child_result in enumerate(child_results):
+                if isinstance(child_result, BaseException):
+                    e_child = child_result
                     logger.error(f"Failed to instantiate child agent at index {idx} for {AgentClass.__name__} '{original_agent_name}': {e_child}")
-                    # Potentially re-raise or handle to allow partial construction if desired
+                    # Siblings that did build may already hold MCP toolsets; release them before failing.
+                    for built_child in instantiated_child_agents:
+                        await close_agent_toolsets(built_child)
+                    if not isinstance(child_result, Exception):
+                        raise child_result
                     raise ValueError(f"Error processing child agent for '{original_agent_name}': {e_child}")
 
         orchestrator_kwargs = {
@@ -536,7 +671,12 @@ __all__ = [
     'generate_vertex_deployment_display_name',
     'get_adk_artifact_service',
     'get_model_config_from_firestore',
+    'get_model_configs_from_firestore',
+    'get_model_snapshots_from_firestore',
+    'collect_model_ids',
+    'build_litellm_model_kwargs',
     'instantiate_tool',
     'sanitize_adk_agent_name',
+    'close_agent_toolsets',
     'instantiate_adk_agent_from_config'
 ]
\ No newline at end of file
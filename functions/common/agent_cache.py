@@ -0,0 +1,108 @@
+# functions/common/agent_cache.py
+import os
+import json
+import asyncio
+import hashlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from .core import logger
+from .adk_helpers import instantiate_adk_agent_from_config, get_model_snapshots_from_firestore, collect_model_ids, close_agent_toolsets
+
+# Upper bound on cached agent trees per instance. Evicted trees have their MCP toolsets closed.
+AGENT_CACHE_MAX_ENTRIES = int(os.environ.get("AGENT_CACHE_MAX_ENTRIES", 32))
+
+
+def agent_cache_key(agent_config: dict, model_versions: dict) -> str:
+    """Content hash of an agent config plus the Firestore update_time of each model it references."""
+    payload = json.dumps({"config": agent_config, "models": model_versions}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _CacheEntry:
+    """A cached agent tree and the number of runs currently leasing it."""
+
+    def __init__(self, agent, model_ids: list[str]):
+        self.agent = agent
+        self.model_ids = model_ids
+        self.leases = 0
+        self.evicted = False
+
+
+class AgentTreeCache:
+    """
+    LRU cache of instantiated ADK agent trees for warm instances. ADK agents keep no per-run
+    state (that lives in the session), so a cached tree can serve any number of sessions.
+    Entries are keyed by agent_cache_key over the agent config and the update_time of every
+    referenced model document, so any write to either yields a new key; stale entries age out
+    or can be dropped with invalidate(). Trees are handed out through lease(): an evicted tree
+    keeps its MCP toolsets open until the last run using it has finished.
+    """
+
+    def __init__(self, max_entries: int = AGENT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> _CacheEntry
+        self._build_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    @asynccontextmanager
+    async def lease(self, agent_config: dict, **instantiate_kwargs):
+        """Yields the cached (or newly built) agent tree for agent_config for the duration of one run."""
+        entry = await self._acquire(agent_config, **instantiate_kwargs)
+        try:
+            yield entry.agent
+        finally:
+            entry.leases -= 1
+            if entry.evicted and not entry.leases:
+                await close_agent_toolsets(entry.agent)
+
+    async def _acquire(self, agent_config: dict, **instantiate_kwargs) -> _CacheEntry:
+        model_ids = collect_model_ids(agent_config)
+        model_docs = await get_model_snapshots_from_firestore(model_ids)
+        model_configs = {model_id: doc.to_dict() for model_id, doc in model_docs.items()}
+        model_versions = {model_id: model_docs[model_id].update_time if model_id in model_docs else None for model_id in model_ids}
+        key = agent_cache_key({**agent_config, "_instantiate": instantiate_kwargs}, model_versions)
+
+        lock = self._build_locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    logger.info(f"[AgentCache] Reusing agent tree '{entry.agent.name}' (hits={self.hits}, misses={self.misses}).")
+                else:
+                    self.misses += 1
+                    agent = await instantiate_adk_agent_from_config(agent_config, model_configs=model_configs, **instantiate_kwargs)
+                    entry = self._entries[key] = _CacheEntry(agent, model_ids)
+                # Leased before any eviction below can see it.
+                entry.leases += 1
+                evicted = []
+                while len(self._entries) > self.max_entries:
+                    _, evicted_entry = self._entries.popitem(last=False)
+                    evicted.append(evicted_entry)
+        finally:
+            self._build_locks.pop(key, None)
+        for evicted_entry in evicted:
+            await self._retire(evicted_entry)
+        return entry
+
+    async def _retire(self, entry: _CacheEntry):
+        """Closes an entry's toolsets now, or when its last lease is released."""
+        entry.evicted = True
+        if not entry.leases:
+            await close_agent_toolsets(entry.agent)
+
+    async def invalidate(self, model_id: str | None = None):
+        """Drops every entry that references model_id, or all entries if model_id is None."""
+        dropped = [key for key, entry in self._entries.items() if model_id is None or model_id in entry.model_ids]
+        for key in dropped:
+            await self._retire(self._entries.pop(key))
+        logger.info(f"[AgentCache] Invalidated {len(dropped)} cached agent trees" + (f" referencing model '{model_id}'." if model_id else "."))
+
+
+# Shared by every run on a warm instance.
+agent_tree_cache = AgentTreeCache()
+
+__all__ = ['AgentTreeCache', 'agent_tree_cache', 'agent_cache_key']
@@ -0,0 +1,140 @@
+# functions/common/blob_cache.py
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .core import logger
+
+# Defaults for the process-wide context blob cache. Both tiers can be tuned per deployment.
+# Note that /tmp on Cloud Functions is an in-memory filesystem, so the spill tier counts
+# against the instance's memory limit as well; it is disabled unless a budget is set.
+CONTEXT_BLOB_CACHE_MAX_BYTES = int(os.environ.get("CONTEXT_BLOB_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+CONTEXT_BLOB_CACHE_SPILL_BYTES = int(os.environ.get("CONTEXT_BLOB_CACHE_SPILL_BYTES", 0))
+CONTEXT_BLOB_CACHE_SPILL_DIR = os.environ.get("CONTEXT_BLOB_CACHE_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "context_blob_cache")
+
+
+class BlobCache:
+    """
+    A thread-safe LRU cache of immutable blob bytes, bounded by total size.
+    Keys are expected to identify a specific object version (e.g. (gs_uri, generation)), so
+    entries never need revalidation. Entries evicted from memory are written to an optional
+    on-disk spill tier, itself an LRU bounded by spill_max_bytes.
+    """
+
+    def __init__(self, max_bytes: int, spill_dir: str | None = None, spill_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir if spill_max_bytes > 0 else None
+        self.spill_max_bytes = spill_max_bytes
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_bytes = 0
+        self._spill = OrderedDict()  # key -> (path, size)
+        self._spill_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def get(self, key) -> bytes | None:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+            spilled = self._spill.pop(key, None)
+            if spilled is None:
+                self.misses += 1
+                return None
+            path, size = spilled
+            self._spill_bytes -= size
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.remove(path)
+        except OSError as e:
+            logger.warn(f"[BlobCache] Could not read spilled entry {path}: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.spill_hits += 1
+        # Promote back to memory; this may spill colder entries in turn.
+        self.put(key, data)
+        return data
+
+    def put(self, key, data: bytes):
+        size = len(data)
+        to_spill = []
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= len(self._memory.pop(key))
+            if size > self.max_bytes:
+                to_spill.append((key, data))
+            else:
+                self._memory[key] = data
+                self._memory_bytes += size
+                while self._memory_bytes > self.max_bytes:
+                    evicted_key, evicted_data = self._memory.popitem(last=False)
+                    self._memory_bytes -= len(evicted_data)
+                    self.evictions += 1
+                    to_spill.append((evicted_key, evicted_data))
+        if self.spill_dir:
+            for spill_key, spill_data in to_spill:
+                self._write_spill(spill_key, spill_data)
+
+    def _write_spill(self, key, data: bytes):
+        size = len(data)
+        if size > self.spill_max_bytes:
+            return
+        path = os.path.join(self.spill_dir, hashlib.sha256(repr(key).encode("utf-8")).hexdigest())
+        try:
+            with open(path, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            logger.warn(f"[BlobCache] Could not spill entry to {path}: {e}")
+            return
+        stale_paths = []
+        with self._lock:
+            previous = self._spill.pop(key, None)
+            if previous:
+                self._spill_bytes -= previous[1]
+            self._spill[key] = (path, size)
+            self._spill_bytes += size
+            while self._spill_bytes > self.spill_max_bytes:
+                _, (stale_path, stale_size) = self._spill.popitem(last=False)
+                self._spill_bytes -= stale_size
+                self.evictions += 1
+                stale_paths.append(stale_path)
+        for stale_path in stale_paths:
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "spillHits": self.spill_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memoryBytes": self._memory_bytes,
+                "memoryEntries": len(self._memory),
+                "spillBytes": self._spill_bytes,
+                "spillEntries": len(self._spill),
+            }
+
+
+# Shared by every run on a warm instance.
+context_blob_cache = BlobCache(
+    max_bytes=CONTEXT_BLOB_CACHE_MAX_BYTES,
+    spill_dir=CONTEXT_BLOB_CACHE_SPILL_DIR,
+    spill_max_bytes=CONTEXT_BLOB_CACHE_SPILL_BYTES,
+)
+
+__all__ = ['BlobCache', 'context_blob_cache']
@@ -1,4 +1,7 @@
 import os
+import asyncio
+import inspect
+import weakref
 import firebase_admin
 from firebase_admin import firestore
 from firebase_functions import logger, options
@@ -14,6 +17,35 @@ except ValueError as e:
 
 db = firestore.client() # Initialize Firestore client globally
 
+# Async Firestore clients are bound to the event loop they first run on, so one is kept per loop
+# (the long-lived worker loop in practice; short-lived asyncio.run() loops get their own and
+# must release it with close_async_db() before the loop ends).
+_async_db_by_loop = weakref.WeakKeyDictionary()
+
+def get_async_db(loop: asyncio.AbstractEventLoop | None = None):
+    """Returns the AsyncClient for `loop` (default: the running loop), sharing the sync client's project and credentials."""
+    loop = loop or asyncio.get_running_loop()
+    async_db = _async_db_by_loop.get(loop)
+    if async_db is None:
+        async_db = firestore.AsyncClient(
+            project=db.project,
+            credentials=firebase_admin.get_app().credential.get_credential(),
+        )
+        _async_db_by_loop[loop] = async_db
+    return async_db
+
+async def close_async_db():
+    """
+    Closes and forgets the running loop's AsyncClient. Short-lived asyncio.run() entry points call
+    this before their loop ends; the worker loop's client is closed by the worker runtime instead.
+    """
+    async_db = _async_db_by_loop.pop(asyncio.get_running_loop(), None)
+    if async_db is None:
+        return
+    result = async_db.close()
+    if inspect.isawaitable(result):
+        await result
+
 def setup_global_options():
     """Sets global options for Firebase Functions."""
     if os.environ.get('FUNCTION_TARGET', None): # Ensures this runs in the Cloud Functions environment
@@ -29,4 +61,4 @@ if os.environ.get('FUNCTION_TARGET', None):
     setup_global_options()
 
 # Export logger for other modules to use consistently
-__all__ = ['db', 'logger', 'setup_global_options']
\ No newline at end of file
+__all__ = ['db', 'get_async_db', 'close_async_db', 'logger', 'setup_global_options']
\ No newline at end of file
@@ -0,0 +1,137 @@
+# functions/common/hedged_llm.py
+import time
+import asyncio
+import contextvars
+from typing import AsyncGenerator
+
+from pydantic import Field
+from .core import logger
+from .rate_limiter import rate_limiter, estimate_request_tokens
+from google.adk.models.lite_llm import LiteLlm
+
+# Default delay before a hedge target is fired while the primary has not answered yet.
+DEFAULT_HEDGE_DELAY_SEC = 2.0
+# Weight of the newest sample in the per-backend first-response latency average.
+LATENCY_EWMA_ALPHA = 0.2
+
+# Per-run record of which backend answered and how much latency hedging saved; set by the task executor.
+model_backend_metrics = contextvars.ContextVar("model_backend_metrics", default=None)
+# Moving average of first-response latency per LiteLLM model string, for latency-saved estimates.
+_first_response_latency_ewma = {}
+
+
+def _record_latency(model: str, latency_sec: float):
+    previous = _first_response_latency_ewma.get(model)
+    _first_response_latency_ewma[model] = latency_sec if previous is None else (
+        LATENCY_EWMA_ALPHA * latency_sec + (1 - LATENCY_EWMA_ALPHA) * previous)
+
+
+class HedgedLiteLlm(LiteLlm):
+    """
+    LiteLlm with hedge/fallback targets. The primary backend is called first; each hedge fires
+    after `hedge_delay_sec` without a response, or immediately when the previous attempt fails.
+    The first backend to produce a response wins and the others are cancelled. For streamed
+    calls the race is decided by the first chunk, after which only the winner keeps streaming.
+    """
+
+    hedges: list[LiteLlm] = Field(default_factory=list)
+    # Per hedge, (rate-limit bucket key, limits) or None. The primary is throttled by the agent's
+    # own callbacks; a hedge reserves from its own bucket before it fires.
+    hedge_rate_limits: list = Field(default_factory=list)
+    hedge_delay_sec: float = DEFAULT_HEDGE_DELAY_SEC
+
+    def __init__(self, model: str, **kwargs):
+        # LiteLlm forwards every extra kwarg to litellm, so the hedge settings are kept out of
+        # its constructor and assigned once the base model is initialised.
+        hedges = kwargs.pop("hedges", None) or []
+        hedge_rate_limits = kwargs.pop("hedge_rate_limits", None) or []
+        hedge_delay_sec = kwargs.pop("hedge_delay_sec", DEFAULT_HEDGE_DELAY_SEC)
+        super().__init__(model=model, **kwargs)
+        self.hedges = list(hedges)
+        self.hedge_rate_limits = list(hedge_rate_limits)
+        self.hedge_delay_sec = hedge_delay_sec
+
+    async def generate_content_async(self, llm_request, stream: bool = False) -> AsyncGenerator:
+        backends = [self] + list(self.hedges)
+        started_at = time.perf_counter()
+        generators, pending, errors = {}, {}, []
+
+        async def first_response(index: int):
+            backend = backends[index]
+            request = llm_request if index == 0 else llm_request.model_copy(deep=True)
+            target_limits = self.hedge_rate_limits[index - 1] if 0 < index <= len(self.hedge_rate_limits) else None
+            if target_limits:
+                bucket_key, limits = target_limits
+                await rate_limiter.acquire(bucket_key, limits, estimate_request_tokens(request))
+            generator = LiteLlm.generate_content_async(backend, request, stream) if index == 0 else backend.generate_content_async(request, stream)
+            generators[index] = generator
+            try:
+                return await generator.__anext__()
+            except StopAsyncIteration:
+                raise RuntimeError(f"Backend '{backend.model}' returned no response.")
+
+        def launch(index: int):
+            pending[asyncio.create_task(first_response(index))] = index
+            if index > 0:
+                logger.info(f"[HedgedLiteLlm] Firing hedge {index} ('{backends[index].model}') after {(time.perf_counter() - started_at) * 1000:.0f} ms.")
+
+        launch(0)
+        next_index = 1
+        winner = None
+        try:
+            while winner is None:
+                can_hedge = next_index < len(backends)
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_delay_sec if can_hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch(next_index)
+                    next_index += 1
+                    continue
+                for task in done:
+                    index = pending.pop(task)
+                    if task.exception() is None:
+                        winner = (index, task.result())
+                        break
+                    errors.append(task.exception())
+                    logger.warn(f"[HedgedLiteLlm] Backend '{backends[index].model}' failed: {task.exception()}")
+                if winner is None and next_index < len(backends):
+                    # A failure fires the next target right away instead of waiting out the delay.
+                    launch(next_index)
+                    next_index += 1
+                elif winner is None and not pending:
+                    raise errors[-1]
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for index, generator in generators.items():
+                if winner is None or index != winner[0]:
+                    try:
+                        await generator.aclose()
+                    except Exception:
+                        pass
+
+        winner_index, first_item = winner
+        winner_model = backends[winner_index].model
+        latency_sec = time.perf_counter() - started_at
+        expected_primary_sec = _first_response_latency_ewma.get(self.model)
+        if winner_index == 0:
+            _record_latency(self.model, latency_sec)
+        # Saved latency is the primary's typical first-response time minus what the winner took.
+        saved_ms = max(0.0, (expected_primary_sec - latency_sec) * 1000) if winner_index and expected_primary_sec else 0.0
+        metrics = model_backend_metrics.get()
+        if metrics is not None:
+            metrics["backend"] = winner_model
+            metrics["modelCalls"] = metrics.get("modelCalls", 0) + 1
+            if winner_index:
+                metrics["hedgeWins"] = metrics.get("hedgeWins", 0) + 1
+                metrics["latencySavedMs"] = metrics.get("latencySavedMs", 0.0) + saved_ms
+        if winner_index:
+            logger.info(f"[HedgedLiteLlm] '{winner_model}' won over primary '{self.model}' in {latency_sec * 1000:.0f} ms (estimated {saved_ms:.0f} ms saved).")
+
+        yield first_item
+        async for item in generators[winner_index]:
+            yield item
+
+
+__all__ = ['HedgedLiteLlm', 'model_backend_metrics', 'DEFAULT_HEDGE_DELAY_SEC']
@@ -0,0 +1,122 @@
+# functions/common/html_text.py
+import re
+from html.parser import HTMLParser
+
+# Elements whose content is never readable page text. Forms are kept (they often wrap the whole
+# page in ASP.NET-style sites); only their controls are dropped.
+SKIPPED_TAGS = {
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe", "object",
+    "nav", "header", "footer", "aside", "dialog",
+    "button", "select", "textarea", "datalist", "option", "optgroup",
+}
+# Elements that end a line of text.
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "li", "ul", "ol", "dl", "dt", "dd", "tr", "table",
+    "pre", "blockquote", "figure", "figcaption", "details", "summary", "h1", "h2", "h3", "h4", "h5", "h6",
+}
+# Block elements that are also separated from what follows by a blank line.
+PARAGRAPH_TAGS = {"p", "pre", "blockquote", "table", "ul", "ol", "dl", "h1", "h2", "h3", "h4", "h5", "h6"}
+HEADING_LEVELS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+VOID_TAGS = {"br", "hr", "img", "input", "meta", "link", "area", "base", "col", "embed", "source", "track", "wbr"}
+MAIN_CONTENT_TAGS = {"main", "article"}
+# <main>/<article> text is used on its own only if it is a meaningful share of the page.
+MIN_MAIN_CONTENT_CHARS = 200
+
+
+class HtmlTextExtractor(HTMLParser):
+    """
+    Incremental HTML-to-text converter that keeps readable content and drops scripts, styles,
+    navigation and other chrome. Feed decoded chunks as they arrive and call close() for the
+    text: the <main>/<article> content when the page has a substantial one, otherwise the
+    whole body. Headings become Markdown-style '#' lines and list items '- ' lines.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self._all_parts = []
+        self._main_parts = []
+        self._skip_tag, self._skip_nesting = None, 0
+        self._main_depth = 0
+        self._pre_depth = 0
+        self._in_title = False
+
+    def _emit(self, text: str):
+        self._all_parts.append(text)
+        if self._main_depth:
+            self._main_parts.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_nesting += 1
+            return
+        attributes = dict(attrs)
+        if tag in SKIPPED_TAGS or "hidden" in attributes or attributes.get("aria-hidden") == "true":
+            if tag not in VOID_TAGS:
+                self._skip_tag, self._skip_nesting = tag, 1
+            return
+        if tag == "title":
+            self._in_title = True
+        elif tag == "br":
+            self._emit("\n")
+        elif tag in MAIN_CONTENT_TAGS:
+            self._main_depth += 1
+        if tag == "pre":
+            self._pre_depth += 1
+        if tag in BLOCK_TAGS:
+            self._emit("\n\n" if tag in PARAGRAPH_TAGS else "\n")
+        if tag in HEADING_LEVELS:
+            self._emit("#" * HEADING_LEVELS[tag] + " ")
+        elif tag == "li":
+            self._emit("- ")
+
+    def handle_endtag(self, tag):
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_nesting -= 1
+                if not self._skip_nesting:
+                    self._skip_tag = None
+            return
+        if tag == "title":
+            self._in_title = False
+        elif tag in MAIN_CONTENT_TAGS and self._main_depth:
+            self._main_depth -= 1
+        elif tag == "pre" and self._pre_depth:
+            self._pre_depth -= 1
+        if tag in PARAGRAPH_TAGS:
+            self._emit("\n\n")
+
+    def handle_data(self, data):
+        if self._skip_tag:
+            return
+        if self._in_title:
+            self.title += data
+            return
+        if self._pre_depth:
+            self._emit(data)
+            return
+        text = re.sub(r"\s+", " ", data)
+        if not self._all_parts or self._all_parts[-1][-1:].isspace():
+            text = text.lstrip()
+        if text:
+            self._emit(text)
+
+    def close(self) -> str:
+        super().close()
+        text = _normalize_whitespace("".join(self._all_parts))
+        main_text = _normalize_whitespace("".join(self._main_parts))
+        if len(main_text) >= MIN_MAIN_CONTENT_CHARS:
+            text = main_text
+        title = " ".join(self.title.split())
+        if title and not text.startswith(f"# {title}"):
+            text = f"# {title}\n\n{text}"
+        return text
+
+
+def _normalize_whitespace(text: str) -> str:
+    lines = [line.rstrip() for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(line if line.strip() else "" for line in lines)).strip()
+
+
+__all__ = ['HtmlTextExtractor']
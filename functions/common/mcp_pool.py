@@ -0,0 +1,199 @@
+# functions/common/mcp_pool.py
+import os
+import time
+import asyncio
+
+import anyio
+from .core import logger
+from google.adk.tools.mcp_tool.mcp_session_manager import (
+    MCPSessionManager,
+    StreamableHTTPConnectionParams,
+    SseServerParams,
+)
+
+# Sessions idle for longer than this are closed by the pool's sweep.
+MCP_SESSION_IDLE_TTL_SEC = float(os.environ.get("MCP_SESSION_IDLE_TTL_SEC", 300))
+# How often the sweep runs; sessions that survive it are pinged so servers keep them open.
+MCP_KEEPALIVE_INTERVAL_SEC = float(os.environ.get("MCP_KEEPALIVE_INTERVAL_SEC", 60))
+# A session idle for longer than this is pinged before it is handed out again.
+MCP_HEALTH_CHECK_IDLE_SEC = float(os.environ.get("MCP_HEALTH_CHECK_IDLE_SEC", 30))
+MCP_PING_TIMEOUT_SEC = float(os.environ.get("MCP_PING_TIMEOUT_SEC", 5))
+
+# Pooling builds on private internals of ADK's MCPSessionManager and MCPToolset (as of the pinned
+# google-adk 1.7). If an upgrade drops any of them, the pool steps aside: toolsets keep their own
+# session managers and listings open a short-lived session per call.
+_REQUIRED_MANAGER_METHODS = ("_generate_session_key", "_merge_headers", "_is_session_disconnected")
+_REQUIRED_MANAGER_STATE = ("_sessions", "_session_lock")
+_REQUIRED_TOOLSET_STATE = "_mcp_session_manager"
+
+
+def mcp_connection_params(server_url: str):
+    """Connection parameters for an MCP server URL: SSE for `/sse` endpoints, StreamableHTTP otherwise."""
+    if server_url.endswith("/sse"):
+        return SseServerParams(url=server_url)
+    return StreamableHTTPConnectionParams(url=server_url)
+
+
+def _missing_pooling_internals() -> list[str]:
+    """Names of the ADK internals the pool needs that this ADK version does not provide."""
+    missing = [name for name in _REQUIRED_MANAGER_METHODS if not callable(getattr(MCPSessionManager, name, None))]
+    try:
+        probe = MCPSessionManager(connection_params=mcp_connection_params("http://localhost/mcp"), errlog=None)
+        missing += [name for name in _REQUIRED_MANAGER_STATE if not hasattr(probe, name)]
+    except Exception as e:
+        missing.append(f"MCPSessionManager() ({type(e).__name__}: {e})")
+    return missing
+
+
+class PooledMCPSessionManager(MCPSessionManager):
+    """
+    ADK session manager shared by every toolset and listing call for one server. Sessions are
+    keyed by auth headers (as in the base class) and are health-checked before reuse after being
+    idle. `close()` is a no-op so that toolsets closing themselves leave shared sessions alone;
+    the pool closes sessions through `close_idle()` and `close_all()`.
+    """
+
+    def __init__(self, server_url: str):
+        super().__init__(connection_params=mcp_connection_params(server_url), errlog=None)
+        self.server_url = server_url
+        self._last_used = {}  # session key -> monotonic time of last checkout
+
+    async def create_session(self, headers=None):
+        session_key = self._generate_session_key(self._merge_headers(headers))
+        existing = self._sessions.get(session_key)
+        if existing is not None and time.monotonic() - self._last_used.get(session_key, 0) > MCP_HEALTH_CHECK_IDLE_SEC:
+            if not await self._ping(existing[0]):
+                logger.info(f"[MCPPool] Session for {self.server_url} failed its health check. Reconnecting.")
+                await self._drop_session(session_key)
+        started_at = time.perf_counter()
+        is_new = session_key not in self._sessions
+        session = await super().create_session(headers)
+        self._last_used[session_key] = time.monotonic()
+        if is_new:
+            logger.info(f"[MCPPool] Opened session for {self.server_url} in {(time.perf_counter() - started_at) * 1000:.1f} ms.")
+        return session
+
+    async def close(self):
+        pass
+
+    async def close_idle(self, now: float):
+        """Closes sessions idle past MCP_SESSION_IDLE_TTL_SEC and pings the rest to keep them alive."""
+        for session_key, (session, _) in list(self._sessions.items()):
+            idle_sec = now - self._last_used.get(session_key, 0)
+            if idle_sec > MCP_SESSION_IDLE_TTL_SEC:
+                logger.info(f"[MCPPool] Closing session for {self.server_url} after {idle_sec:.0f}s idle.")
+                await self._drop_session(session_key)
+            elif not await self._ping(session):
+                logger.info(f"[MCPPool] Keepalive failed for {self.server_url}. Session will reconnect on next use.")
+                await self._drop_session(session_key)
+
+    async def close_all(self):
+        for session_key in list(self._sessions):
+            await self._drop_session(session_key)
+
+    async def _ping(self, session) -> bool:
+        if self._is_session_disconnected(session):
+            return False
+        try:
+            await asyncio.wait_for(session.send_ping(), MCP_PING_TIMEOUT_SEC)
+            return True
+        except Exception as e:
+            logger.warn(f"[MCPPool] Ping to {self.server_url} failed: {type(e).__name__} - {e}")
+            return False
+
+    async def _drop_session(self, session_key: str):
+        async with self._session_lock:
+            entry = self._sessions.pop(session_key, None)
+            self._last_used.pop(session_key, None)
+        if entry is None:
+            return
+        try:
+            await entry[1].aclose()
+        except Exception as e:
+            logger.warn(f"[MCPPool] Error closing session for {self.server_url}: {e}")
+
+
+class MCPSessionPool:
+    """
+    Process-wide pool of MCP sessions, one PooledMCPSessionManager per server URL. Agent toolsets
+    and tool listing share it, so repeated calls to a server skip the transport handshake and
+    `initialize()`. A background sweep on the owning loop handles keepalive and idle eviction.
+    Sessions are bound to the event loop they were opened on, so the pool is only used from
+    the worker runtime's loop.
+    """
+
+    def __init__(self):
+        self._managers = {}  # server URL -> PooledMCPSessionManager
+        self._sweep_task = None
+        self._enabled = None
+
+    @property
+    def enabled(self) -> bool:
+        """False when the installed ADK lacks the internals pooling relies on (checked once)."""
+        if self._enabled is None:
+            missing = _missing_pooling_internals()
+            if missing:
+                logger.warn(f"[MCPPool] Installed ADK lacks {missing}; MCP session pooling is disabled.")
+            self._enabled = not missing
+        return self._enabled
+
+    def get_manager(self, server_url: str) -> PooledMCPSessionManager:
+        manager = self._managers.get(server_url)
+        if manager is None:
+            manager = PooledMCPSessionManager(server_url)
+            self._managers[server_url] = manager
+        self._ensure_sweep()
+        return manager
+
+    def attach(self, toolset, server_url: str):
+        """Points an MCPToolset at the pooled manager for its server (replacing its private one)."""
+        if not self.enabled or not hasattr(toolset, _REQUIRED_TOOLSET_STATE):
+            return toolset
+        toolset._mcp_session_manager = self.get_manager(server_url)
+        return toolset
+
+    async def run(self, server_url: str, headers: dict | None, operation):
+        """
+        Runs `operation(session)` on a pooled session, reconnecting and retrying once if the
+        session turns out to be closed. Without pooling, a session is opened for this call only.
+        """
+        if not self.enabled:
+            manager = MCPSessionManager(connection_params=mcp_connection_params(server_url), errlog=None)
+            try:
+                return await operation(await manager.create_session(headers))
+            finally:
+                await manager.close()
+        manager = self.get_manager(server_url)
+        try:
+            return await operation(await manager.create_session(headers))
+        except anyio.ClosedResourceError:
+            logger.info(f"[MCPPool] Session for {server_url} was closed mid-call. Reconnecting.")
+            return await operation(await manager.create_session(headers))
+
+    async def close(self):
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+        for manager in list(self._managers.values()):
+            await manager.close_all()
+        self._managers.clear()
+
+    def _ensure_sweep(self):
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.get_running_loop().create_task(self._sweep())
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(MCP_KEEPALIVE_INTERVAL_SEC)
+            now = time.monotonic()
+            for server_url, manager in list(self._managers.items()):
+                try:
+                    await manager.close_idle(now)
+                except Exception as e:
+                    logger.warn(f"[MCPPool] Sweep failed for {server_url}: {e}")
+
+
+# Shared by agent runs and tool listing on the worker runtime's loop.
+mcp_session_pool = MCPSessionPool()
+
+__all__ = ['MCPSessionPool', 'PooledMCPSessionManager', 'mcp_session_pool', 'mcp_connection_params']
@@ -0,0 +1,129 @@
+# functions/common/pdf_extraction.py
+import os
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+from google.cloud import storage
+# Imported directly rather than through .core: pool workers are spawned and import this module,
+# and they must not initialize the Firebase Admin SDK.
+from firebase_functions import logger
+
+# Page-range extraction runs in a process pool when more than one worker is configured. Each
+# worker is a full interpreter with pypdf loaded, so the default stays at two even on larger
+# instances; raise PDF_EXTRACTION_WORKERS where memory allows.
+PDF_EXTRACTION_WORKERS = int(os.environ.get("PDF_EXTRACTION_WORKERS", min(2, os.cpu_count() or 1)))
+# Workers are recycled after this many page ranges, so memory held by pypdf and the reader cache is returned.
+PDF_WORKER_MAX_TASKS = int(os.environ.get("PDF_WORKER_MAX_TASKS", 50))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 25))
+PDF_READ_CHUNK_BYTES = 1024 * 1024
+PDF_TRUNCATION_NOTICE = "\n... [PDF CONTENT TRUNCATED]"
+
+_pool = None
+# Per-process reader for the most recent source, so consecutive page ranges skip re-parsing the xref.
+_reader_cache = {}
+_storage_client = None
+
+
+def _page_marker(page_number: int) -> str:
+    return f"--- Page {page_number} ---\n"
+
+
+def _open_reader(source: str) -> PdfReader:
+    """
+    Returns a PdfReader for a local path or a gs:// URI (read through ranged requests). Each pool
+    worker opens the object itself with one storage client per process: it then fetches only the
+    xref and the objects of its own pages, where shipping the bytes in would pickle up to
+    MAX_PDF_DOWNLOAD_BYTES into every task.
+    """
+    global _storage_client
+    reader = _reader_cache.get(source)
+    if reader is not None:
+        return reader
+    _reader_cache.clear()
+    if source.startswith("gs://"):
+        if _storage_client is None:
+            _storage_client = storage.Client()
+        stream = storage.Blob.from_string(source, client=_storage_client).open("rb", chunk_size=PDF_READ_CHUNK_BYTES)
+    else:
+        stream = open(source, "rb")
+    reader = PdfReader(stream)
+    _reader_cache[source] = reader
+    return reader
+
+
+def _extract_page_range(source: str, start: int, end: int, max_chars: int) -> list[tuple[int, str]]:
+    """Extracts pages [start, end) with markers, stopping once this range alone fills max_chars."""
+    reader = _open_reader(source)
+    pages, characters = [], 0
+    for index in range(start, end):
+        text = _page_marker(index + 1) + (reader.pages[index].extract_text() or "")
+        pages.append((index + 1, text))
+        characters += len(text)
+        if characters >= max_chars:
+            break
+    return pages
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked: the parent holds gRPC/HTTP clients that are not fork-safe.
+        _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACTION_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                    max_tasks_per_child=PDF_WORKER_MAX_TASKS)
+    return _pool
+
+
+def extract_pdf_text(source: str, max_chars: int) -> str:
+    """
+    Extracts text from a PDF at a local path or gs:// URI, page by page with page markers, and
+    stops as soon as max_chars is reached. Page ranges are extracted in parallel across the
+    process pool, a window of PDF_EXTRACTION_WORKERS ranges at a time, and assembled in page order.
+    """
+    started_at = time.perf_counter()
+    reader = _open_reader(source)
+    chunks, characters, last_page = [], 0, 0
+    in_flight, next_range = deque(), 0
+    try:
+        if reader.is_encrypted:
+            raise ValueError("PDF is encrypted.")
+        page_count = len(reader.pages)
+        ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count)) for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+        parallel = PDF_EXTRACTION_WORKERS > 1 and len(ranges) > 1
+        while characters < max_chars:
+            if parallel:
+                while next_range < len(ranges) and len(in_flight) < PDF_EXTRACTION_WORKERS:
+                    in_flight.append(_get_pool().submit(_extract_page_range, source, *ranges[next_range], max_chars))
+                    next_range += 1
+                if not in_flight:
+                    break
+                pages = in_flight.popleft().result()
+            else:
+                if next_range >= len(ranges):
+                    break
+                pages = _extract_page_range(source, *ranges[next_range], max_chars - characters)
+                next_range += 1
+            for page_number, text in pages:
+                chunks.append(text)
+                characters += len(text)
+                last_page = page_number
+                if characters >= max_chars:
+                    break
+    finally:
+        # Ranges past the budget are dropped; ones already running finish on their own, bounded by max_chars.
+        for future in in_flight:
+            future.cancel()
+        _reader_cache.pop(source, None)
+        reader.stream.close()
+
+    text_content = "\n\n".join(chunks)
+    if len(text_content) > max_chars or last_page < page_count:
+        text_content = text_content[:max_chars] + PDF_TRUNCATION_NOTICE
+    logger.info(f"[PdfExtraction] Extracted {last_page}/{page_count} pages ({len(text_content)} characters) in "
+                f"{(time.perf_counter() - started_at) * 1000:.0f} ms ({PDF_EXTRACTION_WORKERS if parallel else 1} worker(s)).")
+    return text_content
+
+
+__all__ = ['extract_pdf_text', 'PDF_EXTRACTION_WORKERS', 'PDF_PAGES_PER_TASK']
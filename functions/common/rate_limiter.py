@@ -0,0 +1,200 @@
+# functions/common/rate_limiter.py
+import os
+import json
+import time
+import asyncio
+import hashlib
+import contextvars
+
+from firebase_admin import firestore
+from .core import logger, get_async_db
+from .tokens import estimate_tokens
+
+# Default limits per LiteLLM provider, e.g. {"openai": {"requestsPerMinute": 500, "tokensPerMinute": 200000}}.
+# A model document's own `requestsPerMinute` / `tokensPerMinute` take precedence.
+PROVIDER_RATE_LIMITS = json.loads(os.environ.get("PROVIDER_RATE_LIMITS", "{}"))
+# "local" keeps buckets per instance; "firestore" shares them across instances through RATE_LIMIT_COLLECTION.
+RATE_LIMIT_COORDINATION = os.environ.get("RATE_LIMIT_COORDINATION", "local")
+RATE_LIMIT_COLLECTION = "rateLimitBuckets"
+# Waiters re-check their bucket at least this often, so refills from other instances are noticed.
+RATE_LIMIT_MAX_POLL_SEC = 5.0
+
+# Per-run accumulator for time spent waiting on rate limits; set by the task executor.
+rate_limit_wait_metrics = contextvars.ContextVar("rate_limit_wait_metrics", default=None)
+_pending_token_estimate = contextvars.ContextVar("pending_token_estimate", default=None)
+
+
+def rate_limit_key(provider: str | None, api_key: str | None) -> str:
+    """Bucket key for a provider and API key; keys are fingerprinted, never stored."""
+    key_fingerprint = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else "default"
+    return f"{provider or 'custom'}:{key_fingerprint}"
+
+
+def resolve_rate_limits(model_config: dict) -> tuple[float | None, float | None] | None:
+    """Returns (requests per minute, tokens per minute) for a model config, or None when unlimited."""
+    provider_limits = PROVIDER_RATE_LIMITS.get(model_config.get("provider") or "", {})
+    requests_per_minute = model_config.get("requestsPerMinute") or provider_limits.get("requestsPerMinute")
+    tokens_per_minute = model_config.get("tokensPerMinute") or provider_limits.get("tokensPerMinute")
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    return (float(requests_per_minute) if requests_per_minute else None,
+            float(tokens_per_minute) if tokens_per_minute else None)
+
+
+def _take(state: dict, limits, request_count: int, token_count: int, now: float) -> tuple[dict, float]:
+    """
+    Refills a bucket pair (capacity = the per-minute limit, refilled continuously) and takes
+    request_count requests and token_count tokens if both are available. Returns the new state
+    and 0.0, or the unchanged state and the seconds until the request would fit.
+    """
+    requests_per_minute, tokens_per_minute = limits
+    elapsed = max(now - state.get("updatedAt", now), 0.0)
+    levels, wait_sec = {}, 0.0
+    for field, limit, amount in (("requests", requests_per_minute, request_count), ("tokens", tokens_per_minute, token_count)):
+        if not limit:
+            continue
+        level = min(limit, state.get(field, limit) + elapsed * limit / 60.0)
+        amount = min(amount, limit)  # A single call larger than the bucket waits for a full bucket.
+        if level < amount:
+            wait_sec = max(wait_sec, (amount - level) * 60.0 / limit)
+        levels[field] = level - amount
+    if wait_sec > 0:
+        return state, wait_sec
+    return {**state, **levels, "updatedAt": now}, 0.0
+
+
+class LocalBucketStore:
+    """Token buckets held in process memory."""
+
+    def __init__(self):
+        self._states = {}
+
+    async def try_take(self, key: str, limits, request_count: int, token_count: int) -> float:
+        state, wait_sec = _take(self._states.get(key, {}), limits, request_count, token_count, time.time())
+        self._states[key] = state
+        return wait_sec
+
+    async def adjust_tokens(self, key: str, token_delta: int):
+        state = self._states.get(key)
+        if state is not None and "tokens" in state:
+            state["tokens"] -= token_delta
+
+
+class FirestoreBucketStore:
+    """Token buckets shared by all instances; each take is a Firestore transaction."""
+
+    async def try_take(self, key: str, limits, request_count: int, token_count: int) -> float:
+        async_db = get_async_db()
+        bucket_ref = async_db.collection(RATE_LIMIT_COLLECTION).document(key.replace("/", "_"))
+
+        @firestore.async_transactional
+        async def take_in_transaction(transaction):
+            snap = await bucket_ref.get(transaction=transaction)
+            state, wait_sec = _take(snap.to_dict() if snap.exists else {}, limits, request_count, token_count, time.time())
+            if wait_sec == 0:
+                transaction.set(bucket_ref, state)
+            return wait_sec
+
+        return await take_in_transaction(async_db.transaction())
+
+    async def adjust_tokens(self, key: str, token_delta: int):
+        async_db = get_async_db()
+        bucket_ref = async_db.collection(RATE_LIMIT_COLLECTION).document(key.replace("/", "_"))
+
+        @firestore.async_transactional
+        async def adjust_in_transaction(transaction):
+            snap = await bucket_ref.get(transaction=transaction)
+            # Like LocalBucketStore, a bucket that does not exist (yet) counts as full: nothing to settle.
+            if snap.exists and "tokens" in snap.to_dict():
+                transaction.set(bucket_ref, {"tokens": firestore.Increment(-token_delta)}, merge=True)
+
+        await adjust_in_transaction(async_db.transaction())
+
+
+class RateLimiter:
+    """
+    Per provider/API-key request and token buckets shared by every run on the instance (or, with
+    Firestore coordination, across instances). Callers that exceed a limit queue until the
+    bucket refills rather than failing; time spent waiting is added to rate_limit_wait_metrics.
+    """
+
+    def __init__(self, store=None):
+        self.store = store or (FirestoreBucketStore() if RATE_LIMIT_COORDINATION == "firestore" else LocalBucketStore())
+        self._queues = {}  # key -> asyncio.Lock; waiters for one bucket are served in arrival order
+
+    async def acquire(self, key: str, limits, token_count: int) -> float:
+        """Waits until one request and token_count tokens are available. Returns seconds waited."""
+        started_at = time.perf_counter()
+        async with self._queues.setdefault(key, asyncio.Lock()):
+            while True:
+                try:
+                    wait_sec = await self.store.try_take(key, limits, 1, token_count)
+                except Exception as e:
+                    # Coordination problems must not block runs; proceed unthrottled.
+                    logger.warn(f"[RateLimiter] Bucket check failed for {key}: {e}")
+                    break
+                if wait_sec == 0:
+                    break
+                await asyncio.sleep(min(wait_sec, RATE_LIMIT_MAX_POLL_SEC))
+        waited_sec = time.perf_counter() - started_at
+        metrics = rate_limit_wait_metrics.get()
+        if metrics is not None:
+            metrics["waitSec"] = metrics.get("waitSec", 0.0) + waited_sec
+        if waited_sec >= 0.05:
+            logger.info(f"[RateLimiter] Waited {waited_sec * 1000:.0f} ms for {key} ({token_count} estimated tokens).")
+        return waited_sec
+
+    async def settle(self, key: str, token_delta: int):
+        """Charges (or refunds) the difference between estimated and reported token usage."""
+        if not token_delta:
+            return
+        try:
+            await self.store.adjust_tokens(key, token_delta)
+        except Exception as e:
+            logger.warn(f"[RateLimiter] Token settlement failed for {key}: {e}")
+
+    def model_callbacks(self, key: str, limits):
+        """Returns (before_model_callback, after_model_callback) that throttle an ADK LlmAgent."""
+
+        async def before_model_callback(callback_context, llm_request):
+            estimate = estimate_request_tokens(llm_request)
+            await self.acquire(key, limits, estimate)
+            _pending_token_estimate.set(estimate)
+            return None
+
+        async def after_model_callback(callback_context, llm_response):
+            usage = getattr(llm_response, "usage_metadata", None)
+            estimate = _pending_token_estimate.get()
+            if usage is None or getattr(llm_response, "partial", False) or estimate is None:
+                return None
+            _pending_token_estimate.set(None)
+            if usage.total_token_count is not None and limits[1]:
+                await self.settle(key, usage.total_token_count - estimate)
+            return None
+
+        return before_model_callback, after_model_callback
+
+
+def estimate_request_tokens(llm_request) -> int:
+    """Rough prompt-plus-completion estimate (see estimate_tokens) used to reserve tokens."""
+    texts = [part.text for content in llm_request.contents or [] for part in content.parts or [] if part.text]
+    config = llm_request.config
+    if config is not None and isinstance(config.system_instruction, str):
+        texts.append(config.system_instruction)
+    max_output_tokens = (config.max_output_tokens if config is not None else None) or 0
+    return estimate_tokens("".join(texts)) + max_output_tokens
+
+
+# Shared by every run on this instance.
+rate_limiter = RateLimiter()
+
+__all__ = [
+    'RateLimiter',
+    'LocalBucketStore',
+    'FirestoreBucketStore',
+    'rate_limiter',
+    'rate_limit_key',
+    'resolve_rate_limits',
+    'rate_limit_wait_metrics',
+    'estimate_request_tokens',
+]
@@ -0,0 +1,10 @@
+# functions/common/tokens.py
+# Dependency-free so lightweight handlers (context uploads) can use it without importing the task executor.
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap, model-agnostic token estimate (roughly four characters per token)."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+__all__ = ['estimate_tokens']
@@ -0,0 +1,134 @@
+# functions/common/worker_runtime.py
+import asyncio
+import atexit
+import inspect
+import threading
+import time
+
+from .core import logger
+
+
+class WorkerRuntime:
+    """
+    Keeps one asyncio event loop alive in a background thread for the lifetime of the instance,
+    plus a registry of shared clients created on that loop. Synchronous entry points (Cloud Tasks
+    handlers) submit coroutines with `run()` instead of paying for `asyncio.run()` and fresh
+    clients on every invocation. Clients registered with a `close` callback are torn down, in
+    reverse creation order, by `shutdown()`.
+    """
+
+    def __init__(self, name: str = "worker-runtime"):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._clients = {}  # name -> client
+        self._closers = []  # (name, close callable), in creation order
+        self._creation_locks = {}  # name -> threading.Lock held while that client's factory runs
+        self.runs = 0  # Coroutines submitted through run(); 0 means the next one pays the cold start.
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is not None and self._thread.is_alive():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(started.set)
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run_loop, name=self.name, daemon=True)
+            self._thread.start()
+            started.wait()
+            self._loop = loop
+            logger.info(f"[WorkerRuntime] Started long-lived event loop '{self.name}'.")
+            return loop
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._ensure_loop()
+
+    def owns_running_loop(self) -> bool:
+        """True when called from a coroutine running on the shared loop."""
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def run(self, coro, timeout: float | None = None):
+        """Runs a coroutine on the shared loop from synchronous code and returns its result."""
+        with self._lock:
+            self.runs += 1
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result(timeout)
+
+    def get_client(self, name: str, factory, close=None):
+        """
+        Returns the shared client registered under `name`, creating it with `factory()` on first
+        use. `close(client)` may be sync or async and is called on shutdown.
+        """
+        with self._lock:
+            client = self._clients.get(name)
+            if client is not None:
+                return client
+            creation_lock = self._creation_locks.setdefault(name, threading.Lock())
+        # factory() runs outside _lock: factories may touch the runtime themselves (e.g. `.loop`).
+        # The per-name lock still guarantees a single creation per client.
+        with creation_lock:
+            with self._lock:
+                client = self._clients.get(name)
+            if client is not None:
+                return client
+            client = factory()
+            with self._lock:
+                self._clients[name] = client
+                if close is not None:
+                    self._closers.append((name, close))
+            logger.info(f"[WorkerRuntime] Created shared client '{name}'.")
+            return client
+
+    def discard_client(self, name: str):
+        """Forgets a shared client (without closing it) so the next get_client creates a new one."""
+        with self._lock:
+            self._clients.pop(name, None)
+            self._closers = [(n, c) for n, c in self._closers if n != name]
+
+    async def _close_clients(self):
+        with self._lock:
+            closers, clients = list(reversed(self._closers)), dict(self._clients)
+            self._closers, self._clients = [], {}
+        for name, close in closers:
+            client = clients.get(name)
+            if client is None:
+                continue
+            try:
+                result = close(client)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.warn(f"[WorkerRuntime] Error closing shared client '{name}': {e}")
+
+    def shutdown(self, timeout: float = 10.0):
+        """Closes every registered client and stops the loop."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+        if loop is None or not thread.is_alive():
+            return
+        started_at = time.perf_counter()
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_clients(), loop).result(timeout)
+        except Exception as e:
+            logger.warn(f"[WorkerRuntime] Client teardown did not finish cleanly: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        loop.close()
+        logger.info(f"[WorkerRuntime] Shut down '{self.name}' in {(time.perf_counter() - started_at) * 1000:.1f} ms.")
+
+
+# Shared by every task handled on this instance.
+worker_runtime = WorkerRuntime()
+atexit.register(worker_runtime.shutdown)
+
+__all__ = ['WorkerRuntime', 'worker_runtime']
@@ -1,48 +1,337 @@
 # functions/handlers/context_handler.py
 import os
+import time
+import codecs
+import threading
+import asyncio
 import base64
 import uuid
+import hashlib
+import tarfile
 import requests
 import httpx
 from google.cloud import storage
+from google.api_core import exceptions as gcs_exceptions
 import io
-from pypdf import PdfReader
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import Future
 
 from firebase_functions import https_fn
-from common.core import logger
+from common.core import logger, db
+from common.html_text import HtmlTextExtractor
+from common.pdf_extraction import extract_pdf_text
+from common.tokens import estimate_tokens
 
 
 # --- Generic GCS Uploader Helper ---
-def _upload_bytes_to_gcs(user_id: str, file_bytes: bytes, file_name: str, mime_type: str, context_type: str):
-    """Uploads a byte string to GCS and returns a structured response."""
-    logger.info(f"Uploading context file for user {user_id} to GCS: {file_name}, type: {context_type}, mimeType: {mime_type}")
+# Context files are stored once per user and content hash under users/{uid}/, so re-attaching the
+# same PDF or page reuses one object while each user's uploads stay listable and deletable by prefix.
+# Objects are never shared across users. The bucket is only reachable with service credentials.
+CONTENT_ADDRESSED_DIR = "files/sha256/"
+# Buckets already known to exist in this process; avoids a bucket.exists() round trip per upload.
+_verified_buckets = set()
+# Process-wide counters behind the dedupe ratio that is logged after every upload.
+_upload_stats = {"uploads": 0, "deduplicated": 0}
+
+# Downloads are streamed to GCS in chunks, so peak memory does not grow with the source size.
+# Resumable upload chunks must be a multiple of 256 KB.
+STREAM_CHUNK_BYTES = 1024 * 1024
+STREAM_STAGING_PREFIX = "staging/"
+MAX_WEB_PAGE_BYTES = 20 * 1024 * 1024
+MAX_PDF_DOWNLOAD_BYTES = 200 * 1024 * 1024
+FETCH_HEADERS = {'User-Agent': 'AgentLab-ContextFetcher/1.0'}
+
+def _get_context_bucket():
     from common.config import get_gcp_project_config
-    try:
-        project_id, _, _ = get_gcp_project_config()
-        bucket_name = f"{project_id}-context-uploads"
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        if not bucket.exists():
-            logger.warning(f"Storage bucket '{bucket_name}' not found. Creating it with default settings.")
+    project_id, _, _ = get_gcp_project_config()
+    bucket_name = f"{project_id}-context-uploads"
+    storage_client = storage.Client()
+    bucket = storage_client.bucket(bucket_name)
+    if bucket_name in _verified_buckets:
+        return bucket
+    if not bucket.exists():
+        logger.warning(f"Storage bucket '{bucket_name}' not found. Creating it with default settings.")
+        try:
             bucket = storage_client.create_bucket(bucket, location=os.environ.get("FUNCTION_REGION", "us-central1"))
+        except gcs_exceptions.Conflict:
+            logger.info(f"Storage bucket '{bucket_name}' was created concurrently.")
+    _verified_buckets.add(bucket_name)
+    return bucket
+
+def _content_blob_path(user_id: str, content_hash: str, file_name: str):
+    _, file_extension = os.path.splitext(file_name)
+    return f"users/{user_id}/{CONTENT_ADDRESSED_DIR}{content_hash}{file_extension.lower()}"
 
-        _, file_extension = os.path.splitext(file_name)
-        unique_filename = f"{uuid.uuid4().hex}{file_extension}"
-        blob_path = f"users/{user_id}/files/{unique_filename}"
-        blob = bucket.blob(blob_path)
+def _record_upload(deduplicated: bool):
+    _upload_stats["uploads"] += 1
+    if deduplicated:
+        _upload_stats["deduplicated"] += 1
+    ratio = _upload_stats["deduplicated"] / _upload_stats["uploads"]
+    logger.info(f"Context upload dedupe ratio: {ratio:.2%} ({_upload_stats['deduplicated']}/{_upload_stats['uploads']} uploads reused an existing object).")
 
-        blob.upload_from_string(file_bytes, content_type=mime_type)
+def _upload_bytes_to_gcs(user_id: str, file_bytes: bytes, file_name: str, mime_type: str, context_type: str, metadata: dict | None = None):
+    """Uploads a byte string to GCS, reusing an existing object with the same content hash, and returns a structured response."""
+    logger.info(f"Uploading context file for user {user_id} to GCS: {file_name}, type: {context_type}, mimeType: {mime_type}")
+    try:
+        bucket = _get_context_bucket()
+        content_hash = hashlib.sha256(file_bytes).hexdigest()
+        blob_path = _content_blob_path(user_id, content_hash, file_name)
+
+        # Metadata lookup only; the object body is never downloaded.
+        deduplicated = bucket.get_blob(blob_path) is not None
+        if not deduplicated:
+            blob = bucket.blob(blob_path)
+            blob.metadata = {"sha256": content_hash, **(metadata or {})}
+            try:
+                # if_generation_match=0 makes a concurrent upload of the same content a no-op for the loser.
+                blob.upload_from_string(file_bytes, content_type=mime_type, if_generation_match=0)
+            except gcs_exceptions.PreconditionFailed:
+                deduplicated = True
         # No need to make public, we will use signed URLs or direct GCS access
+        _record_upload(deduplicated)
 
-        storage_uri = f"gs://{bucket.name}/{blob.name}"
-        logger.info(f"Context file for user {user_id} uploaded to {storage_uri}.")
+        storage_uri = f"gs://{bucket.name}/{blob_path}"
+        logger.info(f"Context file for user {user_id} {'deduplicated to existing' if deduplicated else 'uploaded to'} {storage_uri}.")
         return {"success": True, "name": file_name, "storageUrl": storage_uri, "type": context_type, "mimeType": mime_type}
     except Exception as e:
         logger.error(f"Error during GCS upload for user {user_id}: {e}", exc_info=True)
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to upload context file: {e}")
 
+def _too_large_error(url: str, max_bytes: int):
+    return https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message=f"Content at {url} exceeds the {max_bytes // (1024 * 1024)} MB limit.")
+
+def _stream_response_to_gcs(user_id: str, url: str, response: httpx.Response, file_name: str, max_bytes: int, mime_type: str,
+                            persist: bool = True):
+    """
+    Streams an open HTTP response body into the context bucket through a resumable upload,
+    hashing it on the way, then moves it to its content-addressed path (or drops it if that
+    object exists). The byte cap is checked against Content-Length before reading and again
+    on every chunk. With persist=False the staging object itself is returned and the caller
+    must delete it. Returns (blob, size_bytes).
+    """
+    bucket = _get_context_bucket()
+    staging_blob = bucket.blob(f"{STREAM_STAGING_PREFIX}{uuid.uuid4().hex}")
+    hasher, size_bytes, writer, completed = hashlib.sha256(), 0, None, False
+    try:
+        if int(response.headers.get("Content-Length") or 0) > max_bytes:
+            raise _too_large_error(url, max_bytes)
+        for chunk in response.iter_bytes(STREAM_CHUNK_BYTES):
+            size_bytes += len(chunk)
+            if size_bytes > max_bytes:
+                raise _too_large_error(url, max_bytes)
+            hasher.update(chunk)
+            if writer is None:
+                writer = staging_blob.open("wb", chunk_size=STREAM_CHUNK_BYTES, content_type=mime_type)
+            writer.write(chunk)
+        if writer is None:
+            # Zero-byte body: no resumable session was started, so create the empty object directly.
+            staging_blob.upload_from_string(b"", content_type=mime_type)
+        else:
+            writer.close()
+        completed = True
+    finally:
+        if writer is not None and not completed:
+            # A BlobWriter finalizes whatever it has on close (including at garbage collection),
+            # so an aborted download is closed explicitly and its staging object removed.
+            try:
+                writer.close()
+                staging_blob.delete()
+            except Exception as cleanup_error:
+                logger.warn(f"Could not clean up staging object {staging_blob.name}: {cleanup_error}")
+    if not persist:
+        logger.info(f"Streamed {size_bytes} bytes from {url} for user {user_id} to scratch object gs://{bucket.name}/{staging_blob.name}.")
+        return staging_blob, size_bytes
+
+    try:
+        content_hash = hasher.hexdigest()
+        blob_path = _content_blob_path(user_id, content_hash, file_name)
+        deduplicated = bucket.get_blob(blob_path) is not None
+        if not deduplicated:
+            try:
+                # Server-side copy; the body does not pass through this instance again.
+                blob = bucket.copy_blob(staging_blob, bucket, blob_path, if_generation_match=0)
+                blob.metadata = {"sha256": content_hash}
+                blob.patch()
+            except gcs_exceptions.PreconditionFailed:
+                deduplicated = True
+        _record_upload(deduplicated)
+    except Exception as e:
+        logger.error(f"Error finalizing streamed upload of {url} for user {user_id}: {e}", exc_info=True)
+        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to upload context file: {e}")
+    finally:
+        # The staging object is never needed past this point, including when the copy failed.
+        try:
+            staging_blob.delete()
+        except gcs_exceptions.NotFound:
+            pass
+        except Exception as cleanup_error:
+            logger.warn(f"Could not clean up staging object {staging_blob.name}: {cleanup_error}")
+    logger.info(f"Streamed {size_bytes} bytes from {url} for user {user_id} to gs://{bucket.name}/{blob_path}{' (deduplicated)' if deduplicated else ''}.")
+    return bucket.blob(blob_path), size_bytes
+
+def _stream_url_to_gcs(user_id: str, url: str, file_name: str, max_bytes: int, default_mime_type: str, persist: bool = True):
+    """Fetches a URL and streams it to GCS with _stream_response_to_gcs. Returns (blob, mime_type, size_bytes)."""
+    with httpx.Client(timeout=httpx.Timeout(20.0, read=60.0), follow_redirects=True) as client:
+        with client.stream("GET", url, headers=FETCH_HEADERS) as response:
+            response.raise_for_status()
+            mime_type = response.headers.get('Content-Type', default_mime_type).split(';')[0]
+            blob, size_bytes = _stream_response_to_gcs(user_id, url, response, file_name, max_bytes, mime_type, persist)
+    return blob, mime_type, size_bytes
+
 
     # --- Web Page Fetching ---
+# HTML pages are stored as extracted main-content text rather than raw markup.
+HTML_MIME_TYPES = {"text/html", "application/xhtml+xml"}
+# Fetched pages are cached per user and URL (results point into that user's storage prefix): within
+# WEB_PAGE_CACHE_FRESH_SEC the stored result is served without contacting the origin; after that it
+# is revalidated with ETag / Last-Modified.
+WEB_PAGE_CACHE_COLLECTION = "webPageCache"
+WEB_PAGE_CACHE_FRESH_SEC = int(os.environ.get("WEB_PAGE_CACHE_FRESH_SEC", 300))
+WEB_PAGE_CACHE_MEMORY_MAX_ENTRIES = 256
+
+
+class _WebPageCache:
+    """
+    Per-user, per-URL cache of fetch results and their validators. A bounded in-memory tier
+    serves warm instances; the Firestore tier (WEB_PAGE_CACHE_COLLECTION) is shared by all
+    instances. Stored results point at objects under the user's own prefix, so entries are
+    never served to another user.
+    """
+
+    def __init__(self, max_memory_entries: int = WEB_PAGE_CACHE_MEMORY_MAX_ENTRIES):
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()  # (user, url) hash -> {"result", "etag", "lastModified", "checkedAt"}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id: str, url: str) -> str:
+        return hashlib.sha256(f"{user_id}\n{url}".encode("utf-8")).hexdigest()
+
+    def get(self, user_id: str, url: str) -> dict | None:
+        key = self._key(user_id, url)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+        try:
+            snap = db.collection(WEB_PAGE_CACHE_COLLECTION).document(key).get()
+        except Exception as e:
+            logger.warn(f"[WebPageCache] Firestore read failed for {url}: {e}")
+            return None
+        if not snap.exists:
+            return None
+        entry = snap.to_dict()
+        self._remember(key, entry)
+        return entry
+
+    def put(self, user_id: str, url: str, entry: dict):
+        key = self._key(user_id, url)
+        self._remember(key, entry)
+        try:
+            db.collection(WEB_PAGE_CACHE_COLLECTION).document(key).set({**entry, "url": url, "userId": user_id})
+        except Exception as e:
+            # The fetch itself succeeded; only cross-instance reuse is lost.
+            logger.warn(f"[WebPageCache] Firestore write failed for {url}: {e}")
+
+    def _remember(self, key: str, entry: dict):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+
+_web_page_cache = _WebPageCache()
+# Fetches in progress on this instance, keyed by (user, URL); concurrent requests for one URL by one user share a single fetch.
+_inflight_web_fetches = {}
+_inflight_web_fetches_lock = threading.Lock()
+
+
+def _coalesced_web_fetch(user_id: str, url: str, fetch):
+    """Runs fetch() for url unless this user is already fetching it, in which case that result is shared."""
+    inflight_key = (user_id, url)
+    with _inflight_web_fetches_lock:
+        future = _inflight_web_fetches.get(inflight_key)
+        is_leader = future is None
+        if is_leader:
+            future = _inflight_web_fetches[inflight_key] = Future()
+    if not is_leader:
+        logger.info(f"Joining the in-flight fetch of {url}.")
+        return future.result()
+    try:
+        result = fetch()
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_web_fetches_lock:
+            _inflight_web_fetches.pop(inflight_key, None)
+
+
+def _extract_html_to_gcs(user_id: str, url: str, response: httpx.Response, file_name: str):
+    """Parses an HTML response incrementally into main-content text and uploads that text with its token count."""
+    if int(response.headers.get("Content-Length") or 0) > MAX_WEB_PAGE_BYTES:
+        raise _too_large_error(url, MAX_WEB_PAGE_BYTES)
+    try:
+        decoder = codecs.getincrementaldecoder(response.charset_encoding or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    extractor, size_bytes = HtmlTextExtractor(), 0
+    for chunk in response.iter_bytes(STREAM_CHUNK_BYTES):
+        size_bytes += len(chunk)
+        if size_bytes > MAX_WEB_PAGE_BYTES:
+            raise _too_large_error(url, MAX_WEB_PAGE_BYTES)
+        extractor.feed(decoder.decode(chunk))
+    extractor.feed(decoder.decode(b"", final=True))
+    text_content = extractor.close()
+    token_count = estimate_tokens(text_content)
+    logger.info(f"Extracted {len(text_content)} characters (~{token_count} tokens) of page text from {size_bytes} bytes of HTML at {url}.")
+    result = _upload_bytes_to_gcs(
+        user_id=user_id,
+        file_bytes=text_content.encode('utf-8'),
+        file_name=f"{os.path.splitext(file_name)[0]}.txt",
+        mime_type='text/plain',
+        context_type='webpage',
+        metadata={"tokenCount": str(token_count)}
+    )
+    return {**result, "tokenCount": token_count}
+
+
+def _fetch_web_page_with_cache(user_id: str, url: str):
+    cached = _web_page_cache.get(user_id, url)
+    if cached and time.time() - cached.get("checkedAt", 0) < WEB_PAGE_CACHE_FRESH_SEC:
+        logger.info(f"Serving {url} from the web page cache (checked {time.time() - cached['checkedAt']:.0f}s ago).")
+        return cached["result"]
+
+    headers = dict(FETCH_HEADERS)
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("lastModified"):
+        headers["If-Modified-Since"] = cached["lastModified"]
+    file_name_from_url = url.split('/')[-1] or "webpage.html"
+    with httpx.Client(timeout=httpx.Timeout(20.0, read=60.0), follow_redirects=True) as client:
+        with client.stream("GET", url, headers=headers) as response:
+            if cached and response.status_code == 304:
+                logger.info(f"Web page {url} not modified since the cached fetch; reusing {cached['result'].get('storageUrl')}.")
+                _web_page_cache.put(user_id, url, {**cached, "checkedAt": time.time()})
+                return cached["result"]
+            response.raise_for_status()
+            mime_type = response.headers.get('Content-Type', 'text/plain; charset=utf-8').split(';')[0]
+            if mime_type in HTML_MIME_TYPES:
+                result = _extract_html_to_gcs(user_id, url, response, file_name_from_url)
+            else:
+                blob, size_bytes = _stream_response_to_gcs(user_id, url, response, file_name_from_url, MAX_WEB_PAGE_BYTES, mime_type)
+                logger.info(f"Fetched web page content from {url}, size: {size_bytes} bytes, mimeType: {mime_type}")
+                result = {"success": True, "name": file_name_from_url, "storageUrl": f"gs://{blob.bucket.name}/{blob.name}", "type": 'webpage', "mimeType": mime_type}
+            validators = {"etag": response.headers.get("ETag"), "lastModified": response.headers.get("Last-Modified")}
+    _web_page_cache.put(user_id, url, {"result": result, **validators, "checkedAt": time.time()})
+    return result
+
+
 def _fetch_web_page_content_logic(req: https_fn.CallableRequest):
     logger.info(f"[_fetch_web_page_content_logic] Function called with data keys: {list(req.data.keys()) if isinstance(req.data, dict) else 'Non-dict data'}")
     if not req.auth:
@@ -53,23 +342,9 @@ def _fetch_web_page_content_logic(req: https_fn.CallableRequest):
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="URL is required.")
 
     try:
-        headers = {'User-Agent': 'AgentLab-ContextFetcher/1.0'}
         logger.info(f"[_fetch_web_page_content_logic] Fetching web page content from URL: {url}")
-        with httpx.Client(timeout=20.0) as client:
-            response = client.get(url, headers=headers)
-            response.raise_for_status()
-            raw_content_bytes = response.content
-            mime_type = response.headers.get('Content-Type', 'text/plain; charset=utf-8').split(';')[0]
-            file_name_from_url = url.split('/')[-1] or "webpage.html"
-        logger.info(f"Fetched web page content from {url}, size: {len(raw_content_bytes)} bytes, mimeType: {mime_type}")
-        return _upload_bytes_to_gcs(
-            user_id=req.auth.uid,
-            file_bytes=raw_content_bytes,
-            file_name=file_name_from_url,
-            mime_type=mime_type,
-            context_type='webpage'
-        )
-    except httpx.RequestError as err:
+        return _coalesced_web_fetch(req.auth.uid, url, lambda: _fetch_web_page_with_cache(req.auth.uid, url))
+    except httpx.HTTPError as err:
         logger.error(f"Error fetching web page {url}: {err}")
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to fetch web page: {str(err)}")
 
@@ -78,61 +353,200 @@ def _fetch_web_page_content_logic(req: https_fn.CallableRequest):
 GITHUB_API_BASE = "https://api.github.com"
 NEW_FILE_SEPARATOR = "\n\n---<newfile>--\n\n"
 
+# Archive mode streams the repository tarball once instead of listing and fetching file by file.
+MAX_ARCHIVE_BYTES = 512 * 1024 * 1024
+MAX_REPO_FILE_BYTES = 1024 * 1024
+ARCHIVE_CHUNK_BYTES = 64 * 1024
+
 def get_github_token():
     return os.environ.get("GITHUB_TOKEN")
 
-def fetch_repo_file_content(session: httpx.Client, owner, repo, path, token):
-    headers = {"Accept": "application/vnd.github.v3.raw"}
+def _extension_allowed(file_name, include_ext, exclude_ext):
+    _, ext_with_dot = os.path.splitext(file_name)
+    ext = ext_with_dot.lstrip('.').lower() if ext_with_dot else ""
+    return not (include_ext and ext not in include_ext) and not (exclude_ext and ext in exclude_ext)
+
+class _StreamingResponseReader(io.RawIOBase):
+    """Read-only file object over an httpx streaming response, so tarfile can decompress it as it arrives."""
+
+    def __init__(self, response: httpx.Response, max_bytes: int):
+        self._chunks = response.iter_bytes(ARCHIVE_CHUNK_BYTES)
+        self._buffer = b""
+        self._max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self.bytes_read += len(chunk)
+            if self.bytes_read > self._max_bytes:
+                raise ValueError(f"Repository archive exceeds {self._max_bytes // (1024 * 1024)} MB.")
+            self._buffer = chunk
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+def collect_repo_files_from_archive(session: httpx.Client, owner, repo, ref, token, directory, include_ext, exclude_ext, max_total_size):
+    """
+    Streams the repository tarball for `ref` (default branch if empty) and returns
+    (content_chunks, file_count, total_content_size) in the same shape the contents-API path
+    builds. Filters and byte limits are applied per member while decompressing; nothing is
+    written to disk.
+    """
+    headers = {"Accept": "application/vnd.github+json"}
     if token:
         headers["Authorization"] = f"token {token}"
-    file_url = f"{GITHUB_API_BASE}/repos/{owner}/{repo}/contents/{path}"
-    try:
-        response = session.get(file_url, headers=headers, timeout=15)
+    archive_url = f"{GITHUB_API_BASE}/repos/{owner}/{repo}/tarball" + (f"/{ref}" if ref else "")
+    directory_prefix = f"{directory.strip('/')}/" if directory.strip('/') else ""
+    content_chunks, file_count, total_content_size, skipped_binary = [], 0, 0, 0
+    with session.stream("GET", archive_url, headers=headers, timeout=httpx.Timeout(30.0, read=120.0), follow_redirects=True) as response:
         response.raise_for_status()
-        return response.text
-    except httpx.RequestError as e:
-        logger.warn(f"Failed to fetch content for {path} in {owner}/{repo}: {e}")
-        return None
+        reader = _StreamingResponseReader(response, MAX_ARCHIVE_BYTES)
+        with tarfile.open(fileobj=io.BufferedReader(reader, ARCHIVE_CHUNK_BYTES), mode="r|gz") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                # Members are prefixed with a "<owner>-<repo>-<sha>/" directory.
+                path = member.name.split("/", 1)[1] if "/" in member.name else member.name
+                if not path.startswith(directory_prefix) or not _extension_allowed(path.rsplit("/", 1)[-1], include_ext, exclude_ext):
+                    continue
+                file_count += 1
+                if member.size > MAX_REPO_FILE_BYTES:
+                    content_chunks.append(f"{path}\n... [FILE TOO LARGE ({member.size} bytes), SKIPPED] ...")
+                    continue
+                if total_content_size + member.size > max_total_size:
+                    content_chunks.append(f"{path}\n... [TOTAL CONTENT LIMIT REACHED, FILE SKIPPED] ...")
+                    continue
+                file_bytes = archive.extractfile(member).read()
+                if b"\x00" in file_bytes:
+                    skipped_binary += 1
+                    file_count -= 1
+                    continue
+                content = file_bytes.decode("utf-8", errors="replace")
+                content_chunks.append(f"{path}\n{content}")
+                total_content_size += len(content)
+        logger.info(f"Streamed {reader.bytes_read} archive bytes for {owner}/{repo}@{ref or 'default branch'}: "
+                    f"{file_count} matching files, {skipped_binary} binary files skipped.")
+    return content_chunks, file_count, total_content_size
 
-def list_repo_files_recursive(session: httpx.Client, owner, repo, path, token, include_ext, exclude_ext, files_list, processed_paths, depth=0):
-    if depth > 10:
-        logger.warn(f"Max recursion depth reached for path: '{path}' in {owner}/{repo}")
-        return
-    MAX_FILES_PER_REPO = 100
-    if len(files_list) >= MAX_FILES_PER_REPO:
-        return
-    headers = {"Accept": "application/vnd.github.v3+json"}
+# Tree mode lists the repository with one git/trees call and fetches the selected files concurrently.
+GIT_FETCH_CONCURRENCY = 16
+GIT_FETCH_MAX_RETRIES = 4
+GIT_RATE_LIMIT_MAX_WAIT_SEC = 60
+BINARY_FILE_EXTENSIONS = {
+    "png", "jpg", "jpeg", "gif", "bmp", "ico", "webp", "pdf", "zip", "gz", "tgz", "bz2", "xz", "7z", "tar",
+    "jar", "war", "class", "so", "dll", "dylib", "exe", "bin", "o", "a", "pyc", "woff", "woff2", "ttf",
+    "otf", "eot", "mp3", "mp4", "mov", "avi", "wav", "ogg", "webm", "psd", "sqlite", "db", "parquet",
+}
+
+def _github_headers(token, accept):
+    headers = {"Accept": accept}
     if token:
         headers["Authorization"] = f"token {token}"
-    contents_url_path_part = f"/{path.strip('/')}" if path.strip('/') else ""
-    contents_url = f"{GITHUB_API_BASE}/repos/{owner}/{repo}/contents{contents_url_path_part}"
-    try:
-        response = session.get(contents_url, headers=headers, timeout=20)
-        response.raise_for_status()
-        contents = response.json()
-        if not isinstance(contents, list): return
-
-        tasks = []
-        for item in contents:
-            if len(files_list) >= MAX_FILES_PER_REPO: break
-            item_path, item_type, item_name = item.get("path"), item.get("type"), item.get("name")
-            if not all([item_path, item_type, item_name]) or item_path in processed_paths: continue
-            processed_paths.add(item_path)
-            if item_type == "file":
-                _, ext_with_dot = os.path.splitext(item_name)
-                ext = ext_with_dot.lstrip('.').lower() if ext_with_dot else ""
-                should_include = not (include_ext and ext not in include_ext) and not (exclude_ext and ext in exclude_ext)
-                if should_include:
-                    files_list.append({"path": item_path, "name": item_name})
-            elif item_type == "dir":
-                task = list_repo_files_recursive(session, owner, repo, item_path, token, include_ext, exclude_ext, files_list, processed_paths, depth + 1)
-                tasks.append(task)
-
-    except httpx.HTTPStatusError as e:
-        if e.response is not None and e.response.status_code == 404:
-            logger.warn(f"Directory/path '{path}' not found in {owner}/{repo} (404).")
-            return
-        raise
+    return headers
+
+def _rate_limit_delay(response: httpx.Response, attempt: int):
+    """Seconds to wait before retrying a GitHub response, or None if it should not be retried."""
+    if response.status_code in (403, 429):
+        if response.headers.get("retry-after"):
+            return min(float(response.headers["retry-after"]), GIT_RATE_LIMIT_MAX_WAIT_SEC)
+        if response.headers.get("x-ratelimit-remaining") == "0" and response.headers.get("x-ratelimit-reset"):
+            return min(max(float(response.headers["x-ratelimit-reset"]) - time.time(), 1.0), GIT_RATE_LIMIT_MAX_WAIT_SEC)
+        return None
+    if response.status_code >= 500:
+        return min(2 ** attempt, GIT_RATE_LIMIT_MAX_WAIT_SEC)
+    return None
+
+async def _github_get(client: httpx.AsyncClient, url, headers, params=None):
+    """GET with backoff on rate limiting and server errors; raises for other error statuses."""
+    for attempt in range(GIT_FETCH_MAX_RETRIES + 1):
+        response = await client.get(url, headers=headers, params=params)
+        delay = _rate_limit_delay(response, attempt) if response.status_code >= 400 else None
+        if delay is None or attempt == GIT_FETCH_MAX_RETRIES:
+            response.raise_for_status()
+            return response
+        logger.warn(f"GitHub returned {response.status_code} for {url}; retrying in {delay:.1f}s (attempt {attempt + 1}).")
+        await asyncio.sleep(delay)
+
+async def list_repo_files_from_tree(client: httpx.AsyncClient, owner, repo, ref, token, directory, include_ext, exclude_ext):
+    """
+    Lists every blob under `directory` with one recursive git/trees call and returns the ones
+    that pass the extension filters, are not binary by extension and fit MAX_REPO_FILE_BYTES,
+    sorted by path. Oversized files are returned with `skipped: True` so the bundle can say so.
+    """
+    tree_url = f"{GITHUB_API_BASE}/repos/{owner}/{repo}/git/trees/{ref or 'HEAD'}"
+    response = await _github_get(client, tree_url, _github_headers(token, "application/vnd.github+json"), params={"recursive": "1"})
+    tree = response.json()
+    if tree.get("truncated"):
+        logger.warn(f"Tree listing for {owner}/{repo}@{ref or 'HEAD'} was truncated by GitHub; some files are missing.")
+    directory_prefix = f"{directory.strip('/')}/" if directory.strip('/') else ""
+    selected = []
+    for entry in tree.get("tree", []):
+        path = entry.get("path", "")
+        if entry.get("type") != "blob" or not path.startswith(directory_prefix):
+            continue
+        file_name = path.rsplit("/", 1)[-1]
+        if not _extension_allowed(file_name, include_ext, exclude_ext):
+            continue
+        if os.path.splitext(file_name)[1].lstrip(".").lower() in BINARY_FILE_EXTENSIONS:
+            continue
+        selected.append({"path": path, "size": entry.get("size", 0), "skipped": entry.get("size", 0) > MAX_REPO_FILE_BYTES})
+    return sorted(selected, key=lambda file_meta: file_meta["path"])
+
+async def fetch_repo_files_concurrently(client: httpx.AsyncClient, owner, repo, ref, token, files_meta):
+    """Fetches raw file contents with at most GIT_FETCH_CONCURRENCY requests in flight; None marks a failure."""
+    semaphore = asyncio.Semaphore(GIT_FETCH_CONCURRENCY)
+    headers = _github_headers(token, "application/vnd.github.v3.raw")
+    params = {"ref": ref} if ref else None
+
+    async def fetch(file_meta):
+        async with semaphore:
+            try:
+                response = await _github_get(client, f"{GITHUB_API_BASE}/repos/{owner}/{repo}/contents/{file_meta['path']}", headers, params=params)
+                return response.text
+            except httpx.HTTPError as e:
+                logger.warn(f"Failed to fetch content for {file_meta['path']} in {owner}/{repo}: {e}")
+                return None
+
+    return await asyncio.gather(*(fetch(file_meta) for file_meta in files_meta))
+
+async def collect_repo_files_from_tree(owner, repo, ref, token, directory, include_ext, exclude_ext, max_total_size):
+    """
+    Returns (content_chunks, file_count, total_content_size) for tree mode. Because the tree
+    reports sizes, files that would overflow max_total_size are skipped before downloading.
+    """
+    async with httpx.AsyncClient(timeout=httpx.Timeout(20.0), http2=True) as client:
+        files_meta = await list_repo_files_from_tree(client, owner, repo, ref, token, directory, include_ext, exclude_ext)
+        planned_size = 0
+        for file_meta in files_meta:
+            if file_meta["skipped"]:
+                continue
+            if planned_size + file_meta["size"] > max_total_size:
+                file_meta["overBudget"] = True
+                continue
+            planned_size += file_meta["size"]
+        to_fetch = [file_meta for file_meta in files_meta if not file_meta["skipped"] and not file_meta.get("overBudget")]
+        fetched = dict(zip((file_meta["path"] for file_meta in to_fetch), await fetch_repo_files_concurrently(client, owner, repo, ref, token, to_fetch)))
+
+    content_chunks, total_content_size = [], 0
+    for file_meta in files_meta:
+        path = file_meta["path"]
+        if file_meta["skipped"]:
+            content_chunks.append(f"{path}\n... [FILE TOO LARGE ({file_meta['size']} bytes), SKIPPED] ...")
+        elif file_meta.get("overBudget"):
+            content_chunks.append(f"{path}\n... [TOTAL CONTENT LIMIT REACHED, FILE SKIPPED] ...")
+        elif fetched.get(path) is not None:  # An empty file is valid content; None marks a failed fetch.
+            content_chunks.append(f"{path}\n{fetched[path]}")
+            total_content_size += len(fetched[path])
+        else:
+            content_chunks.append(f"{path}\n... [Failed to fetch content] ...")
+    return content_chunks, len(files_meta), total_content_size
 
 def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
     if not req.auth:
@@ -143,38 +557,51 @@ def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Organization/User and Repository Name are required.")
 
     auth_token = data.get("gitToken") or get_github_token()
-    files_to_fetch_meta, processed_paths = [], set()
-    try:
-        with httpx.Client() as session:
-            directory = data.get('directory', "")
-            list_repo_files_recursive(session, org_user, repo_name, directory, auth_token, data.get("includeExt", []), data.get("excludeExt", []), files_to_fetch_meta, processed_paths)
-    except Exception as e_list:
-        logger.error(f"Critical error during repo file listing for {org_user}/{repo_name}: {e_list}")
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to list repository files: {str(e_list)}")
-
-    if not files_to_fetch_meta:
-        raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message="No files found matching the specified criteria in the repository.")
-
+    directory = data.get('directory', "")
     content_chunks = []
     total_content_size, MAX_TOTAL_CONTENT_SIZE = 0, 5 * 1024 * 1024
-    with httpx.Client() as session:
-        fetch_tasks = [fetch_repo_file_content(session, org_user, repo_name, file_meta["path"], auth_token) for file_meta in files_to_fetch_meta]
-        fetched_contents = fetch_tasks
-
-    for i, content in enumerate(fetched_contents):
-        file_meta = files_to_fetch_meta[i]
-        if content:
-            if total_content_size + len(content) > MAX_TOTAL_CONTENT_SIZE:
-                content_chunks.append(f"{file_meta['path']}\n... [TOTAL CONTENT LIMIT REACHED, FILE SKIPPED] ...")
-                continue
-            content_chunks.append(f"{file_meta['path']}\n{content}")
-            total_content_size += len(content)
-        else:
-            content_chunks.append(f"{file_meta['path']}\n... [Failed to fetch content] ...")
+    # "archive" (default) streams one tarball; "tree" lists via git/trees and fetches files concurrently,
+    # which is cheaper for sparse directories of large repositories.
+    fetch_mode = data.get("fetchMode", "archive")
+    started_at = time.perf_counter()
+
+    if fetch_mode == "archive":
+        try:
+            with httpx.Client() as session:
+                content_chunks, file_count, total_content_size = collect_repo_files_from_archive(
+                    session, org_user, repo_name, data.get("ref", ""), auth_token, directory,
+                    data.get("includeExt", []), data.get("excludeExt", []), MAX_TOTAL_CONTENT_SIZE
+                )
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message=f"Repository or ref not found: {org_user}/{repo_name}.")
+            logger.error(f"Archive download failed for {org_user}/{repo_name}: {e}")
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to download repository archive: {str(e)}")
+        except Exception as e_archive:
+            logger.error(f"Critical error while reading the archive of {org_user}/{repo_name}: {e_archive}")
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to read repository archive: {str(e_archive)}")
+        if not file_count:
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message="No files found matching the specified criteria in the repository.")
+    else:
+        try:
+            content_chunks, file_count, total_content_size = asyncio.run(collect_repo_files_from_tree(
+                org_user, repo_name, data.get("ref", ""), auth_token, directory,
+                data.get("includeExt", []), data.get("excludeExt", []), MAX_TOTAL_CONTENT_SIZE
+            ))
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message=f"Repository or ref not found: {org_user}/{repo_name}.")
+            logger.error(f"Tree listing failed for {org_user}/{repo_name}: {e}")
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to list repository files: {str(e)}")
+        except Exception as e_list:
+            logger.error(f"Critical error during repo file listing for {org_user}/{repo_name}: {e_list}")
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to list repository files: {str(e_list)}")
+        if not file_count:
+            raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.NOT_FOUND, message="No files found matching the specified criteria in the repository.")
 
     monolithic_content = NEW_FILE_SEPARATOR.join(content_chunks)
     file_name = f"clone_{org_user}_{repo_name}.txt"
-    logger.info(f"Fetched {len(files_to_fetch_meta)} files from {org_user}/{repo_name}, total content size: {total_content_size} bytes.")
+    logger.info(f"Fetched {file_count} files from {org_user}/{repo_name} ({fetch_mode} mode) in {(time.perf_counter() - started_at) * 1000:.0f} ms, total content size: {total_content_size} bytes.")
     return _upload_bytes_to_gcs(
         user_id=req.auth.uid,
         file_bytes=monolithic_content.encode('utf-8'),
@@ -184,19 +611,21 @@ def _fetch_git_repo_contents_logic(req: https_fn.CallableRequest):
     )
 
 # --- PDF Processing ---
+MAX_PDF_CONTENT_LENGTH = 2 * 1024 * 1024
+
 def _process_pdf_content_logic(req: https_fn.CallableRequest):
     if not req.auth:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.UNAUTHENTICATED, message="Authentication required.")
     url, file_data_base64, file_name_from_client = req.data.get("url"), req.data.get("fileData"), req.data.get("fileName")
-    pdf_bytes, pdf_source_name = None, "Uploaded PDF"
+    pdf_source, temp_path, scratch_blob, pdf_source_name = None, None, None, "Uploaded PDF"
     if url:
         pdf_source_name = url.split('/')[-1]
         try:
-            with httpx.Client() as client:
-                response = client.get(url, headers={'User-Agent': 'AgentLab-ContextFetcher/1.0'}, timeout=30)
-                response.raise_for_status()
-                pdf_bytes = response.content
-        except httpx.RequestError as e:
+            # The PDF is streamed to a scratch object and parsed from there with ranged reads, so it is
+            # never held in memory whole. Only the extracted text is kept; the scratch object is deleted below.
+            scratch_blob, _, _ = _stream_url_to_gcs(req.auth.uid, url, pdf_source_name or "document.pdf", MAX_PDF_DOWNLOAD_BYTES, 'application/pdf', persist=False)
+            pdf_source = f"gs://{scratch_blob.bucket.name}/{scratch_blob.name}"
+        except httpx.HTTPError as e:
             raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to fetch PDF from URL: {str(e)}")
     elif file_data_base64:
         pdf_source_name = file_name_from_client or "Uploaded PDF"
@@ -205,17 +634,18 @@ def _process_pdf_content_logic(req: https_fn.CallableRequest):
         except Exception as e:
             logger.error(f"Error decoding base64 PDF data: {e}")
             raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Invalid PDF file data provided.")
+        if pdf_bytes:
+            # Extraction workers are separate processes, so they read uploaded PDFs from a file.
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
+                temp_file.write(pdf_bytes)
+            pdf_source = temp_path = temp_file.name
     else:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT, message="Either PDF URL or file data is required.")
-    if not pdf_bytes:
+    if pdf_source is None:
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message="Could not load PDF data.")
 
     try:
-        reader = PdfReader(io.BytesIO(pdf_bytes))
-        text_content = "".join(page.extract_text() or "" for page in reader.pages)
-        MAX_PDF_CONTENT_LENGTH = 2 * 1024 * 1024
-        if len(text_content) > MAX_PDF_CONTENT_LENGTH:
-            text_content = text_content[:MAX_PDF_CONTENT_LENGTH] + "\n... [PDF CONTENT TRUNCATED]"
+        text_content = extract_pdf_text(pdf_source, MAX_PDF_CONTENT_LENGTH)
         logger.info(f"Extracted {len(text_content)} characters from PDF: {pdf_source_name}")
         return _upload_bytes_to_gcs(
             user_id=req.auth.uid,
@@ -228,6 +658,16 @@ def _process_pdf_content_logic(req: https_fn.CallableRequest):
         if "encrypted" in str(e).lower():
             raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.FAILED_PRECONDITION, message="PDF is encrypted and cannot be processed.")
         raise https_fn.HttpsError(code=https_fn.FunctionsErrorCode.INTERNAL, message=f"Failed to process PDF: {str(e)}")
+    finally:
+        if temp_path:
+            os.remove(temp_path)
+        if scratch_blob is not None:
+            try:
+                scratch_blob.delete()
+            except gcs_exceptions.NotFound:
+                pass
+            except Exception as cleanup_error:
+                logger.warn(f"Could not delete scratch PDF {scratch_blob.name}: {cleanup_error}")
 
     # --- Image Upload ---
 def _upload_image_and_get_uri_logic(req: https_fn.CallableRequest):
@@ -1,36 +1,42 @@
 # functions/handlers/mcp_handler.py
+import os
+import json
+import time
 import asyncio
+import hmac
+import hashlib
+import secrets
 import traceback
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 
 import httpx # Import for specific httpx exceptions
+from firebase_admin import firestore
 from firebase_functions import https_fn
 
-from mcp.client.session import ClientSession
-from mcp.client.sse import sse_client
-from mcp.client.streamable_http import streamablehttp_client
 from mcp.shared.metadata_utils import get_display_name
-from common.core import logger
+from common.core import logger, get_async_db
+from common.mcp_pool import mcp_session_pool
+from common.worker_runtime import worker_runtime
 
+# Each server in a listing gets this long to answer before it is reported as timed out.
+MCP_LIST_TIMEOUT_SEC = float(os.environ.get("MCP_LIST_TIMEOUT_SEC", 20))
+# Tool listings are served from cache (memory, then Firestore) for this long unless refreshed.
+MCP_TOOL_LISTING_TTL_SEC = int(os.environ.get("MCP_TOOL_LISTING_TTL_SEC", 600))
+MCP_TOOL_LISTING_MEMORY_MAX_ENTRIES = 256
+MCP_TOOL_LISTING_COLLECTION = "mcpToolListings"
+# Listing keys are HMACs over the server URL and its credentials, so a readable document ID cannot
+# be used to confirm a guessed token. Set the same secret on every instance to share the Firestore
+# tier; without it each instance uses its own random key and only its memory tier is effective.
+MCP_TOOL_LISTING_KEY_SECRET = os.environ.get("MCP_TOOL_LISTING_KEY_SECRET") or None
+_tool_listing_key_secret = (MCP_TOOL_LISTING_KEY_SECRET or secrets.token_hex(32)).encode("utf-8")
+if MCP_TOOL_LISTING_KEY_SECRET is None:
+    logger.warn("MCP_TOOL_LISTING_KEY_SECRET is not set; MCP tool listings will not be shared across instances.")
+MAX_SERVERS_PER_LISTING = 50
 
-async def _list_mcp_server_tools_logic_async(req: https_fn.CallableRequest):
-    if not req.auth:
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.UNAUTHENTICATED,
-            message="Authentication required to list MCP server tools."
-        )
 
-    server_url = req.data.get("serverUrl")
-    auth_config = req.data.get("auth") # New: Get auth config
-
-    if not server_url or not isinstance(server_url, str):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'serverUrl' is required and must be a string."
-        )
-
-    logger.info(f"Attempting to list tools from MCP server: {server_url}")
-
-    # --- New: Construct headers from auth_config ---
+def _mcp_auth_headers(server_url: str, auth_config: dict | None) -> dict:
+    """Builds request headers from a UI-provided auth config."""
     headers = {}
     if auth_config and isinstance(auth_config, dict):
         auth_type = auth_config.get("type")
@@ -40,48 +46,24 @@ async def _list_mcp_server_tools_logic_async(req: https_fn.CallableRequest):
         elif auth_type == "apiKey" and auth_config.get("key") and auth_config.get("name"):
             headers[auth_config["name"]] = auth_config["key"]
             logger.info(f"Using API Key authentication for {server_url} (Header: {auth_config['name']}).")
+    return headers
 
-    client_kwargs = {"headers": headers} if headers else {}
 
-    if server_url.endswith("/sse"):
-        client_context_manager = sse_client(url=server_url, **client_kwargs)
-        transport_description = "SSE"
-    else:
-        client_context_manager = streamablehttp_client(url=server_url, **client_kwargs)
-        transport_description = "StreamableHTTP"
+def _tool_listing_cache_key(server_url: str, auth_config: dict | None) -> str:
+    """Keyed HMAC of the server URL and its auth config; credentials are never stored or hashed bare."""
+    auth_fingerprint = json.dumps(auth_config, sort_keys=True) if auth_config else ""
+    return hmac.new(_tool_listing_key_secret, f"{server_url}\n{auth_fingerprint}".encode("utf-8"), hashlib.sha256).hexdigest()
 
-    logger.info(f"Attempting to connect to MCP server at {server_url} using {transport_description} client.")
 
-    try:
-        async with client_context_manager as client_streams_tuple:
-            if transport_description == "SSE":
-                read_stream, write_stream = client_streams_tuple
-            else:  # StreamableHTTP
-                read_stream, write_stream, _get_session_id = client_streams_tuple
-
-            logger.info(f"Connection established via {transport_description} client.")
-            async with ClientSession(read_stream, write_stream) as mcp_client:
-                logger.info("Client session established with MCP server.")
-                await mcp_client.initialize()
-
-                mcp_server_tools = await mcp_client.list_tools()
-                logger.info(f"Retrieved {len(mcp_server_tools.tools)} tools from MCP server: {server_url}")
-
-                tools_for_client = []
-                for tool_obj in mcp_server_tools.tools: # tool_obj is of type mcp.types.Tool
-                    tools_for_client.append({
-                        "name": tool_obj.name,
-                        "description": tool_obj.description,
-                        "title": get_display_name(tool_obj), # Use get_display_name here
-                        "input_schema": tool_obj.inputSchema
-                    })
-                logger.info(f"Successfully listed {len(tools_for_client)} tools from MCP server: {server_url}")
-                return {"success": True, "tools": tools_for_client, "serverUrl": server_url}
-
-    except httpx.HTTPStatusError as e: # Specific error for HTTP status issues (4xx, 5xx)
+def _mcp_listing_error(server_url: str, e: Exception) -> https_fn.HttpsError:
+    """Maps a failure while listing tools from an MCP server to an HttpsError."""
+    if isinstance(e, https_fn.HttpsError):
+        return e
+    if isinstance(e, httpx.HTTPStatusError): # Specific error for HTTP status issues (4xx, 5xx)
         logger.error(f"HTTP error {e.response.status_code} while communicating with MCP server at {server_url}: {e.response.text[:200]}")
         # Map HTTP status codes to Firebase error codes more granularly if needed
         firebase_error_code = https_fn.FunctionsErrorCode.UNAVAILABLE
+        msg = f"MCP server at {server_url} returned HTTP status {e.response.status_code}."
         if e.response.status_code == 401 or e.response.status_code == 403:
             firebase_error_code = https_fn.FunctionsErrorCode.PERMISSION_DENIED
             msg = f"Authentication failed for MCP server at {server_url}. Please check your credentials."
@@ -91,9 +73,8 @@ async def _list_mcp_server_tools_logic_async(req: https_fn.CallableRequest):
         elif 500 <= e.response.status_code < 600:
             firebase_error_code = https_fn.FunctionsErrorCode.INTERNAL
             msg = f"MCP server at {server_url} returned server error {e.response.status_code}."
-
-        raise https_fn.HttpsError(code=firebase_error_code, message=msg)
-    except httpx.RequestError as e: # General httpx network errors (ConnectTimeout, ReadTimeout, etc.)
+        return https_fn.HttpsError(code=firebase_error_code, message=msg)
+    if isinstance(e, httpx.RequestError): # General httpx network errors (ConnectTimeout, ReadTimeout, etc.)
         logger.error(f"Network error while communicating with MCP server at {server_url}: {type(e).__name__} - {e}")
         if isinstance(e, httpx.ConnectTimeout):
             code = https_fn.FunctionsErrorCode.DEADLINE_EXCEEDED
@@ -107,32 +88,213 @@ async def _list_mcp_server_tools_logic_async(req: https_fn.CallableRequest):
         else:
             code = https_fn.FunctionsErrorCode.UNAVAILABLE
             msg = f"Network error connecting to MCP server at {server_url}."
-        raise https_fn.HttpsError(code=code, message=msg)
-        # ConnectionRefusedError might be caught by httpx.ConnectError above if httpx is used internally.
+        return https_fn.HttpsError(code=code, message=msg)
+    # ConnectionRefusedError might be caught by httpx.ConnectError above if httpx is used internally.
     # Keeping it for now as a fallback or if other libraries raise it.
-    except ConnectionRefusedError:
+    if isinstance(e, ConnectionRefusedError):
         logger.error(f"Connection refused by MCP server at {server_url}.")
-        raise https_fn.HttpsError(
+        return https_fn.HttpsError(
             code=https_fn.FunctionsErrorCode.UNAVAILABLE,
             message=f"Could not connect to MCP server at {server_url}. Server might be down or URL incorrect."
         )
-        # The generic asyncio.TimeoutError might be less common now with specific httpx timeouts.
-    # It's kept as a fallback.
-    except asyncio.TimeoutError:
+    # Also raised when a server exceeds MCP_LIST_TIMEOUT_SEC.
+    if isinstance(e, asyncio.TimeoutError):
         logger.error(f"A general timeout occurred while communicating with MCP server at {server_url}.")
-        raise https_fn.HttpsError(
+        return https_fn.HttpsError(
             code=https_fn.FunctionsErrorCode.DEADLINE_EXCEEDED,
             message=f"An operation with MCP server at {server_url} timed out."
         )
+    logger.error(f"Error listing tools from MCP server {server_url}: {e}\n{traceback.format_exc()}", exc_info=True)
+    return https_fn.HttpsError(
+        code=https_fn.FunctionsErrorCode.INTERNAL,
+        message=f"An unexpected error occurred while listing tools from MCP server: {str(e)[:200]}"
+    )
+
+
+async def _fetch_mcp_server_tools(server_url: str, headers: dict) -> list[dict]:
+    """Lists a server's tools over a pooled session, bounded by MCP_LIST_TIMEOUT_SEC."""
+    transport_description = "SSE" if server_url.endswith("/sse") else "StreamableHTTP"
+    logger.info(f"Listing tools from MCP server at {server_url} over a pooled {transport_description} session.")
+    # Sessions come from the process-wide pool shared with agent runs, so repeat listings
+    # reuse an initialized session instead of reconnecting.
+    mcp_server_tools = await asyncio.wait_for(
+        mcp_session_pool.run(server_url, headers or None, lambda session: session.list_tools()),
+        MCP_LIST_TIMEOUT_SEC
+    )
+    logger.info(f"Retrieved {len(mcp_server_tools.tools)} tools from MCP server: {server_url}")
+
+    tools_for_client = []
+    for tool_obj in mcp_server_tools.tools: # tool_obj is of type mcp.types.Tool
+        tools_for_client.append({
+            "name": tool_obj.name,
+            "description": tool_obj.description,
+            "title": get_display_name(tool_obj), # Use get_display_name here
+            "input_schema": tool_obj.inputSchema
+        })
+    return tools_for_client
+
+
+class _ToolListingCache:
+    """
+    TTL cache of tool listings keyed by _tool_listing_cache_key. A bounded in-memory tier
+    serves warm instances; the Firestore tier (MCP_TOOL_LISTING_COLLECTION) is shared by all.
+    """
+
+    def __init__(self, ttl_sec: int = MCP_TOOL_LISTING_TTL_SEC, max_memory_entries: int = MCP_TOOL_LISTING_MEMORY_MAX_ENTRIES):
+        self.ttl_sec = ttl_sec
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()  # key -> (expires_at epoch seconds, tools, fetched_at ISO string)
+
+    async def get(self, key: str) -> tuple[list[dict], str] | None:
+        """Returns (tools, fetchedAt) for a fresh entry, or None."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, tools, fetched_at = entry
+            if expires_at > time.time():
+                self._memory.move_to_end(key)
+                return tools, fetched_at
+            del self._memory[key]
+        try:
+            snap = await get_async_db().collection(MCP_TOOL_LISTING_COLLECTION).document(key).get()
+        except Exception as e:
+            logger.warn(f"[MCPToolListingCache] Firestore read failed for {key}: {e}")
+            return None
+        if not snap.exists:
+            return None
+        data = snap.to_dict()
+        expires_at = data.get("expiresAt")
+        if not expires_at or expires_at <= datetime.now(timezone.utc):
+            return None
+        fetched_at = data["fetchedAt"].isoformat() if data.get("fetchedAt") else None
+        self._remember(key, expires_at.timestamp(), data.get("tools", []), fetched_at)
+        return data.get("tools", []), fetched_at
+
+    async def put(self, key: str, server_url: str, tools: list[dict]) -> str:
+        """Stores a fresh listing in both tiers and returns its fetchedAt."""
+        now = datetime.now(timezone.utc)
+        self._remember(key, now.timestamp() + self.ttl_sec, tools, now.isoformat())
+        try:
+            await get_async_db().collection(MCP_TOOL_LISTING_COLLECTION).document(key).set({
+                "serverUrl": server_url,
+                "tools": tools,
+                "fetchedAt": now,
+                "expiresAt": now + timedelta(seconds=self.ttl_sec),
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            })
+        except Exception as e:
+            # The listing itself succeeded; only cross-instance reuse is lost.
+            logger.warn(f"[MCPToolListingCache] Firestore write failed for {server_url}: {e}")
+        return now.isoformat()
+
+    def _remember(self, key, expires_at, tools, fetched_at):
+        self._memory[key] = (expires_at, tools, fetched_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+
+_tool_listing_cache = _ToolListingCache()
+
+
+async def _list_mcp_server_tools_logic_async(req: https_fn.CallableRequest):
+    if not req.auth:
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.UNAUTHENTICATED,
+            message="Authentication required to list MCP server tools."
+        )
+
+    server_url = req.data.get("serverUrl")
+    auth_config = req.data.get("auth") # New: Get auth config
+
+    if not server_url or not isinstance(server_url, str):
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            message="'serverUrl' is required and must be a string."
+        )
+
+    logger.info(f"Attempting to list tools from MCP server: {server_url}")
+    headers = _mcp_auth_headers(server_url, auth_config)
+
+    try:
+        tools_for_client = await _fetch_mcp_server_tools(server_url, headers)
     except Exception as e:
-        logger.error(f"Error listing tools from MCP server {server_url}: {e}\n{traceback.format_exc()}", exc_info=True)
+        raise _mcp_listing_error(server_url, e)
+    # Single-server listings always ask the live server, and refresh the cache on the way out.
+    await _tool_listing_cache.put(_tool_listing_cache_key(server_url, auth_config), server_url, tools_for_client)
+    logger.info(f"Successfully listed {len(tools_for_client)} tools from MCP server: {server_url}")
+    return {"success": True, "tools": tools_for_client, "serverUrl": server_url}
+
+
+async def _list_tools_for_server(server: dict, refresh: bool) -> dict:
+    """Lists one server's tools for a multi-server listing. Failures are returned, not raised."""
+    server_url = server.get("serverUrl") if isinstance(server, dict) else None
+    if not server_url or not isinstance(server_url, str):
+        return {"serverUrl": server_url, "success": False,
+                "error": {"code": https_fn.FunctionsErrorCode.INVALID_ARGUMENT.value, "message": "'serverUrl' is required and must be a string."}}
+    auth_config = server.get("auth")
+    cache_key = _tool_listing_cache_key(server_url, auth_config)
+    if not refresh:
+        cached = await _tool_listing_cache.get(cache_key)
+        if cached is not None:
+            tools, fetched_at = cached
+            return {"serverUrl": server_url, "success": True, "tools": tools, "cached": True, "fetchedAt": fetched_at}
+    try:
+        tools = await _fetch_mcp_server_tools(server_url, _mcp_auth_headers(server_url, auth_config))
+    except Exception as e:
+        error = _mcp_listing_error(server_url, e)
+        return {"serverUrl": server_url, "success": False, "error": {"code": error.code.value, "message": error.message}}
+    fetched_at = await _tool_listing_cache.put(cache_key, server_url, tools)
+    return {"serverUrl": server_url, "success": True, "tools": tools, "cached": False, "fetchedAt": fetched_at}
+
+
+async def _list_mcp_servers_tools_logic_async(req: https_fn.CallableRequest):
+    """
+    Lists tools from several MCP servers concurrently. Expects `servers` (a list of
+    {serverUrl, auth}) and an optional `refresh` flag that bypasses the listing cache.
+    Returns one result per server, in request order, each with either `tools` or `error`.
+    """
+    if not req.auth:
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.UNAUTHENTICATED,
+            message="Authentication required to list MCP server tools."
+        )
+
+    servers = req.data.get("servers")
+    if not isinstance(servers, list) or not servers:
         raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INTERNAL,
-            message=f"An unexpected error occurred while listing tools from MCP server: {str(e)[:200]}"
+            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            message="'servers' is required and must be a non-empty list."
+        )
+    if len(servers) > MAX_SERVERS_PER_LISTING:
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            message=f"At most {MAX_SERVERS_PER_LISTING} servers can be listed per call."
         )
+    refresh = bool(req.data.get("refresh"))
+
+    started_at = time.perf_counter()
+    results = await asyncio.gather(*(_list_tools_for_server(server, refresh) for server in servers))
+    cached_count = sum(1 for result in results if result.get("cached"))
+    failed_count = sum(1 for result in results if not result["success"])
+    logger.info(f"Listed tools from {len(results)} MCP servers in {(time.perf_counter() - started_at) * 1000:.1f} ms "
+                f"({cached_count} from cache, {failed_count} failed, refresh={refresh}).")
+    return {"success": True, "results": results}
+
 
 def _list_mcp_server_tools_logic(req: https_fn.CallableRequest):
-    return asyncio.run(_list_mcp_server_tools_logic_async(req))
+    # Runs on the worker runtime's loop, which owns the pooled MCP sessions.
+    worker_runtime.get_client("mcp_sessions", lambda: mcp_session_pool, close=lambda pool: pool.close())
+    return worker_runtime.run(_list_mcp_server_tools_logic_async(req))
+
+
+def _list_mcp_servers_tools_logic(req: https_fn.CallableRequest):
+    worker_runtime.get_client("mcp_sessions", lambda: mcp_session_pool, close=lambda pool: pool.close())
+    return worker_runtime.run(_list_mcp_servers_tools_logic_async(req))
 
 
-__all__ = ['_list_mcp_server_tools_logic', '_list_mcp_server_tools_logic_async']  
\ No newline at end of file
+__all__ = [
+    '_list_mcp_server_tools_logic',
+    '_list_mcp_server_tools_logic_async',
+    '_list_mcp_servers_tools_logic',
+    '_list_mcp_servers_tools_logic_async',
+]
@@ -10,7 +10,7 @@ from google.cloud.aiplatform_v1beta1.types import ReasoningEngine as ReasoningEn
 from vertexai import agent_engines as deployed_agent_engines
 import os
 
-from common.core import db, logger
+from common.core import db, logger, close_async_db
 from common.config import get_gcp_project_config
 from common.utils import initialize_vertex_ai
 from common.adk_helpers import (
@@ -21,6 +21,13 @@ from common.adk_helpers import (
 
 # --- Deployment Logic ---
 
+async def _instantiate_for_deploy(agent_config_data: dict, parent_adk_name_for_context: str):
+    """Builds the agent tree on this call's short-lived loop and releases that loop's Firestore client."""
+    try:
+        return await instantiate_adk_agent_from_config(agent_config_data, parent_adk_name_for_context=parent_adk_name_for_context)
+    finally:
+        await close_async_db()
+
 def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest):
     agent_config_data = req.data.get("agentConfig")
     agent_doc_id = req.data.get("agentDocId")
@@ -45,10 +52,7 @@ def _deploy_agent_to_vertex_logic(req: https_fn.CallableRequest):
     initialize_vertex_ai()
 
     try:
-        adk_agent = asyncio.run(instantiate_adk_agent_from_config(
-            agent_config_data,
-            parent_adk_name_for_context=f"root_{agent_doc_id[:4]}"
-        ))
+        adk_agent = asyncio.run(_instantiate_for_deploy(agent_config_data, f"root_{agent_doc_id[:4]}"))
         logger.info(f"Root ADK Agent object '{adk_agent.name}' of type {type(adk_agent).__name__} prepared for deployment.")
     except ValueError as e_instantiate:
         error_msg = f"Failed to instantiate agent hierarchy for '{agent_doc_id}' (Original Name: '{original_config_name}'): {str(e_instantiate)}"
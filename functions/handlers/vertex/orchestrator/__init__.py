@@ -43,6 +43,15 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
     effective_parent_id = parent_message_id
     user_message_id = None
 
+    # Each message stores the IDs of its ancestors (root first) so the task executor can load the
+    # history without scanning the chat. Unknown when the parent predates the field; the executor
+    # backfills it on the assistant message in that case.
+    effective_ancestor_ids = []
+    if parent_message_id:
+        parent_snap = messages_col_ref.document(parent_message_id).get()
+        parent_ancestor_ids = parent_snap.to_dict().get("ancestorMessageIds") if parent_snap.exists else None
+        effective_ancestor_ids = parent_ancestor_ids + [parent_message_id] if isinstance(parent_ancestor_ids, list) else None
+
     # Always create a user message if there's text or context.
     # The client constructs the display, the backend just needs to log it.
     if (message_text and message_text.strip()) or (stuffed_context_items and isinstance(stuffed_context_items, list)):
@@ -69,6 +78,8 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
             "childMessageIds": [],
             "timestamp": firestore.SERVER_TIMESTAMP,
         }
+        if effective_ancestor_ids is not None:
+            user_message_data["ancestorMessageIds"] = effective_ancestor_ids
         batch.set(user_message_ref, user_message_data)
 
         if parent_message_id:
@@ -76,6 +87,8 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
             batch.update(parent_message_ref, {"childMessageIds": firestore.ArrayUnion([user_message_id])})
 
         effective_parent_id = user_message_id
+        if effective_ancestor_ids is not None:
+            effective_ancestor_ids = effective_ancestor_ids + [user_message_id]
         logger.info(f"[Orchestrator] Creating user message {user_message_id} for chat {chat_id}.")
 
     assistant_message_ref = messages_col_ref.document()
@@ -90,6 +103,8 @@ def query_deployed_agent_orchestrator_logic(req: https_fn.CallableRequest):
         "parts": [],
         "timestamp": firestore.SERVER_TIMESTAMP,
     }
+    if effective_ancestor_ids is not None:
+        assistant_message_data["ancestorMessageIds"] = effective_ancestor_ids
     batch.set(assistant_message_ref, assistant_message_data)
 
     if effective_parent_id:
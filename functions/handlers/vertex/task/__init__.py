@@ -1,181 +1,433 @@
 # functions/handlers/vertex/task/__init__.py
 import asyncio
+import os
+import threading
+import time
 import traceback
 import json
 import uuid
 from google.cloud import storage
 
 from firebase_admin import firestore
-from common.core import db, logger
-from common.adk_helpers import instantiate_adk_agent_from_config
+from common.core import get_async_db, logger
+from common.blob_cache import context_blob_cache
+from common.worker_runtime import worker_runtime
+from common.agent_cache import agent_tree_cache
+from common.mcp_pool import mcp_session_pool
+from common.rate_limiter import rate_limit_wait_metrics
+from common.hedged_llm import model_backend_metrics
+from common.adk_helpers import get_model_config_from_firestore
+from .event_writer import EventBatchWriter
+from .stream_writer import PartialTextWriter
+from .retrieval import RetrievalSource, build_retrieval_parts, RETRIEVAL_ENABLED, RETRIEVAL_MIN_FILE_TOKENS, RETRIEVAL_TOKEN_BUDGET
+from .response_cache import get_response_cache, is_response_cache_enabled, response_cache_key, RESPONSE_CACHE_TTL_SEC
+from .prompt_budget import (
+    PROMPT_TOKEN_BUDGET, PROMPT_MAX_FILE_PART_TOKENS, PROMPT_RECENT_MESSAGES, IMAGE_PART_TOKEN_ESTIMATE,
+    PROMPT_SUMMARY_MODEL_ID, FALLBACK_SUMMARY_TOKENS, truncate_to_tokens, make_litellm_summarizer
+)
+from common.tokens import estimate_tokens
 from google.genai.types import Content, Part
 from google.adk.runners import Runner
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.adk.sessions import InMemorySessionService
 from google.adk.memory import InMemoryMemoryService
 # CORRECTED IMPORT: Use agent_engines to get a deployed engine
 from vertexai import agent_engines
 import httpx
+import litellm
+from urllib.parse import urlsplit
 from a2a.types import Message as A2AMessage, TextPart
 
 # --- Message History and Prompt Construction ---
 
+# Legacy messages (written before `ancestorMessageIds` existed, or by the UI's addChatMessage)
+# are resolved by walking `parentMessageId` one read at a time. Past this many hops it is cheaper
+# to stream the whole chat once, as the loader used to do. Setting it to 0 forces that full scan,
+# which reproduces the old loader for before/after comparisons of the log line below.
+MAX_PARENT_WALK_BEFORE_SCAN = int(os.environ.get("MAX_PARENT_WALK_BEFORE_SCAN", 50))
+
+async def _fetch_message_ancestry(chat_id: str, leaf_message_id: str) -> tuple[list[str], list[dict]]:
+    """
+    Returns (message_ids, messages) for the chain ending at leaf_message_id, ordered root first.
+    Only the leaf's ancestors are read: the parent chain is walked until a message carrying an
+    `ancestorMessageIds` list is found, and the rest of the chain is fetched with one `get_all`.
+    """
+    async_db = get_async_db()
+    messages_collection = async_db.collection("chats").document(chat_id).collection("messages")
+    started_at = time.perf_counter()
+    reads = 0
+    chain = []  # (id, data) pairs, leaf first
+    stored_ancestor_ids = None
+    strategy = "parent walk"
+    current_id = leaf_message_id
+    while current_id:
+        if len(chain) >= MAX_PARENT_WALK_BEFORE_SCAN:
+            logger.info(f"[TaskExecutor] Parent walk for chat {chat_id} exceeded {MAX_PARENT_WALK_BEFORE_SCAN} hops without an ancestor list. Falling back to a full scan.")
+            strategy = "full scan"
+            all_messages = {}
+            async for doc in messages_collection.stream():
+                all_messages[doc.id] = doc.to_dict()
+                reads += 1
+            while current_id and current_id in all_messages:
+                message = all_messages[current_id]
+                chain.append((current_id, message))
+                current_id = message.get("parentMessageId")
+            break
+        snap = await messages_collection.document(current_id).get()
+        reads += 1
+        if not snap.exists:
+            break
+        message = snap.to_dict()
+        chain.append((current_id, message))
+        stored_ancestor_ids = message.get("ancestorMessageIds")
+        if isinstance(stored_ancestor_ids, list):
+            break
+        current_id = message.get("parentMessageId")
+
+    ancestors = []
+    if stored_ancestor_ids:
+        strategy = "ancestor list"
+        refs = [messages_collection.document(ancestor_id) for ancestor_id in stored_ancestor_ids]
+        fetched = {}
+        async for snap in async_db.get_all(refs):
+            reads += 1
+            if snap.exists:
+                fetched[snap.id] = snap.to_dict()
+        # Mirror the parent walk: a missing ancestor cuts the history off at that point.
+        for ancestor_id in reversed(stored_ancestor_ids):
+            if ancestor_id not in fetched:
+                break
+            ancestors.append((ancestor_id, fetched[ancestor_id]))
+
+    ordered = list(reversed(chain + ancestors))
+    elapsed_ms = (time.perf_counter() - started_at) * 1000
+    logger.info(f"[TaskExecutor] Loaded {len(ordered)} ancestor messages for chat {chat_id} with {reads} document reads in {elapsed_ms:.1f} ms ({strategy}).")
+    return [message_id for message_id, _ in ordered], [message for _, message in ordered]
+
 async def get_full_message_history(chat_id: str, leaf_message_id: str | None) -> list[dict]:
     """Reconstructs the conversation history leading up to a specific message."""
     logger.info(f"[TaskExecutor] Fetching full message history for chat {chat_id} starting from leaf message {leaf_message_id}.")
     if not leaf_message_id:
         logger.info("[TaskExecutor] Leaf message ID is null, returning empty history.")
         return []
-    messages = {}
-    messages_collection = db.collection("chats").document(chat_id).collection("messages")
-    # Fetch all messages in the chat once for efficiency
-    for doc in messages_collection.stream():
-        doc_data = doc.to_dict()
-        messages[doc.id] = doc_data
-
-    logger.info(f"[TaskExecutor] Retrieved {len(messages)} messages from Firestore for chat {chat_id}.")
-    history = []
-    current_id = leaf_message_id
-    while current_id and current_id in messages:
-        message = messages[current_id]
-        history.insert(0, message)
-        current_id = message.get("parentMessageId")
+    _, history = await _fetch_message_ancestry(chat_id, leaf_message_id)
     logger.info(f"[TaskExecutor] Full history reconstructed with {len(history)} messages.")
     return history
 
+# Upper bound on simultaneous GCS downloads while building a prompt.
+CONTEXT_DOWNLOAD_CONCURRENCY = 8
+
+def _get_storage_client() -> storage.Client:
+    """Returns the instance-wide GCS client from the worker runtime's registry."""
+    return worker_runtime.get_client("gcs", storage.Client, close=lambda client: client.close())
+
+def _download_context_part(storage_client: storage.Client, role: str, uri: str, mime_type: str) -> Part | RetrievalSource:
+    """
+    Downloads an image or text file referenced by a gs:// URI and wraps it as an ADK Part. Text
+    files above RETRIEVAL_MIN_FILE_TOKENS come back as a RetrievalSource to be resolved later.
+    """
+    kind = "image" if mime_type.startswith("image/") else "text"
+    if not uri.startswith("gs://"):
+        raise ValueError(f"Unsupported URI scheme for {kind} download: {uri}")
+    bucket_name = uri.split('/')[2]
+    blob_name = '/'.join(uri.split('/')[3:])
+    # A metadata lookup pins the object generation; the bytes for that generation are served
+    # from the warm-instance cache when an earlier turn already downloaded them.
+    blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+    if blob is None:
+        raise ValueError(f"Object not found: {uri}")
+    cache_key = (uri, blob.generation)
+    data = context_blob_cache.get(cache_key)
+    if data is None:
+        data = blob.download_as_bytes(if_generation_match=blob.generation)
+        context_blob_cache.put(cache_key, data)
+    if kind == "image":
+        return Part.from_bytes(data=data, mime_type=mime_type)
+    text_content = data.decode('utf-8')
+    if RETRIEVAL_ENABLED and estimate_tokens(text_content) > RETRIEVAL_MIN_FILE_TOKENS:
+        return RetrievalSource(role, uri, blob, text_content)
+    text_content = truncate_to_tokens(text_content, PROMPT_MAX_FILE_PART_TOKENS, "FILE")
+    return Part.from_text(text=f"{role} uploaded file '{blob_name}':\n{text_content}")
+
+async def _download_context_parts(adk_parts: list, pending_downloads: list[tuple[int, str, str, str]]):
+    """
+    Fetches every queued context file concurrently (bounded by CONTEXT_DOWNLOAD_CONCURRENCY)
+    and writes each resulting Part into its reserved slot in adk_parts, preserving prompt order.
+    """
+    storage_client = _get_storage_client()
+    semaphore = asyncio.Semaphore(CONTEXT_DOWNLOAD_CONCURRENCY)
+
+    async def fetch(index: int, role: str, uri: str, mime_type: str):
+        kind = "image" if mime_type.startswith("image/") else "text"
+        async with semaphore:
+            started_at = time.perf_counter()
+            try:
+                adk_parts[index] = await asyncio.to_thread(_download_context_part, storage_client, role, uri, mime_type)
+                logger.info(f"Successfully downloaded {kind} from {uri} to include in ADK prompt in {(time.perf_counter() - started_at) * 1000:.1f} ms.")
+            except Exception as e:
+                logger.error(f"Failed to download {kind} from GCS URI {uri} for ADK prompt after {(time.perf_counter() - started_at) * 1000:.1f} ms: {e}")
+                adk_parts[index] = Part.from_text(text=f"[{role} Error: Could not load {kind} from {uri}]")
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(fetch(*download) for download in pending_downloads))
+    logger.info(f"[TaskExecutor] Downloaded {len(pending_downloads)} context files in {(time.perf_counter() - started_at) * 1000:.1f} ms (concurrency {CONTEXT_DOWNLOAD_CONCURRENCY}). Blob cache: {context_blob_cache.stats()}")
+
+def _part_token_estimate(part: Part) -> int:
+    if getattr(part, "text", None) is not None:
+        return estimate_tokens(part.text)
+    return IMAGE_PART_TOKEN_ESTIMATE
+
+async def _summarize_older_messages(older_messages: list[tuple[str, str, dict]], message_ids: list[str] | None, summarizer, messages_collection_ref) -> list[str]:
+    """
+    Returns one summary per message. Summaries already stored on the message (`summary`) are
+    reused; new ones are generated concurrently and written back so later turns reuse them.
+    Without a summarizer, long text is truncated instead and nothing is cached.
+    """
+    summaries = [None] * len(older_messages)
+    to_generate = []
+    for index, (role, full_text, message) in enumerate(older_messages):
+        if message.get("summary"):
+            summaries[index] = message["summary"]
+        elif estimate_tokens(full_text) <= FALLBACK_SUMMARY_TOKENS:
+            summaries[index] = full_text
+        elif summarizer is None:
+            summaries[index] = truncate_to_tokens(full_text, FALLBACK_SUMMARY_TOKENS, "TURN")
+        else:
+            to_generate.append(index)
+
+    async def generate(index: int):
+        full_text = older_messages[index][1]
+        try:
+            summary = await summarizer(full_text)
+        except Exception as e:
+            logger.warn(f"[TaskExecutor] Summarizing an earlier turn failed, truncating instead: {e}")
+            summaries[index] = truncate_to_tokens(full_text, FALLBACK_SUMMARY_TOKENS, "TURN")
+            return
+        summaries[index] = summary
+        if message_ids and messages_collection_ref is not None:
+            try:
+                await messages_collection_ref.document(message_ids[index]).update({"summary": summary})
+            except Exception as e:
+                logger.warn(f"[TaskExecutor] Could not cache summary for message {message_ids[index]}: {e}")
+
+    if to_generate:
+        await asyncio.gather(*(generate(index) for index in to_generate))
+        logger.info(f"[TaskExecutor] Generated {len(to_generate)} new turn summaries.")
+    return summaries
+
 async def _build_adk_content_from_history(
-        conversation_history: list[dict]
-) -> tuple[Content, int]:
+        conversation_history: list[dict],
+        message_ids: list[str] | None = None,
+        summarizer=None,
+        messages_collection_ref=None,
+        token_budget: int = PROMPT_TOKEN_BUDGET,
+        retrieval_token_budget: int = RETRIEVAL_TOKEN_BUDGET,
+) -> tuple[Content, int, int]:
     """
-    Constructs a multi-part ADK Content object from the entire conversation history.
-    This content object represents the full context/prompt for the ADK run.
+    Constructs a multi-part ADK Content object from the conversation history, within a token budget.
+    The last PROMPT_RECENT_MESSAGES messages are always verbatim. Older messages stay verbatim
+    while their text fits in the budget; beyond that point they are replaced by summaries
+    (cached per message ID in Firestore) and their files are omitted. File parts are then kept
+    newest first while they fit, and replaced by a marker otherwise. Large text files contribute
+    only their chunks most relevant to the latest user message, within retrieval_token_budget.
+    Returns (content, included text character count, estimated input tokens).
     """
     adk_parts = []
+    # Image and text files are downloaded after the walk, concurrently. Each one reserves a slot
+    # in adk_parts here as (slot index, role, uri, mime_type) so the prompt order is unchanged.
+    pending_downloads = []
     total_char_count = 0
     logger.info(f"[TaskExecutor] Building ADK content from {len(conversation_history)} history messages.")
 
     # The prompt is constructed from the entire conversation history.
     # To preserve turn structure within a single Content object, we process each
     # message and its parts from the history.
+    flattened_messages = []
     for message in conversation_history:
         participant = message.get("participant", "")
         # Determine role for context. "assistant" becomes "model" for the LLM.
         role = "model" if participant.startswith("assistant:") else "user"
-
         # Aggregate all text from the current message into a single string.
         message_texts = [p.get("text", "") for p in message.get("parts", []) if "text" in p]
-        if message_texts:
-            full_text = "\n".join(message_texts).strip()
-            if full_text:
-                # Prepend the role to the text to distinguish turns, as we are flattening history.
-                adk_parts.append(Part.from_text(text=f"{role}: {full_text}"))
-                total_char_count += len(full_text)
-                logger.info(f"Added text from '{role}' to ADK prompt.")
+        full_text = "\n".join(message_texts).strip() if message_texts else ""
+        flattened_messages.append((role, full_text, message))
+
+    # Everything before first_verbatim_index is summarized; the cut is contiguous so the
+    # verbatim tail always reads as an unbroken conversation.
+    first_verbatim_index = max(len(flattened_messages) - PROMPT_RECENT_MESSAGES, 0)
+    verbatim_text_tokens = sum(estimate_tokens(text) for _, text, _ in flattened_messages[first_verbatim_index:])
+    while first_verbatim_index > 0:
+        candidate_tokens = estimate_tokens(flattened_messages[first_verbatim_index - 1][1])
+        if verbatim_text_tokens + candidate_tokens > token_budget:
+            break
+        verbatim_text_tokens += candidate_tokens
+        first_verbatim_index -= 1
+
+    summaries = []
+    if first_verbatim_index > 0:
+        summaries = await _summarize_older_messages(
+            flattened_messages[:first_verbatim_index],
+            message_ids[:first_verbatim_index] if message_ids else None,
+            summarizer, messages_collection_ref
+        )
+        logger.info(f"[TaskExecutor] Summarized {first_verbatim_index} older messages to fit the {token_budget}-token prompt budget.")
+
+    for index, (role, full_text, message) in enumerate(flattened_messages):
+        file_infos = [part_data.get("file_data") or {} for part_data in message.get("parts", []) if "file_data" in part_data]
+        if index < first_verbatim_index:
+            summary = summaries[index]
+            if summary:
+                adk_parts.append(Part.from_text(text=f"{role} (earlier turn, summarized): {summary}"))
+                total_char_count += len(summary)
+            for file_info in file_infos:
+                if file_info.get("file_uri"):
+                    adk_parts.append(Part.from_text(text=f"[{role} attached '{file_info['file_uri'].split('/')[-1]}' in an earlier turn; omitted]"))
+            continue
+
+        if full_text:
+            # Prepend the role to the text to distinguish turns, as we are flattening history.
+            adk_parts.append(Part.from_text(text=f"{role}: {full_text}"))
+            total_char_count += len(full_text)
+            logger.info(f"Added text from '{role}' to ADK prompt.")
 
         # Process file parts separately. They will be associated with the flattened prompt.
-        for part_data in message.get("parts", []):
-            if "file_data" in part_data:
-                file_info = part_data.get("file_data", {})
-                if file_info is None:
-                    file_info = {}
-                uri = file_info.get("file_uri")
-                mime_type = file_info.get("mime_type")
-
-                if uri and mime_type:
-                    # If the part is an image, download its bytes from GCS.
-                    if mime_type.startswith("image/"):
-                        try:
-                            if not uri.startswith("gs://"):
-                                raise ValueError(f"Unsupported URI scheme for image download: {uri}")
-                            bucket_name = uri.split('/')[2]
-                            blob_name = '/'.join(uri.split('/')[3:])
-                            storage_client = storage.Client()
-                            bucket = storage_client.bucket(bucket_name)
-                            blob = bucket.blob(blob_name)
-                            image_bytes = blob.download_as_bytes()
-                            adk_parts.append(Part.from_bytes(data=image_bytes, mime_type=mime_type))
-                            logger.info(f"Successfully downloaded image from {uri} to include in ADK prompt.")
-                        except Exception as e:
-                            logger.error(f"Failed to download image from GCS URI {uri} for ADK prompt: {e}")
-                            adk_parts.append(Part.from_text(text=f"[{role} Error: Could not load image from {uri}]"))
-                    elif mime_type.startswith("text/"):
-                        try:
-                            if not uri.startswith("gs://"):
-                                raise ValueError(f"Unsupported URI scheme for text download: {uri}")
-                            bucket_name = uri.split('/')[2]
-                            blob_name = '/'.join(uri.split('/')[3:])
-                            storage_client = storage.Client()
-                            bucket = storage_client.bucket(bucket_name)
-                            blob = bucket.blob(blob_name)
-                            text_content = blob.download_as_text()
-                            adk_parts.append(Part.from_text(text=f"{role} uploaded file '{blob_name}':\n{text_content}"))
-                            logger.info(f"Successfully downloaded text from {uri} to include in ADK prompt.")
-                        except Exception as e:
-                            logger.error(f"Failed to download text from GCS URI {uri} for ADK prompt: {e}")
-                            adk_parts.append(Part.from_text(text=f"[{role} Error: Could not load text from {uri}]"))
-                    else:
-                        # For other file types (like text from PDF), from_uri is appropriate.
-                        logger.warn(f"[_build_adk_content_from_history] Throwing a hail mary- file_uris don't usually work...  {mime_type} isn't handled yet.")
-                        adk_parts.append(Part.from_uri(file_uri=uri, mime_type=mime_type))
+        for file_info in file_infos:
+            uri = file_info.get("file_uri")
+            mime_type = file_info.get("mime_type")
+
+            if uri and mime_type:
+                if mime_type.startswith("image/") or mime_type.startswith("text/"):
+                    pending_downloads.append((len(adk_parts), role, uri, mime_type))
+                    adk_parts.append(None)
+                else:
+                    # For other file types (like text from PDF), from_uri is appropriate.
+                    logger.warn(f"[_build_adk_content_from_history] Throwing a hail mary- file_uris don't usually work...  {mime_type} isn't handled yet.")
+                    adk_parts.append(Part.from_uri(file_uri=uri, mime_type=mime_type))
+
+    if pending_downloads:
+        await _download_context_parts(adk_parts, pending_downloads)
+        retrieval_slots = [index for index, _, _, _ in pending_downloads if isinstance(adk_parts[index], RetrievalSource)]
+        if retrieval_slots:
+            latest_user_text = next((text for role, text, _ in reversed(flattened_messages) if role == "user" and text), "")
+            try:
+                retrieved_texts = await build_retrieval_parts([adk_parts[index] for index in retrieval_slots], latest_user_text, retrieval_token_budget)
+            except Exception as e:
+                logger.error(f"[TaskExecutor] Retrieval over {len(retrieval_slots)} large files failed; truncating them instead: {e}")
+                retrieved_texts = [f"{adk_parts[index].role} uploaded file '{adk_parts[index].uri.split('/')[-1]}':\n"
+                                   f"{truncate_to_tokens(adk_parts[index].text, PROMPT_MAX_FILE_PART_TOKENS, 'FILE')}" for index in retrieval_slots]
+            for index, text in zip(retrieval_slots, retrieved_texts):
+                adk_parts[index] = Part.from_text(text=text)
+        # Files compete for whatever the text left over, newest first.
+        file_slots = {index for index, _, _, _ in pending_downloads}
+        remaining_tokens = token_budget - sum(_part_token_estimate(part) for index, part in enumerate(adk_parts) if index not in file_slots)
+        for index, role, uri, _ in reversed(pending_downloads):
+            part_tokens = _part_token_estimate(adk_parts[index])
+            if part_tokens <= remaining_tokens:
+                remaining_tokens -= part_tokens
+            else:
+                logger.info(f"[TaskExecutor] Skipping {uri} (~{part_tokens} tokens): prompt token budget exceeded.")
+                adk_parts[index] = Part.from_text(text=f"[{role} file '{uri.split('/')[-1]}' skipped: prompt token budget exceeded]")
 
     if not adk_parts:
         logger.warn("No message parts were created. Adding an empty text part to avoid ADK error.")
         adk_parts.append(Part.from_text(text=""))
 
-    logger.info(f"[TaskExecutor] Built {len(adk_parts)} ADK parts from {len(conversation_history)} messages.")
+    estimated_token_count = sum(_part_token_estimate(part) for part in adk_parts)
+    logger.info(f"[TaskExecutor] Built {len(adk_parts)} ADK parts from {len(conversation_history)} messages (~{estimated_token_count} tokens).")
     # The entire history is flattened into a single 'user' turn. This is necessary
     # given the stateless nature of the task execution.
-    return Content(role="user", parts=adk_parts), total_char_count
+    return Content(role="user", parts=adk_parts), total_char_count, estimated_token_count
 
 # --- Agent/Model Execution Logic ---
 
-async def _run_adk_agent(local_adk_agent, adk_content_for_run, adk_user_id, assistant_message_id, events_collection_ref):
-    """Runs a locally instantiated ADK agent (typically for an API-based model)."""
+# Model-only runs stream partial text into the assistant message's `content` while they run.
+STREAM_MODEL_OUTPUT = os.environ.get("STREAM_MODEL_OUTPUT", "true").lower() != "false"
+
+def _add_prompt_tokens(running_total: int | None, event: dict) -> int | None:
+    """Adds an event's reported prompt token usage (if any) to a running total."""
+    prompt_tokens = (event.get("usage_metadata") or {}).get("prompt_token_count")
+    if prompt_tokens is None:
+        return running_total
+    return (running_total or 0) + prompt_tokens
+
+def _is_final_model_response(event: dict) -> bool:
+    """True for a complete (non-partial) model event that is not a function call."""
+    content = event.get('content') or {}
+    return (
+        content.get('role') == 'model' and
+        not event.get("partial", False) and
+        not any(part.get('function_call') for part in content.get('parts') or [])
+    )
+
+async def _discard_adk_session(runner: Runner, adk_user_id: str, session_id: str):
+    """Removes a finished run's session and artifacts from the shared in-memory ADK services."""
+    try:
+        artifact_keys = await runner.artifact_service.list_artifact_keys(app_name=runner.app_name, user_id=adk_user_id, session_id=session_id)
+        for filename in artifact_keys:
+            await runner.artifact_service.delete_artifact(app_name=runner.app_name, user_id=adk_user_id, session_id=session_id, filename=filename)
+        await runner.session_service.delete_session(app_name=runner.app_name, user_id=adk_user_id, session_id=session_id)
+    except Exception as e:
+        logger.warn(f"[_run_adk_agent] Could not discard ADK session {session_id}: {e}")
+
+async def _run_adk_agent(local_adk_agent, adk_content_for_run, adk_user_id, assistant_message_id, events_collection_ref, stream_to_message_ref=None):
+    """
+    Runs a locally instantiated ADK agent (typically for an API-based model).
+    If stream_to_message_ref is given, the run uses SSE streaming and partial text is mirrored
+    into that message's `content` field as it arrives.
+    """
     from google.adk.artifacts import InMemoryArtifactService
+    # The in-memory ADK services are shared by every run on the instance; each run's session
+    # (and any artifacts it saved) is removed again once the run finishes.
     runner = Runner(
         agent=local_adk_agent,
         app_name=local_adk_agent.name,
-        session_service=InMemorySessionService(),
-        artifact_service=InMemoryArtifactService(),
-        memory_service=InMemoryMemoryService()
+        session_service=worker_runtime.get_client("adk_session_service", InMemorySessionService),
+        artifact_service=worker_runtime.get_client("adk_artifact_service", InMemoryArtifactService),
+        memory_service=worker_runtime.get_client("adk_memory_service", InMemoryMemoryService)
     )
     session = await runner.session_service.create_session(app_name=runner.app_name, user_id=adk_user_id)
 
     errors = []
-    all_events = []
+    final_model_response_event = None
+    input_token_count = None
+    event_writer = EventBatchWriter(events_collection_ref, log_prefix=f"[_run_adk_agent] ({assistant_message_id})")
+    text_writer = None
+    run_config = RunConfig()
+    if stream_to_message_ref is not None:
+        text_writer = PartialTextWriter(stream_to_message_ref, log_prefix=f"[_run_adk_agent] ({assistant_message_id})")
+        run_config = RunConfig(streaming_mode=StreamingMode.SSE)
     try:
-        # Step 1: Collect all events from the runner
+        # Events are persisted in micro-batches while the runner is still producing them.
         async for event_obj in runner.run_async(
                 user_id=adk_user_id,
                 session_id=session.id,
-                new_message=adk_content_for_run
+                new_message=adk_content_for_run,
+                run_config=run_config
         ):
-            all_events.append(event_obj.model_dump())
-            #logger.info(f"[_run_adk_agent] Event collected: {event_obj.model_dump()}")
+            event_dict = event_obj.model_dump()
+            if event_dict.get("partial"):
+                # Partial events carry per-chunk text deltas that the final aggregated event repeats,
+                # so they only feed the streamed preview and are not stored as events.
+                if text_writer:
+                    content = event_dict.get("content") or {}
+                    await text_writer.add("".join(part.get("text") or "" for part in content.get("parts") or []))
+                continue
+            await event_writer.add(event_dict)
+            input_token_count = _add_prompt_tokens(input_token_count, event_dict)
+            if _is_final_model_response(event_dict):
+                final_model_response_event = event_dict
     except Exception as e_run:
         logger.error(f"Error during ADK agent run for '{local_adk_agent.name}': {e_run}\n{traceback.format_exc()}")
         errors.append(f"Agent/Model run failed: {str(e_run)}")
+    try:
+        if text_writer:
+            await text_writer.close()
+        await event_writer.close()
+    finally:
+        # Always released, even if the final flush fails, so the shared session service does not grow.
+        await _discard_adk_session(runner, adk_user_id, session.id)
 
-    #logger.info(f"[_run_adk_agent] Collected {len(all_events)} events from the ADK agent run.")
-    # Step 2: Write all collected events to Firestore in a batch for efficiency
-    batch = db.batch()
-    for index, event_dict in enumerate(all_events):
-        event_doc_ref = events_collection_ref.document()
-        event_with_meta = {**event_dict, "eventIndex": index, "timestamp": firestore.SERVER_TIMESTAMP}
-        batch.set(event_doc_ref, event_with_meta)
-    if all_events:
-        batch.commit()
-
-
-    # Step 3: Find the final response from the collected events
     final_parts = []
-    final_model_response_event = next(
-        (event for event in reversed(all_events) if
-           event.get('content', {}).get('role') == 'model' and
-           not event.get("partial", False) and
-                     not any(part.get('function_call', None) in part for part in event.get('content', {}).get('parts', []))),
-    None
-    )
-
     if final_model_response_event:
         logger.info(f"[_run_adk_agent] Final model response event found: {final_model_response_event}")
         content = final_model_response_event.get("content", {})
@@ -184,15 +436,85 @@ async def _run_adk_agent(local_adk_agent, adk_content_for_run, adk_user_id, assi
     else:
         logger.warn("[_run_adk_agent] No final model response event found in the collected events.")
 
-    return {"finalParts": final_parts, "errorDetails": errors}
+    return {"finalParts": final_parts, "errorDetails": errors, "inputTokenCount": input_token_count}
+
+# Resolved Agent Engine handles are reused across runs on a warm instance for this long.
+VERTEX_ENGINE_HANDLE_TTL_SEC = 600
+
+_vertex_engine_handles = {}  # resource_name -> (handle, resolved_at)
+
+async def _get_vertex_engine(resource_name: str):
+    """Returns a cached `agent_engines.get` handle, resolving it off the event loop when stale."""
+    cached = _vertex_engine_handles.get(resource_name)
+    if cached and time.monotonic() - cached[1] < VERTEX_ENGINE_HANDLE_TTL_SEC:
+        return cached[0]
+    remote_app = await asyncio.to_thread(agent_engines.get, resource_name)
+    _vertex_engine_handles[resource_name] = (remote_app, time.monotonic())
+    return remote_app
+
+async def _iterate_in_thread(make_iterator):
+    """
+    Drives a blocking iterator on its own daemon thread and yields its items on the event loop,
+    so the loop stays free (e.g. to persist events) while the producer waits on the network.
+    A dedicated thread keeps long remote streams from pinning the default executor that
+    asyncio.to_thread relies on. Exceptions raised by the iterator are re-raised in the
+    consumer; when the consumer stops early, the producer stops at the next item and closes
+    the iterator.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+    stop = threading.Event()
+
+    def post(item, error=None):
+        if stop.is_set():
+            return
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            stop.set()  # The loop has closed; nobody is listening any more.
+
+    def produce():
+        iterator = None
+        try:
+            iterator = iter(make_iterator())
+            for item in iterator:
+                if stop.is_set():
+                    break
+                post(item)
+            else:
+                post(done)
+        except Exception as e:
+            post(done, e)
+        finally:
+            close = getattr(iterator, "close", None)
+            if stop.is_set() and close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logger.warn(f"[TaskExecutor] Closing an abandoned stream failed: {e}")
+
+    threading.Thread(target=produce, name="stream-producer", daemon=True).start()
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
 
 async def _run_vertex_agent(resource_name, adk_content_for_run, adk_user_id, assistant_message_id, events_collection_ref):
     """Runs a deployed Vertex AI Reasoning Engine."""
     logger.info(f"Running deployed Vertex agent: {resource_name}")
-    remote_app = agent_engines.get(resource_name)
+    remote_app = await _get_vertex_engine(resource_name)
 
-    all_events = []
     errors = []
+    final_model_response_event = None
+    input_token_count = None
+    event_writer = EventBatchWriter(events_collection_ref, log_prefix=f"[_run_vertex_agent] ({assistant_message_id})")
     try:
         # The deployed `stream_query` endpoint currently accepts a simple string `message`.
         # We must serialize our rich Content object into text for it.
@@ -203,86 +525,164 @@ async def _run_vertex_agent(resource_name, adk_content_for_run, adk_user_id, ass
             if image_count > 0:
                 message_text_for_vertex = f"[Image Content Provided ({image_count})]"
 
-        # Step 1: Collect all events from the runner
-        for event_obj in remote_app.stream_query(
+        # The remote stream is synchronous, so it runs in a worker thread; events are persisted
+        # in micro-batches on the loop while the stream is still producing them.
+        async for event_obj in _iterate_in_thread(lambda: remote_app.stream_query(
                 message=message_text_for_vertex,
                 user_id=adk_user_id,
                 # session_id is now managed by the VertexAiSessionService within the remote_app context
-        ):
+        )):
             if hasattr(event_obj, 'model_dump'): event_dict = event_obj.model_dump()
             else: event_dict = event_obj
 
-            all_events.append(event_dict)
-        logger.info(f"[_run_vertex_agent] Collected {len(all_events)} events from the Vertex agent run.")
+            await event_writer.add(event_dict)
+            input_token_count = _add_prompt_tokens(input_token_count, event_dict)
+            if _is_final_model_response(event_dict):
+                final_model_response_event = event_dict
+        logger.info(f"[_run_vertex_agent] Collected {event_writer.event_count} events from the Vertex agent run.")
 
     except Exception as e:
         error_message = f"Vertex run failed: {str(e)}"
         errors.append(error_message)
         logger.error(f"Error during Vertex engine run: {e}", exc_info=True)
+        # Drop the cached handle in case the engine was redeployed or deleted.
+        _vertex_engine_handles.pop(resource_name, None)
+    await event_writer.close()
 
-
-    # Step 2: Write all collected events to Firestore in a batch
-    batch = db.batch()
-    for index, event_dict in enumerate(all_events):
-        event_doc_ref = events_collection_ref.document()
-        logger.info(f"[_run_vertex_agent] Writing event {index} to Firestore: {event_dict}")
-        event_with_meta = {**event_dict, "eventIndex": index, "timestamp": firestore.SERVER_TIMESTAMP}
-        batch.set(event_doc_ref, event_with_meta)
-    if all_events:
-        batch.commit()
-
-    # Step 3: Find the final response from the collected events
     final_parts = []
-    final_model_response_event = next(
-        (event for event in reversed(all_events) if
-           event.get('content', {}).get('role') == 'model' and
-            not event.get("partial", False) and
-         not any(part.get('function_call', None) in part for part in event.get('content', {}).get('parts', []))),
-        None
-    )
     if final_model_response_event:
         content = final_model_response_event.get("content", {})
         if content and content.get("parts"):
             final_parts = content.get("parts")
 
+    return {"finalParts": final_parts, "errorDetails": errors, "inputTokenCount": input_token_count}
+
+A2A_REQUEST_TIMEOUT_SEC = 120.0
+A2A_CONNECT_TIMEOUT_SEC = 10.0
+
+def _get_a2a_client(endpoint_url: str) -> httpx.AsyncClient:
+    """
+    Returns the pooled HTTP/2-capable client for an A2A endpoint's origin. Clients live in the
+    worker runtime's registry and are bound to its long-lived loop, so connections are reused
+    across runs on a warm instance.
+    """
+    parsed_url = urlsplit(endpoint_url)
+    client_name = f"a2a_httpx:{parsed_url.scheme}://{parsed_url.netloc}"
+    client = worker_runtime.get_client(
+        client_name,
+        lambda: httpx.AsyncClient(http2=True, timeout=httpx.Timeout(A2A_REQUEST_TIMEOUT_SEC, connect=A2A_CONNECT_TIMEOUT_SEC)),
+        close=lambda c: c.aclose(),
+    )
+    if client.is_closed:
+        worker_runtime.discard_client(client_name)
+        return _get_a2a_client(endpoint_url)
+    return client
+
+def _a2a_parts_text(parts: list) -> str:
+    return "".join(part.get("text", "") or part.get("text-delta", "") for part in parts or [] if part.get("text") or part.get("text-delta"))
+
+async def _iter_sse_json(response: httpx.Response):
+    """Yields the JSON payload of each server-sent event in a streaming response."""
+    data_lines = []
+    async for line in response.aiter_lines():
+        if line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+        elif not line.strip() and data_lines:
+            yield json.loads("\n".join(data_lines))
+            data_lines = []
+    if data_lines:
+        yield json.loads("\n".join(data_lines))
+
+async def _stream_a2a_message(client, rpc_endpoint_url, a2a_message, assistant_message_id, events_collection_ref, stream_to_message_ref):
+    """Sends a message with `message/stream` and persists artifact deltas as they arrive."""
+    errors, final_parts = [], []
+    event_writer = EventBatchWriter(events_collection_ref, log_prefix=f"[_run_a2a_agent] ({assistant_message_id})")
+    text_writer = PartialTextWriter(stream_to_message_ref, log_prefix=f"[_run_a2a_agent] ({assistant_message_id})") if stream_to_message_ref is not None else None
+    artifact_texts = {}  # artifactId -> accumulated text, in order of first appearance
+    message_text = ""
+    rpc_payload = {
+        "jsonrpc": "2.0", "method": "message/stream", "id": f"agentlab-stream-{uuid.uuid4().hex}",
+        "params": {"message": a2a_message.model_dump(exclude_none=True)}
+    }
+    try:
+        async with client.stream("POST", rpc_endpoint_url, json=rpc_payload, headers={"Accept": "text/event-stream"}) as response:
+            response.raise_for_status()
+            async for rpc_response in _iter_sse_json(response):
+                if rpc_response.get("error"):
+                    errors.append(f"A2A 'message/stream' error: {rpc_response['error']}")
+                    continue
+                result = rpc_response.get("result")
+                if not result:
+                    continue
+                await event_writer.add({"type": "a2a_stream_event", "source_event": result})
+
+                kind = result.get("kind")
+                if kind == "artifact-update":
+                    artifact = result.get("artifact", {})
+                    artifact_id = artifact.get("artifactId") or f"artifact_{len(artifact_texts)}"
+                    chunk_text = _a2a_parts_text(artifact.get("parts"))
+                    if result.get("append"):
+                        artifact_texts[artifact_id] = artifact_texts.get(artifact_id, "") + chunk_text
+                    else:
+                        artifact_texts[artifact_id] = chunk_text
+                elif kind == "task":
+                    for index, artifact in enumerate(result.get("artifacts") or []):
+                        artifact_texts[artifact.get("artifactId") or f"artifact_{index}"] = _a2a_parts_text(artifact.get("parts"))
+                elif kind == "message" and result.get("role") == "agent":
+                    message_text += _a2a_parts_text(result.get("parts"))
+                if text_writer:
+                    await text_writer.set_text("".join(artifact_texts.values()) or message_text)
+    except Exception as e:
+        logger.error(f"Failed to stream from A2A agent: {e}\n{traceback.format_exc()}")
+        errors.append(f"A2A communication failed: {e}")
+    if text_writer:
+        await text_writer.close()
+    await event_writer.close()
+
+    final_text = "".join(artifact_texts.values()) or message_text
+    if final_text:
+        final_parts.append({"text": final_text})
     return {"finalParts": final_parts, "errorDetails": errors}
 
-async def _run_a2a_agent(participant_config, adk_content_for_run, assistant_message_id, events_collection_ref):
-    """Runs an A2A agent (unary)."""
+async def _run_a2a_agent(participant_config, adk_content_for_run, assistant_message_id, events_collection_ref, stream_to_message_ref=None):
+    """Runs an A2A agent, streaming when its AgentCard advertises `capabilities.streaming`."""
     endpoint_url = participant_config.get("endpointUrl")
     if not endpoint_url:
         raise ValueError("A2A agent config is missing 'endpointUrl'.")
     message_text_for_a2a = "".join([part.text for part in adk_content_for_run.parts if hasattr(part, 'text') and part.text])
     a2a_message = A2AMessage(messageId=str(uuid.uuid4()), role="user", parts=[TextPart(text=message_text_for_a2a)])
     rpc_endpoint_url = endpoint_url.rstrip('/')
+    client = _get_a2a_client(rpc_endpoint_url)
+
+    agent_capabilities = (participant_config.get("agentCard") or {}).get("capabilities") or {}
+    if agent_capabilities.get("streaming"):
+        return await _stream_a2a_message(client, rpc_endpoint_url, a2a_message, assistant_message_id, events_collection_ref, stream_to_message_ref)
+
     errors, final_parts = [], []
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        try:
-            rpc_payload = {
-                "jsonrpc": "2.0", "method": "message/send", "id": f"agentlab-send-{uuid.uuid4().hex}",
-                "params": {"message": a2a_message.model_dump(exclude_none=True)}
-            }
-            response = await client.post(rpc_endpoint_url, json=rpc_payload)
-            response.raise_for_status()
-            rpc_response = response.json()
-            task_result = rpc_response.get("result")
-            if task_result:
-                event_doc_ref = events_collection_ref.document()
-                event_doc_ref.set({"type": "a2a_unary_task_result", "source_event": task_result, "eventIndex": 0, "timestamp": firestore.SERVER_TIMESTAMP})
-
-                final_text = ""
-                for artifact in task_result.get("artifacts", []):
-                    for part in artifact.get("parts", []):
-                        if part.get("text") or part.get("text-delta"):
-                            final_text += part.get("text", "") or part.get("text-delta", "")
-                if final_text:
-                    final_parts.append({"text": final_text})
-
-            elif rpc_response.get("error"):
-                errors.append(f"A2A 'message/send' error: {rpc_response['error']}")
-        except Exception as e:
-            logger.error(f"Failed to communicate with A2A agent: {e}\n{traceback.format_exc()}")
-            errors.append(f"A2A communication failed: {e}")
+    try:
+        rpc_payload = {
+            "jsonrpc": "2.0", "method": "message/send", "id": f"agentlab-send-{uuid.uuid4().hex}",
+            "params": {"message": a2a_message.model_dump(exclude_none=True)}
+        }
+        response = await client.post(rpc_endpoint_url, json=rpc_payload)
+        response.raise_for_status()
+        rpc_response = response.json()
+        task_result = rpc_response.get("result")
+        if task_result:
+            event_doc_ref = events_collection_ref.document()
+            await event_doc_ref.set({"type": "a2a_unary_task_result", "source_event": task_result, "eventIndex": 0, "timestamp": firestore.SERVER_TIMESTAMP})
+
+            final_text = ""
+            for artifact in task_result.get("artifacts", []):
+                final_text += _a2a_parts_text(artifact.get("parts", []))
+            if final_text:
+                final_parts.append({"text": final_text})
+
+        elif rpc_response.get("error"):
+            errors.append(f"A2A 'message/send' error: {rpc_response['error']}")
+    except Exception as e:
+        logger.error(f"Failed to communicate with A2A agent: {e}\n{traceback.format_exc()}")
+        errors.append(f"A2A communication failed: {e}")
     return {"finalParts": final_parts, "errorDetails": errors}
 
 # --- Main Task Handler Logic ---
@@ -293,33 +693,56 @@ async def _execute_agent_run(
 ):
     """The core logic that runs in the background task."""
     logger.info(f"[TaskExecutor] Starting execution for message {assistant_message_id} in chat {chat_id}.")
-    messages_collection_ref = db.collection("chats").document(chat_id).collection("messages")
+    async_db = get_async_db()
+    messages_collection_ref = async_db.collection("chats").document(chat_id).collection("messages")
     assistant_message_ref = messages_collection_ref.document(assistant_message_id)
     events_collection_ref = assistant_message_ref.collection("events")
 
-    assistant_message_snap = assistant_message_ref.get() # .get() is synchronous in python-firestore
+    assistant_message_snap = await assistant_message_ref.get()
     if not assistant_message_snap.exists:
         raise ValueError(f"Assistant message {assistant_message_id} not found.")
 
     parent_message_id = assistant_message_snap.to_dict().get("parentMessageId")
 
-    conversation_history = await get_full_message_history(chat_id, parent_message_id)
+    if parent_message_id:
+        ancestor_message_ids, conversation_history = await _fetch_message_ancestry(chat_id, parent_message_id)
+    else:
+        ancestor_message_ids, conversation_history = [], []
     logger.info(f"[TaskExecutor] Retrieved conversation_history: {conversation_history}")
     logger.info(f"[TaskExecutor] Full conversation history for message {assistant_message_id} retrieved with {len(conversation_history)} messages.")
-    adk_content_for_run, char_count = await _build_adk_content_from_history(
-        conversation_history
-    )
-    logger.info(f"[TaskExecutor] ADK content built with: {adk_content_for_run}")
-    assistant_message_ref.update({"inputCharacterCount": char_count})
 
-    participant_ref = db.collection("agents").document(agent_id) if agent_id else db.collection("models").document(model_id)
-    participant_snap = participant_ref.get()
+    participant_ref = async_db.collection("agents").document(agent_id) if agent_id else async_db.collection("models").document(model_id)
+    participant_snap = await participant_ref.get()
     if not participant_snap.exists: raise ValueError(f"Participant config not found for ID: {agent_id or model_id}")
     participant_config = participant_snap.to_dict()
 
+    # Older turns are summarized with PROMPT_SUMMARY_MODEL_ID if configured, else with the run's own model.
+    summarizer = None
+    if PROMPT_SUMMARY_MODEL_ID:
+        try:
+            summarizer = make_litellm_summarizer(await get_model_config_from_firestore(PROMPT_SUMMARY_MODEL_ID))
+        except ValueError as e:
+            logger.warn(f"[TaskExecutor] Summary model '{PROMPT_SUMMARY_MODEL_ID}' unavailable: {e}")
+    elif model_id:
+        summarizer = make_litellm_summarizer(participant_config)
+
+    adk_content_for_run, char_count, estimated_token_count = await _build_adk_content_from_history(
+        conversation_history,
+        message_ids=ancestor_message_ids,
+        summarizer=summarizer,
+        messages_collection_ref=messages_collection_ref,
+    )
+    logger.info(f"[TaskExecutor] ADK content built with: {adk_content_for_run}")
+    # Persisting the resolved chain lets the next turn in this branch skip the parent walk.
+    await assistant_message_ref.update({
+        "inputCharacterCount": char_count,
+        "estimatedInputTokenCount": estimated_token_count,
+        "ancestorMessageIds": ancestor_message_ids,
+    })
+
     agent_platform = participant_config.get("platform")
     if agent_id and agent_platform == 'a2a':
-        return await _run_a2a_agent(participant_config, adk_content_for_run, assistant_message_id, events_collection_ref)
+        return await _run_a2a_agent(participant_config, adk_content_for_run, assistant_message_id, events_collection_ref, stream_to_message_ref=assistant_message_ref)
     elif agent_id and agent_platform == 'google_vertex':
         logger.info("[TaskExecutor] Running Vertex AI agent.")
         resource_name = participant_config.get("vertexAiResourceName")
@@ -333,8 +756,24 @@ async def _execute_agent_run(
             "name": f"ephemeral_model_run_{model_id[:6]}",
             "agentType": "Agent", "tools": [], "modelId": model_id,
         }
-        local_adk_agent = await instantiate_adk_agent_from_config(model_only_agent_config)
-        outputToReturn = await _run_adk_agent(local_adk_agent, adk_content_for_run, adk_user_id, assistant_message_id, events_collection_ref)
+        # Opt-in per model doc: identical prompts with identical generation parameters reuse an earlier answer.
+        response_cache = get_response_cache() if is_response_cache_enabled(participant_config) else None
+        if response_cache:
+            cache_key = response_cache_key(adk_content_for_run, participant_config, adk_user_id)
+            cached_response = await response_cache.get(cache_key)
+            if cached_response is not None:
+                logger.info(f"[TaskExecutor] Serving message {assistant_message_id} from the response cache.")
+                return {"finalParts": cached_response["finalParts"], "errorDetails": [], "responseCacheHit": True}
+        async with agent_tree_cache.lease(model_only_agent_config) as local_adk_agent:
+            outputToReturn = await _run_adk_agent(
+                local_adk_agent, adk_content_for_run, adk_user_id, assistant_message_id, events_collection_ref,
+                stream_to_message_ref=assistant_message_ref if STREAM_MODEL_OUTPUT else None
+            )
+        if response_cache:
+            outputToReturn["responseCacheHit"] = False
+            if outputToReturn.get("finalParts") and not outputToReturn.get("errorDetails"):
+                ttl_sec = int(participant_config.get("responseCacheTtlSec") or RESPONSE_CACHE_TTL_SEC)
+                await response_cache.put(cache_key, {"finalParts": outputToReturn["finalParts"]}, ttl_sec=ttl_sec)
         logger.info(f"[TaskExecutor] Model run completed for message {assistant_message_id} with: {outputToReturn}")
         return outputToReturn
     logger.info("[TaskExecutor] Failed to run agent.")
@@ -347,9 +786,15 @@ async def _run_agent_task_logic(data: dict):
     chat_id = data.get("chatId")
     assistant_message_id = data.get("assistantMessageId")
     logger.info(f"[TaskHandler] Starting execution for message: {assistant_message_id}")
-    assistant_message_ref = db.collection("chats").document(chat_id).collection("messages").document(assistant_message_id)
+    assistant_message_ref = get_async_db().collection("chats").document(chat_id).collection("messages").document(assistant_message_id)
+    # Time this run spends queued on provider rate limits (model calls and turn summaries).
+    rate_limit_wait = {}
+    rate_limit_wait_metrics.set(rate_limit_wait)
+    # Which backend answered when the model declares hedge targets.
+    backend_metrics = {}
+    model_backend_metrics.set(backend_metrics)
     try:
-        assistant_message_ref.update({"status": "running"})
+        await assistant_message_ref.update({"status": "running"})
         final_state_data = await _execute_agent_run(
             chat_id=chat_id, assistant_message_id=assistant_message_id,
             agent_id=data.get("agentId"), model_id=data.get("modelId"),
@@ -362,13 +807,23 @@ async def _run_agent_task_logic(data: dict):
             "errorDetails": final_state_data.get("errorDetails"),
             "completedTimestamp": firestore.SERVER_TIMESTAMP
         }
-        assistant_message_ref.update(final_update_payload)
+        if final_state_data.get("inputTokenCount") is not None:
+            final_update_payload["inputTokenCount"] = final_state_data["inputTokenCount"]
+        if final_state_data.get("responseCacheHit") is not None:
+            final_update_payload["responseCacheHit"] = final_state_data["responseCacheHit"]
+        if rate_limit_wait.get("waitSec"):
+            final_update_payload["rateLimitWaitMs"] = round(rate_limit_wait["waitSec"] * 1000)
+        if backend_metrics.get("backend"):
+            final_update_payload["modelBackend"] = backend_metrics["backend"]
+            final_update_payload["hedgeWins"] = backend_metrics.get("hedgeWins", 0)
+            final_update_payload["hedgeLatencySavedMs"] = round(backend_metrics.get("latencySavedMs", 0.0))
+        await assistant_message_ref.update(final_update_payload)
         logger.info(f"[TaskHandler] Message {assistant_message_id} completed with status: {final_update_payload['status']}")
     except Exception as e:
         error_msg = f"Unhandled exception in task handler for message {assistant_message_id}: {type(e).__name__} - {e}"
         logger.error(f"{error_msg}\n{traceback.format_exc()}")
         try:
-            assistant_message_ref.update({
+            await assistant_message_ref.update({
                 "status": "error",
                 "errorDetails": firestore.ArrayUnion([f"Task handler exception: {error_msg}"]),
                 "completedTimestamp": firestore.SERVER_TIMESTAMP
@@ -376,6 +831,22 @@ async def _run_agent_task_logic(data: dict):
         except Exception as ee:
             logger.error(f"Failed to update error status for Firestore message {assistant_message_id}: {ee}", exc_info=True)
 
+async def _close_litellm_clients(_litellm_module):
+    close_async_clients = getattr(litellm, "close_litellm_async_clients", None)
+    if close_async_clients:
+        await close_async_clients()
+
 def run_agent_task_wrapper(data: dict):
-    """Synchronous wrapper to be called by the Cloud Task entry point."""
-    asyncio.run(_run_agent_task_logic(data))
\ No newline at end of file
+    """
+    Synchronous wrapper to be called by the Cloud Task entry point. Tasks run on the worker
+    runtime's long-lived loop, so shared clients stay warm between invocations.
+    """
+    started_at = time.perf_counter()
+    # The first task on an instance starts the loop and creates the shared clients; later ones reuse them.
+    warmth = "warm" if worker_runtime.runs else "cold"
+    loop = worker_runtime.loop
+    worker_runtime.get_client("firestore", lambda: get_async_db(loop), close=lambda client: client.close())
+    worker_runtime.get_client("litellm", lambda: litellm, close=_close_litellm_clients)
+    worker_runtime.get_client("mcp_sessions", lambda: mcp_session_pool, close=lambda pool: pool.close())
+    worker_runtime.run(_run_agent_task_logic(data))
+    logger.info(f"[TaskHandler] Task for message {data.get('assistantMessageId')} finished in {(time.perf_counter() - started_at) * 1000:.1f} ms ({warmth} runtime).")
\ No newline at end of file
@@ -0,0 +1,101 @@
+# functions/handlers/vertex/task/event_writer.py
+import asyncio
+import time
+
+from firebase_admin import firestore
+from common.core import get_async_db, logger
+
+# A micro-batch is committed as soon as it holds this many events, or when its oldest event
+# has waited this long, whichever comes first. Firestore caps a single batch at 500 writes.
+EVENT_FLUSH_MAX_EVENTS = 20
+EVENT_FLUSH_MAX_DELAY_SEC = 0.5
+FIRESTORE_MAX_BATCH_WRITES = 500
+
+
+class EventBatchWriter:
+    """
+    Persists run events to an `events` subcollection (an async Firestore reference) while the
+    run is still in progress. Events are numbered with `eventIndex` in arrival order and committed
+    in size- and time-bounded micro-batches; commits are serialized so batches land in index order.
+    A batch whose commit fails is put back at the front of the buffer, so the next flush (or
+    close()) retries it; a failure that persists surfaces from close().
+    """
+
+    def __init__(self, events_collection_ref, log_prefix: str,
+                 max_batch_events: int = EVENT_FLUSH_MAX_EVENTS,
+                 max_delay_sec: float = EVENT_FLUSH_MAX_DELAY_SEC):
+        self.events_collection_ref = events_collection_ref
+        self.log_prefix = log_prefix
+        self.max_batch_events = max(1, min(max_batch_events, FIRESTORE_MAX_BATCH_WRITES))
+        self.max_delay_sec = max_delay_sec
+        self.event_count = 0
+        self._buffer = []
+        self._flush_lock = asyncio.Lock()
+        self._timer_task = None
+        self._started_at = time.perf_counter()
+        self._first_event_persisted_ms = None
+        self._flush_count = 0
+        self._flush_seconds = 0.0
+
+    async def add(self, event_dict: dict):
+        """Queues an event for persistence and flushes if the current batch is full."""
+        self._buffer.append({**event_dict, "eventIndex": self.event_count, "timestamp": firestore.SERVER_TIMESTAMP})
+        self.event_count += 1
+        if len(self._buffer) >= self.max_batch_events:
+            await self.flush()
+        elif self._timer_task is None:
+            self._timer_task = asyncio.create_task(self._flush_after_delay())
+
+    async def flush(self):
+        """Commits all buffered events, in batches of at most FIRESTORE_MAX_BATCH_WRITES."""
+        self._cancel_timer()
+        async with self._flush_lock:
+            while self._buffer:
+                pending = self._buffer[:FIRESTORE_MAX_BATCH_WRITES]
+                self._buffer = self._buffer[FIRESTORE_MAX_BATCH_WRITES:]
+                batch = get_async_db().batch()
+                for event_with_meta in pending:
+                    batch.set(self.events_collection_ref.document(), event_with_meta)
+                flush_started_at = time.perf_counter()
+                try:
+                    await batch.commit()
+                except BaseException:
+                    # Re-queued ahead of anything added meanwhile, so index order is preserved on retry.
+                    self._buffer = pending + self._buffer
+                    raise
+                self._flush_seconds += time.perf_counter() - flush_started_at
+                self._flush_count += 1
+                if self._first_event_persisted_ms is None:
+                    self._first_event_persisted_ms = (time.perf_counter() - self._started_at) * 1000
+                    logger.info(f"{self.log_prefix} First event persisted {self._first_event_persisted_ms:.1f} ms after run start.")
+
+    async def close(self) -> dict:
+        """Flushes any remaining events and returns the writer's metrics."""
+        await self.flush()
+        metrics = {
+            "eventCount": self.event_count,
+            "flushCount": self._flush_count,
+            "firstEventLatencyMs": self._first_event_persisted_ms,
+            "flushEventsPerSec": (self.event_count / self._flush_seconds) if self._flush_seconds else None,
+        }
+        logger.info(f"{self.log_prefix} Persisted events: {metrics}")
+        return metrics
+
+    async def _flush_after_delay(self):
+        try:
+            await asyncio.sleep(self.max_delay_sec)
+            self._timer_task = None
+            await self.flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The batch is back in the buffer; the next flush or close() retries it.
+            logger.warn(f"{self.log_prefix} Timed event flush failed, will retry {len(self._buffer)} events: {e}")
+
+    def _cancel_timer(self):
+        if self._timer_task is not None and self._timer_task is not asyncio.current_task():
+            self._timer_task.cancel()
+        self._timer_task = None
+
+
+__all__ = ['EventBatchWriter']
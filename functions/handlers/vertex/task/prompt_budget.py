@@ -0,0 +1,82 @@
+# functions/handlers/vertex/task/prompt_budget.py
+import os
+import asyncio
+
+import litellm
+from common.core import logger
+from common.adk_helpers import build_litellm_model_kwargs
+from common.rate_limiter import rate_limiter, rate_limit_key, resolve_rate_limits
+from common.tokens import estimate_tokens
+
+# Token budget for the flattened prompt. The most recent messages are always kept verbatim;
+# older messages are kept verbatim while they fit and are otherwise replaced by summaries.
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 120_000))
+PROMPT_RECENT_MESSAGES = int(os.environ.get("PROMPT_RECENT_MESSAGES", 6))
+# A single text file part is truncated to this many tokens before it enters the prompt.
+PROMPT_MAX_FILE_PART_TOKENS = int(os.environ.get("PROMPT_MAX_FILE_PART_TOKENS", 30_000))
+# Flat estimate for an image part; providers bill images by resolution, not by bytes.
+IMAGE_PART_TOKEN_ESTIMATE = 1_000
+# Model used to summarize older turns when the run itself has no model config (agent runs).
+PROMPT_SUMMARY_MODEL_ID = os.environ.get("PROMPT_SUMMARY_MODEL_ID")
+
+SUMMARY_MAX_OUTPUT_TOKENS = 300
+SUMMARY_MAX_INPUT_TOKENS = 8_000
+SUMMARY_CONCURRENCY = 4
+# Without a summarizer, older turns are cut down to this many tokens instead.
+FALLBACK_SUMMARY_TOKENS = 150
+
+SUMMARY_SYSTEM_INSTRUCTION = (
+    "Summarize the following chat message in at most three sentences. Keep names, numbers, "
+    "decisions and open questions. Reply with the summary only."
+)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker_label: str) -> str:
+    """Truncates text to about max_tokens, appending a marker that says how much was dropped."""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}\n... [{marker_label} TRUNCATED: {len(text) - max_chars} characters omitted]"
+
+
+def make_litellm_summarizer(model_config: dict):
+    """
+    Returns an async callable that summarizes a message's text with the given model config,
+    or None if the config cannot be resolved into LiteLLM arguments.
+    """
+    try:
+        model_kwargs = build_litellm_model_kwargs(model_config, "prompt_summarizer", context_for_log="(turn summaries)")
+    except ValueError as e:
+        logger.warn(f"[PromptBudget] Cannot build a summarizer from model config: {e}")
+        return None
+    semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+    rate_limits = resolve_rate_limits(model_config)
+    bucket_key = rate_limit_key(model_config.get("provider"), model_kwargs.get("api_key"))
+
+    async def summarize(text: str) -> str:
+        async with semaphore:
+            if rate_limits:
+                await rate_limiter.acquire(bucket_key, rate_limits, estimate_tokens(text) + SUMMARY_MAX_OUTPUT_TOKENS)
+            response = await litellm.acompletion(
+                messages=[
+                    {"role": "system", "content": SUMMARY_SYSTEM_INSTRUCTION},
+                    {"role": "user", "content": truncate_to_tokens(text, SUMMARY_MAX_INPUT_TOKENS, "MESSAGE")},
+                ],
+                max_tokens=SUMMARY_MAX_OUTPUT_TOKENS,
+                **model_kwargs,
+            )
+        return (response.choices[0].message.content or "").strip()
+
+    return summarize
+
+
+__all__ = [
+    'PROMPT_TOKEN_BUDGET',
+    'PROMPT_RECENT_MESSAGES',
+    'PROMPT_MAX_FILE_PART_TOKENS',
+    'IMAGE_PART_TOKEN_ESTIMATE',
+    'PROMPT_SUMMARY_MODEL_ID',
+    'FALLBACK_SUMMARY_TOKENS',
+    'truncate_to_tokens',
+    'make_litellm_summarizer',
+]
@@ -0,0 +1,201 @@
+# functions/handlers/vertex/task/response_cache.py
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from google.cloud import storage
+from google.api_core import exceptions as gcs_exceptions
+from common.core import logger, get_async_db
+from common.config import get_gcp_project_config
+from common.worker_runtime import worker_runtime
+
+# Response caching is opt-in per model document (`responseCache: true`) and only applies to models
+# with `temperature: 0`, whose answers are meant to be repeatable. Only the fields below, plus the
+# normalized prompt, go into the key; anything else on the model doc can change freely.
+RESPONSE_CACHE_KEY_FIELDS = (
+    "provider", "modelString", "litellm_api_base", "systemInstruction",
+    "temperature", "maxOutputTokens", "topP", "topK", "stopSequences",
+)
+# Where cached responses live: "memory", "firestore" or "gcs".
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_TTL_SEC = int(os.environ.get("RESPONSE_CACHE_TTL_SEC", 3600))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 512))
+# Responses larger than this (serialized) are not cached by any backend.
+RESPONSE_CACHE_MAX_VALUE_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_VALUE_BYTES", 256 * 1024))
+RESPONSE_CACHE_COLLECTION = "responseCache"
+RESPONSE_CACHE_GCS_PREFIX = "response-cache/"
+
+
+def is_response_cache_enabled(model_config: dict) -> bool:
+    if not model_config.get("responseCache"):
+        return False
+    try:
+        deterministic = float(model_config.get("temperature")) == 0
+    except (TypeError, ValueError):
+        deterministic = False
+    if not deterministic:
+        logger.info(f"[ResponseCache] Skipping the cache: it is enabled but temperature is {model_config.get('temperature')!r}, not 0.")
+    return deterministic
+
+
+def response_cache_key(content, model_config: dict, user_id: str) -> str:
+    """
+    Hash of the requesting user, the normalized ADK content and the model doc's generation
+    parameters. Entries are per user, so a shared backend never serves one user's answer to another.
+    """
+    normalized_content = content.model_dump(mode="json", exclude_none=True)
+    generation_params = {field: model_config.get(field) for field in RESPONSE_CACHE_KEY_FIELDS if model_config.get(field) is not None}
+    payload = json.dumps({"user": user_id, "content": normalized_content, "generation": generation_params}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryResponseCache:
+    """Per-instance LRU bounded by RESPONSE_CACHE_MAX_ENTRIES."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at epoch seconds, value)
+
+    async def get(self, key: str) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def put(self, key: str, value: dict, ttl_sec: int):
+        self._entries[key] = (time.time() + ttl_sec, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class FirestoreResponseCache:
+    """Shared across instances; one document per key in RESPONSE_CACHE_COLLECTION."""
+
+    async def get(self, key: str) -> dict | None:
+        snap = await get_async_db().collection(RESPONSE_CACHE_COLLECTION).document(key).get()
+        if not snap.exists:
+            return None
+        data = snap.to_dict()
+        if not data.get("expiresAt") or data["expiresAt"] <= datetime.now(timezone.utc):
+            return None
+        return json.loads(data["value"])
+
+    async def put(self, key: str, value: dict, ttl_sec: int):
+        now = datetime.now(timezone.utc)
+        await get_async_db().collection(RESPONSE_CACHE_COLLECTION).document(key).set({
+            "value": json.dumps(value),
+            "createdAt": now,
+            "expiresAt": now + timedelta(seconds=ttl_sec),
+        })
+
+
+class GcsResponseCache:
+    """
+    Shared across instances; one JSON object per key under RESPONSE_CACHE_GCS_PREFIX. The
+    object holds {"expiresAt": epoch seconds, "value": ...}, so a lookup is a single download.
+    """
+
+    def __init__(self, bucket_name: str | None = None):
+        if not bucket_name:
+            project_id, _, _ = get_gcp_project_config()
+            bucket_name = os.environ.get("RESPONSE_CACHE_GCS_BUCKET") or f"{project_id}-adk-artifacts"
+        self.bucket_name = bucket_name
+
+    def _blob(self, key: str):
+        storage_client = worker_runtime.get_client("gcs", storage.Client, close=lambda client: client.close())
+        return storage_client.bucket(self.bucket_name).blob(f"{RESPONSE_CACHE_GCS_PREFIX}{key}.json")
+
+    def _get_sync(self, key: str) -> dict | None:
+        try:
+            entry = json.loads(self._blob(key).download_as_bytes())
+        except gcs_exceptions.NotFound:
+            return None
+        if not isinstance(entry, dict) or float(entry.get("expiresAt") or 0) <= time.time():
+            return None
+        return entry.get("value")
+
+    def _put_sync(self, key: str, value: dict, ttl_sec: int):
+        entry = {"expiresAt": time.time() + ttl_sec, "value": value}
+        self._blob(key).upload_from_string(json.dumps(entry), content_type="application/json")
+
+    async def get(self, key: str) -> dict | None:
+        return await asyncio.to_thread(self._get_sync, key)
+
+    async def put(self, key: str, value: dict, ttl_sec: int):
+        await asyncio.to_thread(self._put_sync, key, value, ttl_sec)
+
+
+class ResponseCache:
+    """
+    Exact-match cache of model-run results in front of a pluggable backend. Lookups and stores
+    never fail a run: backend errors are logged and treated as misses.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> dict | None:
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            logger.warn(f"[ResponseCache] Lookup failed for {key[:12]}: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        logger.info(f"[ResponseCache] {'Hit' if value is not None else 'Miss'} for {key[:12]} (hits={self.hits}, misses={self.misses}).")
+        return value
+
+    async def put(self, key: str, value: dict, ttl_sec: int = RESPONSE_CACHE_TTL_SEC):
+        size = len(json.dumps(value))
+        if size > RESPONSE_CACHE_MAX_VALUE_BYTES:
+            logger.info(f"[ResponseCache] Not caching {key[:12]}: {size} bytes exceeds {RESPONSE_CACHE_MAX_VALUE_BYTES}.")
+            return
+        try:
+            await self.backend.put(key, value, ttl_sec)
+        except Exception as e:
+            logger.warn(f"[ResponseCache] Store failed for {key[:12]}: {e}")
+
+
+_BACKENDS = {
+    "memory": MemoryResponseCache,
+    "firestore": FirestoreResponseCache,
+    "gcs": GcsResponseCache,
+}
+
+_response_cache = None
+
+def get_response_cache() -> ResponseCache:
+    """Returns the process-wide response cache for RESPONSE_CACHE_BACKEND."""
+    global _response_cache
+    if _response_cache is None:
+        backend_class = _BACKENDS.get(RESPONSE_CACHE_BACKEND)
+        if backend_class is None:
+            logger.warn(f"[ResponseCache] Unknown backend '{RESPONSE_CACHE_BACKEND}'. Falling back to memory.")
+            backend_class = MemoryResponseCache
+        _response_cache = ResponseCache(backend_class())
+    return _response_cache
+
+
+__all__ = [
+    'ResponseCache',
+    'MemoryResponseCache',
+    'FirestoreResponseCache',
+    'GcsResponseCache',
+    'get_response_cache',
+    'is_response_cache_enabled',
+    'response_cache_key',
+    'RESPONSE_CACHE_TTL_SEC',
+]
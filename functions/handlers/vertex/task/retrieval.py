@@ -0,0 +1,281 @@
+# functions/handlers/vertex/task/retrieval.py
+import os
+import re
+import json
+import math
+import time
+import zlib
+import asyncio
+from collections import Counter
+
+import litellm
+from google.cloud import storage
+from common.core import logger
+from common.blob_cache import context_blob_cache
+from common.tokens import estimate_tokens
+
+# Text files larger than RETRIEVAL_MIN_FILE_TOKENS are not pasted into the prompt whole. They are
+# chunked and indexed once (the index is stored next to the object), and each turn includes only
+# the chunks most relevant to the latest user message, up to RETRIEVAL_TOP_K chunks and
+# RETRIEVAL_TOKEN_BUDGET tokens across all of the chat's large files.
+# Indexes are per file rather than per chat: a file's index is reused by every chat and turn that
+# attaches the same object, and adding a file to a chat never invalidates the others. Per turn the
+# files' indexes are loaded concurrently and their chunks ranked together in one scoring pass.
+RETRIEVAL_ENABLED = os.environ.get("RETRIEVAL_ENABLED", "true").lower() != "false"
+RETRIEVAL_MIN_FILE_TOKENS = int(os.environ.get("RETRIEVAL_MIN_FILE_TOKENS", 8_000))
+RETRIEVAL_TOKEN_BUDGET = int(os.environ.get("RETRIEVAL_TOKEN_BUDGET", 12_000))
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", 12))
+RETRIEVAL_CHUNK_TOKENS = int(os.environ.get("RETRIEVAL_CHUNK_TOKENS", 500))
+RETRIEVAL_CHUNK_OVERLAP_TOKENS = int(os.environ.get("RETRIEVAL_CHUNK_OVERLAP_TOKENS", 50))
+# "hashing" (local, no external calls) or "litellm:<embedding model>", e.g. "litellm:text-embedding-3-small".
+RETRIEVAL_EMBEDDER = os.environ.get("RETRIEVAL_EMBEDDER", "hashing")
+RETRIEVAL_INDEX_SUFFIX = ".retrieval-index.json"
+RETRIEVAL_INDEX_VERSION = 1
+
+_WORD_PATTERN = re.compile(r"[a-z0-9_]{2,}")
+
+
+class RetrievalSource:
+    """A downloaded text file that is too large to include whole; resolved into a Part by build_retrieval_parts."""
+
+    def __init__(self, role: str, uri: str, blob: storage.Blob, text: str):
+        self.role = role
+        self.uri = uri
+        self.blob = blob  # Pinned to the generation the text was downloaded from.
+        self.text = text
+
+
+class HashingTfidfEmbedder:
+    """
+    Local stand-in embedder: words are feature-hashed into HASH_BUCKETS buckets and weighted by
+    sublinear TF times IDF over the file's own chunks. Chunk vectors keep their MAX_FEATURES
+    heaviest buckets and are L2-normalized; vectors are {bucket: weight} dicts with string keys
+    so they round-trip through JSON unchanged.
+    """
+
+    name = "hashing-tfidf-v1"
+    HASH_BUCKETS = 1 << 20
+    MAX_FEATURES = 64
+
+    def _term_counts(self, text: str) -> Counter:
+        return Counter(str(zlib.crc32(word.encode("utf-8")) % self.HASH_BUCKETS) for word in _WORD_PATTERN.findall(text.lower()))
+
+    def _embed_documents_sync(self, texts: list[str]) -> list[dict]:
+        counts = [self._term_counts(text) for text in texts]
+        document_frequency = Counter(bucket for term_counts in counts for bucket in term_counts)
+        vectors = []
+        for term_counts in counts:
+            weights = {bucket: (1 + math.log(count)) * (math.log((1 + len(texts)) / (1 + document_frequency[bucket])) + 1)
+                       for bucket, count in term_counts.items()}
+            top = dict(sorted(weights.items(), key=lambda item: item[1], reverse=True)[:self.MAX_FEATURES])
+            norm = math.sqrt(sum(weight * weight for weight in top.values())) or 1.0
+            vectors.append({bucket: round(weight / norm, 4) for bucket, weight in top.items()})
+        return vectors
+
+    async def embed_documents(self, texts: list[str]) -> list[dict]:
+        return await asyncio.to_thread(self._embed_documents_sync, texts)
+
+    async def embed_query(self, text: str) -> dict:
+        return {bucket: 1 + math.log(count) for bucket, count in self._term_counts(text).items()}
+
+    @staticmethod
+    def similarity(query_vector: dict, document_vector: dict) -> float:
+        return sum(weight * query_vector.get(bucket, 0.0) for bucket, weight in document_vector.items())
+
+
+class LiteLlmEmbedder:
+    """Dense embeddings from any LiteLLM embedding model; credentials come from the usual provider env vars."""
+
+    BATCH_SIZE = 64
+
+    def __init__(self, model: str):
+        self.model = model
+        self.name = f"litellm:{model}"
+
+    async def _embed(self, texts: list[str]) -> list[list[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.BATCH_SIZE):
+            response = await litellm.aembedding(model=self.model, input=texts[start:start + self.BATCH_SIZE])
+            for item in response.data:
+                embedding = item["embedding"]
+                norm = math.sqrt(sum(value * value for value in embedding)) or 1.0
+                vectors.append([round(value / norm, 6) for value in embedding])
+        return vectors
+
+    async def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self._embed(texts)
+
+    async def embed_query(self, text: str) -> list[float]:
+        return (await self._embed([text]))[0]
+
+    @staticmethod
+    def similarity(query_vector: list[float], document_vector: list[float]) -> float:
+        return sum(a * b for a, b in zip(query_vector, document_vector))
+
+
+_embedder = None
+
+def get_embedder():
+    """Returns the process-wide embedder for RETRIEVAL_EMBEDDER."""
+    global _embedder
+    if _embedder is None:
+        if RETRIEVAL_EMBEDDER.startswith("litellm:"):
+            _embedder = LiteLlmEmbedder(RETRIEVAL_EMBEDDER.split(":", 1)[1])
+        else:
+            if RETRIEVAL_EMBEDDER != "hashing":
+                logger.warn(f"[Retrieval] Unknown embedder '{RETRIEVAL_EMBEDDER}'. Falling back to hashing.")
+            _embedder = HashingTfidfEmbedder()
+    return _embedder
+
+
+def chunk_text(text: str, chunk_tokens: int = RETRIEVAL_CHUNK_TOKENS, overlap_tokens: int = RETRIEVAL_CHUNK_OVERLAP_TOKENS) -> list[tuple[int, int]]:
+    """
+    Splits text into (start, end) character spans of about chunk_tokens tokens, preferring to
+    end at a blank line, then at a line break, in the second half of each span. Consecutive
+    spans overlap by about overlap_tokens tokens.
+    """
+    chunk_chars, overlap_chars = chunk_tokens * 4, overlap_tokens * 4
+    spans, start = [], 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            floor = start + chunk_chars // 2
+            boundary = text.rfind("\n\n", floor, end)
+            if boundary == -1:
+                boundary = text.rfind("\n", floor, end)
+            if boundary != -1:
+                end = boundary + 1
+        spans.append((start, end))
+        if end >= len(text):
+            break
+        start = max(end - overlap_chars, start + 1)
+    return spans
+
+
+def _index_blob(source: RetrievalSource) -> storage.Blob:
+    return source.blob.bucket.blob(f"{source.blob.name}{RETRIEVAL_INDEX_SUFFIX}")
+
+
+def _load_index_sync(source: RetrievalSource, embedder_name: str) -> dict | None:
+    """Returns the stored index for the source's generation and embedder, or None if it must be (re)built."""
+    index_blob = source.blob.bucket.get_blob(_index_blob(source).name)
+    if index_blob is None:
+        return None
+    cache_key = (f"gs://{index_blob.bucket.name}/{index_blob.name}", index_blob.generation)
+    data = context_blob_cache.get(cache_key)
+    if data is None:
+        data = index_blob.download_as_bytes(if_generation_match=index_blob.generation)
+        context_blob_cache.put(cache_key, data)
+    index = json.loads(data)
+    if (index.get("version") != RETRIEVAL_INDEX_VERSION or index.get("embedder") != embedder_name
+            or index.get("sourceGeneration") != source.blob.generation or index.get("chunkTokens") != RETRIEVAL_CHUNK_TOKENS):
+        return None
+    return index
+
+
+def _store_index_sync(source: RetrievalSource, index: dict):
+    _index_blob(source).upload_from_string(json.dumps(index, separators=(",", ":")), content_type="application/json")
+
+
+async def get_or_build_index(source: RetrievalSource, embedder) -> dict:
+    """Loads the source's index from next to its object, building and storing it on a miss."""
+    try:
+        index = await asyncio.to_thread(_load_index_sync, source, embedder.name)
+    except Exception as e:
+        logger.warn(f"[Retrieval] Could not read the index for {source.uri}, rebuilding: {e}")
+        index = None
+    if index is not None:
+        return index
+
+    started_at = time.perf_counter()
+    # Chunking a multi-megabyte file is CPU-bound; keep it (and hashing embeddings) off the event loop.
+    spans = await asyncio.to_thread(chunk_text, source.text)
+    vectors = await embedder.embed_documents([source.text[start:end] for start, end in spans])
+    index = {
+        "version": RETRIEVAL_INDEX_VERSION,
+        "embedder": embedder.name,
+        "sourceGeneration": source.blob.generation,
+        "chunkTokens": RETRIEVAL_CHUNK_TOKENS,
+        "chunks": [{"start": start, "end": end, "vector": vector} for (start, end), vector in zip(spans, vectors)],
+    }
+    try:
+        await asyncio.to_thread(_store_index_sync, source, index)
+    except Exception as e:
+        # The index is still used for this turn; it is rebuilt next time.
+        logger.warn(f"[Retrieval] Could not store the index for {source.uri}: {e}")
+    logger.info(f"[Retrieval] Indexed {source.uri} into {len(spans)} chunks with {embedder.name} in {(time.perf_counter() - started_at) * 1000:.0f} ms.")
+    return index
+
+
+async def build_retrieval_parts(sources: list[RetrievalSource], query: str, token_budget: int = RETRIEVAL_TOKEN_BUDGET, top_k: int = RETRIEVAL_TOP_K) -> list[str]:
+    """
+    Ranks the chunks of all sources together against the query and returns, per source, the
+    prompt text made of its selected chunks in document order. The first chunk of every file is
+    always taken (budget permitting) so each file keeps its heading context; further chunks are
+    taken by descending score while they fit token_budget, up to top_k in total. Without a query,
+    if ranking fails, or if no chunk shares anything with the query, the earliest chunks are
+    taken instead.
+    """
+    embedder = get_embedder()
+    started_at = time.perf_counter()
+    indexes = await asyncio.gather(*(get_or_build_index(source, embedder) for source in sources))
+
+    candidates = [(source_index, chunk_number, chunk) for source_index, index in enumerate(indexes)
+                  for chunk_number, chunk in enumerate(index["chunks"], start=1)]
+    ranked = list(range(len(candidates)))
+    if query.strip():
+        try:
+            query_vector = await embedder.embed_query(query)
+            scores = [embedder.similarity(query_vector, chunk["vector"]) for _, _, chunk in candidates]
+            # Stable sort, so ties keep file and document order; chunks sharing nothing with the query are dropped.
+            matched = [position for position in sorted(ranked, key=lambda position: scores[position], reverse=True) if scores[position] > 0]
+            if matched:
+                ranked = matched
+            else:
+                logger.info("[Retrieval] No chunk matched the latest message; using leading chunks instead.")
+        except Exception as e:
+            logger.warn(f"[Retrieval] Query embedding failed; using leading chunks instead: {e}")
+
+    selected, selected_count, used_tokens = [[] for _ in sources], 0, 0
+    leading = [position for position, (_, chunk_number, _) in enumerate(candidates) if chunk_number == 1]
+    for position in leading + [position for position in ranked if candidates[position][1] != 1]:
+        # Leading chunks are exempt from top_k so no file is left with nothing at all.
+        if selected_count >= top_k and candidates[position][1] != 1:
+            break
+        source_index, chunk_number, chunk = candidates[position]
+        chunk_tokens = estimate_tokens(sources[source_index].text[chunk["start"]:chunk["end"]])
+        if used_tokens + chunk_tokens > token_budget:
+            continue
+        used_tokens += chunk_tokens
+        selected_count += 1
+        selected[source_index].append((chunk_number, chunk))
+
+    texts = []
+    for source, index, chunks in zip(sources, indexes, selected):
+        file_name = source.uri.split('/')[-1]
+        total_chunks = len(index["chunks"])
+        if not chunks:
+            texts.append(f"[{source.role} file '{file_name}' ({total_chunks} sections) omitted: no section fit within the retrieval budget]")
+            continue
+        sections = "\n\n".join(
+            f"[section {chunk_number}/{total_chunks}]\n{source.text[chunk['start']:chunk['end']].strip()}"
+            for chunk_number, chunk in sorted(chunks, key=lambda selected_chunk: selected_chunk[0])
+        )
+        texts.append(f"{source.role} uploaded file '{file_name}' ({len(chunks)} of {total_chunks} sections, selected for relevance to the latest message):\n{sections}")
+    logger.info(f"[Retrieval] Selected {selected_count} of {len(candidates)} chunks (~{used_tokens} tokens) "
+                f"from {len(sources)} files in {(time.perf_counter() - started_at) * 1000:.0f} ms.")
+    return texts
+
+
+__all__ = [
+    'RetrievalSource',
+    'HashingTfidfEmbedder',
+    'LiteLlmEmbedder',
+    'get_embedder',
+    'chunk_text',
+    'get_or_build_index',
+    'build_retrieval_parts',
+    'RETRIEVAL_ENABLED',
+    'RETRIEVAL_MIN_FILE_TOKENS',
+    'RETRIEVAL_TOKEN_BUDGET',
+]
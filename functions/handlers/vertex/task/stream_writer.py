@@ -0,0 +1,80 @@
+# functions/handlers/vertex/task/stream_writer.py
+import asyncio
+import time
+
+from common.core import logger
+
+# Streamed text is written to the assistant message at most once per interval, unless at
+# least this many new characters have accumulated since the previous write.
+STREAM_FLUSH_INTERVAL_SEC = 0.3
+STREAM_FLUSH_MIN_CHARS = 400
+
+
+class PartialTextWriter:
+    """
+    Coalesces partial text deltas from a streaming run and mirrors the accumulated text into
+    the assistant message's `content` field (an async Firestore reference) with a debounce, so
+    the UI sees progressive output without one Firestore write per token.
+    """
+
+    def __init__(self, message_ref, log_prefix: str,
+                 flush_interval_sec: float = STREAM_FLUSH_INTERVAL_SEC,
+                 flush_min_chars: int = STREAM_FLUSH_MIN_CHARS):
+        self.message_ref = message_ref
+        self.log_prefix = log_prefix
+        self.flush_interval_sec = flush_interval_sec
+        self.flush_min_chars = flush_min_chars
+        self._text = ""
+        self._written_text = ""
+        self._last_write_at = time.perf_counter()
+        self._write_lock = asyncio.Lock()
+        self._timer_task = None
+        self._write_count = 0
+
+    async def add(self, delta: str):
+        """Appends a text delta and writes if the debounce window or character budget is exceeded."""
+        if delta:
+            await self.set_text(self._text + delta)
+
+    async def set_text(self, text: str):
+        """Replaces the accumulated text, for sources that report snapshots rather than deltas."""
+        if text == self._text:
+            return
+        self._text = text
+        since_last_write = time.perf_counter() - self._last_write_at
+        if abs(len(self._text) - len(self._written_text)) >= self.flush_min_chars or since_last_write >= self.flush_interval_sec:
+            await self.flush()
+        elif self._timer_task is None:
+            self._timer_task = asyncio.create_task(self._flush_after(self.flush_interval_sec - since_last_write))
+
+    async def flush(self):
+        """Writes the accumulated text if anything new arrived since the last write."""
+        if self._timer_task is not None and self._timer_task is not asyncio.current_task():
+            self._timer_task.cancel()
+        self._timer_task = None
+        async with self._write_lock:
+            if self._text == self._written_text:
+                return
+            text_snapshot = self._text
+            try:
+                await self.message_ref.update({"content": text_snapshot})
+            except Exception as e:
+                # Streamed text is best-effort; the final parts are still recorded by the task handler.
+                logger.warn(f"{self.log_prefix} Streamed text write failed: {e}")
+                return
+            self._written_text = text_snapshot
+            self._last_write_at = time.perf_counter()
+            self._write_count += 1
+
+    async def close(self):
+        """Writes any remaining text."""
+        await self.flush()
+        logger.info(f"{self.log_prefix} Streamed {len(self._text)} characters in {self._write_count} message writes.")
+
+    async def _flush_after(self, delay_sec: float):
+        await asyncio.sleep(max(delay_sec, 0))
+        self._timer_task = None
+        await self.flush()
+
+
+__all__ = ['PartialTextWriter']
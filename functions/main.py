@@ -22,7 +22,7 @@ from handlers.context_handler import (
     _process_pdf_content_logic,
     _upload_image_and_get_uri_logic
 )
-from handlers.mcp_handler import _list_mcp_server_tools_logic_async
+from handlers.mcp_handler import _list_mcp_server_tools_logic, _list_mcp_servers_tools_logic
 from handlers.a2a_handler import _fetch_a2a_agent_card_logic_async
 
 # --- Cloud Function Definitions ---
@@ -88,7 +88,12 @@ def uploadImageForContext(req: https_fn.CallableRequest):
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=120)
 @handle_exceptions_and_log
 def list_mcp_server_tools(req: https_fn.CallableRequest):
-    return asyncio.run(_list_mcp_server_tools_logic_async(req))
+    return _list_mcp_server_tools_logic(req)
+
+@https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=120)
+@handle_exceptions_and_log
+def list_mcp_servers_tools(req: https_fn.CallableRequest):
+    return _list_mcp_servers_tools_logic(req)
 
 @https_fn.on_call(memory=options.MemoryOption.GB_1, timeout_sec=60)
 @handle_exceptions_and_log
@@ -15,7 +15,7 @@ import VpnKeyIcon from '@mui/icons-material/VpnKey';
 
 import ToolSetupDialog from './ToolSetupDialog';
 import McpAuthDialog from './McpAuthDialog'; // New Auth Dialog
-import { listMcpServerTools } from '../../services/agentService'; // New service import
+import { listMcpServerTools, listMcpServersTools } from '../../services/agentService'; // New service import
 
 
 // PREDEFINED_ADK_FUNCTION_TOOLS removed
@@ -83,6 +83,7 @@ const ToolSelector = ({
     // State now includes auth config for each server
     const [loadedMcpServers, setLoadedMcpServers] = useState([]); // Array of {url, tools, error, loading, auth}
     const [loadingMcpServerUrl, setLoadingMcpServerUrl] = useState(null); // Track which server is loading
+    const [loadingAllMcpServers, setLoadingAllMcpServers] = useState(false);
     const [isMcpAuthDialogOpen, setIsMcpAuthDialogOpen] = useState(false);
     const [serverForAuthSetup, setServerForAuthSetup] = useState(null);
 
@@ -241,6 +242,37 @@ const ToolSelector = ({
         }
     };
 
+    // Once every server has tools, the bulk button refreshes instead of reading the listing cache.
+    const allMcpServersLoaded = loadedMcpServers.length > 0 && loadedMcpServers.every(s => s.tools);
+
+    // Lists every added server in one request; each server succeeds or fails on its own.
+    const handleLoadAllMcpServerTools = async () => {
+        if (loadedMcpServers.length === 0) return;
+        setLoadingAllMcpServers(true);
+        const serversToLoad = loadedMcpServers.map(s => ({ serverUrl: s.url, auth: s.auth }));
+        const refresh = allMcpServersLoaded;
+        setLoadedMcpServers(prev => prev.map(s => ({ ...s, loading: true, error: null })));
+        try {
+            const result = await listMcpServersTools(serversToLoad, { refresh });
+            if (result.success) {
+                const resultsByUrl = new Map(result.results.map(r => [r.serverUrl, r]));
+                setLoadedMcpServers(prev => prev.map(s => {
+                    const serverResult = resultsByUrl.get(s.url);
+                    if (!serverResult) return { ...s, loading: false };
+                    return serverResult.success && Array.isArray(serverResult.tools)
+                        ? { ...s, tools: serverResult.tools, error: null, loading: false }
+                        : { ...s, tools: null, error: serverResult.error?.message || "Failed to load tools.", loading: false };
+                }));
+            } else {
+                setLoadedMcpServers(prev => prev.map(s => ({ ...s, error: result.message || "Failed to load tools.", loading: false })));
+            }
+        } catch (error) {
+            setLoadedMcpServers(prev => prev.map(s => ({ ...s, error: error.message || "An unexpected error occurred.", loading: false })));
+        } finally {
+            setLoadingAllMcpServers(false);
+        }
+    };
+
     const openMcpAuthDialog = (server) => {
         setServerForAuthSetup(server);
         setIsMcpAuthDialogOpen(true);
@@ -483,6 +515,7 @@ const ToolSelector = ({
                     <Box sx={{ display: 'flex', gap: 1, alignItems: 'flex-start', mb: 2}}>
                         <TextField fullWidth label="MCP Server URL" variant="outlined" size="small" value={mcpServerUrlInput} onChange={(e) => setMcpServerUrlInput(e.target.value)} placeholder="e.g., http://localhost:8080 or https://mcp.example.com"/>
                         <Button variant="contained" onClick={handleAddMcpServer} startIcon={<AddCircleOutlineIcon />}>Add Server</Button>
+                        <Button variant="outlined" onClick={handleLoadAllMcpServerTools} disabled={loadedMcpServers.length === 0 || loadingAllMcpServers} startIcon={loadingAllMcpServers ? <CircularProgress size={16}/> : <RefreshIcon/>} sx={{ whiteSpace: 'nowrap' }}>{allMcpServersLoaded ? "Refresh All" : "Load All"}</Button>
                     </Box>
                     <FormHelperText>Add an MCP-compliant server URL to discover its tools. Configure authentication for private servers.</FormHelperText>
 
@@ -496,7 +529,7 @@ const ToolSelector = ({
                                             <VpnKeyIcon />
                                         </IconButton>
                                     </Tooltip>
-                                    <Button size="small" variant="text" onClick={() => handleLoadMcpServerTools(server.url)} disabled={loadingMcpServerUrl === server.url} startIcon={loadingMcpServerUrl === server.url ? <CircularProgress size={16}/> : <RefreshIcon/>}>
+                                    <Button size="small" variant="text" onClick={() => handleLoadMcpServerTools(server.url)} disabled={loadingMcpServerUrl === server.url || loadingAllMcpServers} startIcon={loadingMcpServerUrl === server.url ? <CircularProgress size={16}/> : <RefreshIcon/>}>
                                         {server.tools ? "Reload" : "Load"}
                                     </Button>
                                 </Box>
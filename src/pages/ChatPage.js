@@ -303,6 +303,9 @@ const ChatPage = () => {
                                         }
                                         return null;
                                     })}
+                                    {msg.status === 'running' && !(msg.parts || []).length && msg.content && (
+                                        <ReactMarkdown components={muiMarkdownComponentsConfig} remarkPlugins={[remarkGfm]}>{msg.content}</ReactMarkdown>
+                                    )}
                                     {msg.status === 'running' && (
                                         <Box sx={{ display: 'flex', alignItems: 'center', mt: 1 }}>
                                             <LoadingSpinner small />
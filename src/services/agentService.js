@@ -7,6 +7,7 @@ const executeQueryCallable = createCallable('executeQuery'); // Renamed
 const deleteVertexAgentCallable = createCallable('delete_vertex_agent');
 const checkVertexAgentDeploymentStatusCallable = createCallable('check_vertex_agent_deployment_status');
 const listMcpServerToolsCallable = createCallable('list_mcp_server_tools');
+const listMcpServersToolsCallable = createCallable('list_mcp_servers_tools');
 const fetchA2AAgentCardCallable = createCallable('fetchA2AAgentCard');
 
 export const fetchGofannonTools = async () => {
@@ -51,6 +52,24 @@ export const listMcpServerTools = async (serverUrl, auth) => {
     }
 };
 
+// Lists tools from several MCP servers at once. `servers` is an array of { serverUrl, auth }.
+// Results come back in the same order, each with either `tools` or `error`; pass `refresh`
+// to bypass the server-side listing cache.
+export const listMcpServersTools = async (servers, { refresh = false } = {}) => {
+    try {
+        const result = await listMcpServersToolsCallable({ servers, refresh });
+        if (result.data && result.data.success && Array.isArray(result.data.results)) {
+            return { success: true, results: result.data.results };
+        }
+        console.error("Error listing tools from MCP servers:", result.data);
+        return { success: false, message: result.data?.message || "Failed to list tools from MCP servers." };
+    } catch (error) {
+        console.error("Error calling listMcpServersTools callable:", error);
+        const message = error.details?.message || error.message || "An unexpected error occurred while listing MCP server tools.";
+        return { success: false, message: message };
+    }
+};
+
 export const fetchA2AAgentCard = async (endpointUrl) => {
     try {
        const result = await fetchA2AAgentCardCallable({ endpointUrl });
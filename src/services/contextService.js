@@ -9,7 +9,7 @@ const processPdfContentCallable = createCallable('process_pdf_content');
 export const fetchWebPageContent = async (url) => {
     try {
         const result = await fetchWebPageContentCallable({url});
-        return result.data; // Expected: { success: true, name: string, content: string, type: 'webpage' } or { success: false, message: string }
+        return result.data; // Expected: { success: true, name: string, storageUrl: string, mimeType: string, type: 'webpage', tokenCount?: number } or { success: false, message: string }
     } catch (error) {
         console.error("Error calling fetchWebPageContent callable:", error);
         throw error; // Re-throw to be caught by UI